@@ -4,37 +4,69 @@ import os
 from flask import Flask, g
 from config import Config
 from flask.cli import with_appcontext
+from flask_login import LoginManager
 from flask_mail import Mail
 from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
 import logging
 from logging.handlers import RotatingFileHandler
+import assets
+import authorstats
+import bench
+from cache import page_cache
 from dbase import db
+import deletion
+import feed
+from fulltext import search_index
+import images
+from likes import like_buffer
+from mailqueue import mail_queue
 from models import Comment, PostTag, Tag, User
+from passwords import password_hasher
+from profiler import profiler
+from ratelimit import rate_limiter
+import rendering
+import replicas
+import schema
+import storage
+from tagindex import tag_index
+import transfer
+import trending
+from usercache import user_cache
 
 # Initialize mail
 mail = Mail()
 
+# Initialize the login manager, users are loaded in auth.load_user
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+
 # Custom Jinja filter for converting newline characters to HTML <br> tags
 def nl2br(value):
     """Handles page breaks on the post body"""
     return Markup(value.replace('\n', '<br>\n'))
 
 def get_db():
-    """Initializes a database connection"""
+    """Returns the database session of the current app context.
+
+    Sessions are scoped to the app context, which is per request, and per
+    greenlet under gevent workers, so concurrent requests never share one.
+    """
     if 'db' not in g:
-        g.db = db
+        g.db = db.session()
     return g.db
 
 def close_db(e=None):
-    db = g.pop('db', None)
+    session = g.pop('db', None)
 
-    if db is not None:
+    if session is not None:
         db.session.remove()
 
 def init_db():
     """creates all tables in the database"""
-    db = get_db()
     db.create_all()
+    # The new tables match the latest migration
+    schema.stamp()
 
 @click.command('init-db')
 @with_appcontext
@@ -57,6 +89,7 @@ def create_app():
 
     # Initialize mail with the Flask app
     mail.init_app(app)
+    mail_queue.init_app(app)
 
     # Ensure the instance folder exists
     try:
@@ -64,8 +97,35 @@ def create_app():
     except OSError:
         pass
 
-    # Initialize the database
+    # Initialize the database and its read replicas
     db.init_app(app)
+    replicas.init_app(app)
+
+    # Initialize login sessions and the logged in user cache
+    login_manager.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+
+    # Initialize the full-text search index, the feed projection, the tag index and trending scores
+    search_index.init_app(app)
+    feed.init_app(app)
+    tag_index.init_app(app)
+    trending.init_app(app)
+
+    # Initialize the write-behind like counter
+    like_buffer.init_app(app)
+
+    # Initialize the page and fragment cache
+    page_cache.init_app(app)
+
+    # Initialize the opt-in request profiler
+    profiler.init_app(app)
+
+    # Initialize rate limiting, with the client IP taken from trusted proxies
+    rate_limiter.init_app(app)
+    if app.config['PROXY_COUNT']:
+        count = app.config['PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=count, x_proto=count, x_host=count)
 
     # Register blueprints
     import auth, blog
@@ -73,12 +133,23 @@ def create_app():
     app.register_blueprint(blog.bp)
     app.add_url_rule('/', endpoint='blog.index')
 
-    # Register custom Jinja filter
+    # Register custom Jinja filter, used for posts not rendered at write time yet
     app.jinja_env.filters['nl2br'] = nl2br
+    rendering.init_app(app)
+
+    # Initialize upload storage, the image variant helpers and the built static assets
+    storage.init_app(app)
+    images.init_app(app)
+    assets.init_app(app)
 
-    # Initialize the database command
+    # Initialize the database, data transfer, deletion and benchmark commands
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    schema.init_app(app)
+    transfer.init_app(app)
+    deletion.init_app(app)
+    authorstats.init_app(app)
+    bench.init_app(app)
 
     # Configure logging
     if not app.debug:
@@ -0,0 +1,342 @@
+"""This module builds and serves the static assets.
+
+'flask assets fetch' downloads the pinned Tailwind and jQuery builds the
+pages used to load from CDNs into static/vendor. 'flask assets build'
+then writes every file of the static folder except uploads to static/dist
+under a content-hashed name: Tailwind purged of the classes no template
+or script uses, CSS and JS minified, and text files with precompressed
+.br and .gz siblings. static/dist/manifest.json maps source names to
+built names.
+
+Once built, url_for('static', filename=...) emits the built name, and the
+static view serves the brotli or gzip file the client accepts with
+immutable caching. Vendor files that were never fetched are redirected
+to their CDN, so pages keep working without a build.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import urllib.request
+import click
+from flask import current_app, redirect, request, send_from_directory
+from flask.cli import AppGroup
+from storage import IMMUTABLE
+
+VENDOR = {
+    'vendor/tailwind.min.css': 'https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css',
+    'vendor/jquery.min.js': 'https://ajax.googleapis.com/ajax/libs/jquery/3.5.1/jquery.min.js',
+}
+# Stylesheets purged of the classes the templates do not use
+PURGED = {'vendor/tailwind.min.css'}
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# Top-level static folders that are not assets: uploads and the build itself
+SKIPPED_DIRS = {'public', BUILD_DIR}
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Candidate class names in templates and scripts, as Tailwind's own extractor finds them
+TOKEN_RE = re.compile(r'[^<>"\'`\s]*[^<>"\'`\s:]')
+CLASS_RE = re.compile(r'\.((?:\\[0-9a-fA-F]{1,6} ?|\\.|[\w-])+)')
+ESCAPE_RE = re.compile(r'\\([0-9a-fA-F]{1,6} ?|.)')
+CSS_SKIP_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/', re.S)
+JS_SKIP_RE = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|/\*.*?\*/|//[^\n]*', re.S)
+
+
+def used_tokens(directories):
+    """Returns every token of the HTML and JS files under the directories"""
+    tokens = set()
+    for directory in directories:
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith(('.html', '.js')):
+                    with open(os.path.join(root, name), encoding='utf-8') as f:
+                        tokens.update(TOKEN_RE.findall(f.read()))
+    return tokens
+
+
+def _unescape(match):
+    escaped = match.group(1)
+    if len(escaped) > 1 or escaped in '0123456789abcdefABCDEF':
+        return chr(int(escaped.strip(), 16))
+    return escaped
+
+
+def _class_names(selector):
+    return [ESCAPE_RE.sub(_unescape, name.rstrip()) for name in CLASS_RE.findall(selector)]
+
+
+def _split_selectors(prelude):
+    """Splits a selector list on the commas outside parentheses"""
+    selectors, depth, start = [], 0, 0
+    for i, c in enumerate(prelude):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return selectors
+
+
+def _skip_string(css, i):
+    quote = css[i]
+    i += 1
+    while i < len(css) and css[i] != quote:
+        i += 2 if css[i] == '\\' else 1
+    return i + 1
+
+
+def split_rules(css):
+    """Splits comment-free CSS into (prelude, block) pairs, block being None for statements like @import"""
+    rules, depth, start, opened = [], 0, 0, 0
+    i = 0
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            i = _skip_string(css, i)
+            continue
+        if c == '{':
+            if depth == 0:
+                opened = i
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((css[start:opened].strip(), css[opened + 1:i]))
+                start = i + 1
+        elif c == ';' and depth == 0:
+            rules.append((css[start:i + 1].strip(), None))
+            start = i + 1
+        i += 1
+    return rules
+
+
+def _purge_rules(css, used, keyframes):
+    out = []
+    for prelude, block in split_rules(css):
+        # License comments are kept by strip_comments and end up in front of a prelude
+        while prelude.startswith('/*'):
+            end = prelude.index('*/') + 2
+            out.append(prelude[:end])
+            prelude = prelude[end:].lstrip()
+        if block is None:
+            out.append(prelude)
+        elif prelude.startswith('@'):
+            name = prelude[1:].split(None, 1)[0].lower()
+            if name in ('media', 'supports'):
+                inner = _purge_rules(block, used, keyframes)
+                if inner:
+                    out.append(f'{prelude}{{{inner}}}')
+            elif name.endswith('keyframes'):
+                keyframes.append((prelude.split(None, 1)[1].strip(), f'{prelude}{{{block}}}'))
+            else:
+                out.append(f'{prelude}{{{block}}}')
+        else:
+            # A selector stays when every class it names is used, like PurgeCSS does
+            selectors = [selector for selector in _split_selectors(prelude)
+                         if all(name in used for name in _class_names(selector))]
+            if selectors:
+                out.append(f'{",".join(selectors)}{{{block}}}')
+    return ''.join(out)
+
+
+def purge_css(css, used):
+    """Removes the rules whose selectors name a class that is not in used"""
+    keyframes = []
+    purged = _purge_rules(strip_comments(css, CSS_SKIP_RE), used, keyframes)
+    # Animations of removed rules are removed too
+    return purged + ''.join(text for name, text in keyframes if re.search(rf'\b{re.escape(name)}\b', purged))
+
+
+def strip_comments(source, pattern):
+    """Removes the comments matched by pattern, except /*! license comments, leaving strings alone"""
+    def replace(match):
+        text = match.group()
+        if text.startswith('//') or (text.startswith('/*') and not text.startswith('/*!')):
+            return ''
+        return text
+    return pattern.sub(replace, source)
+
+
+def minify_css(css):
+    """Removes comments and the whitespace CSS does not need"""
+    css = strip_comments(css, CSS_SKIP_RE)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """Removes comments, indentation and blank lines.
+
+    Line breaks are kept, so automatic semicolon insertion still applies.
+    Regular expression literals containing quotes or // are not
+    recognized, so only hand-written scripts should go through this.
+    """
+    js = strip_comments(js, JS_SKIP_RE)
+    return '\n'.join(line.strip() for line in js.splitlines() if line.strip())
+
+
+def _compressors():
+    compressors = [('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        click.echo('brotli is not installed, skipping the .br files.', err=True)
+    else:
+        compressors.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+    return compressors
+
+
+def asset_sources(static_folder):
+    """Yields the static folder's asset names, e.g. 'scripts/blog.js'"""
+    for root, dirs, names in os.walk(static_folder):
+        relative = os.path.relpath(root, static_folder)
+        if relative == '.':
+            dirs[:] = [name for name in dirs if name not in SKIPPED_DIRS and not name.startswith('.')]
+        for name in sorted(names):
+            if not name.startswith('.'):
+                yield os.path.normpath(os.path.join(relative, name)).replace(os.sep, '/')
+
+
+def build(static_folder, template_folders):
+    """Builds every asset into static_folder/dist, returns {source name: sizes in bytes}"""
+    used = used_tokens(list(template_folders) + [os.path.join(static_folder, 'scripts')])
+    staging = tempfile.mkdtemp(dir=static_folder, prefix='.dist-')
+    compressors = _compressors()
+    manifest, report = {}, {}
+    for source in asset_sources(static_folder):
+        with open(os.path.join(static_folder, source), 'rb') as f:
+            data = f.read()
+        sizes = {'source': len(data)}
+        stem, ext = os.path.splitext(source)
+        kind = ext.lower()
+        if source in PURGED:
+            data = purge_css(data.decode('utf-8'), used).encode('utf-8')
+        if kind == '.css':
+            data = minify_css(data.decode('utf-8')).encode('utf-8')
+        elif kind == '.js' and not source.endswith('.min.js'):
+            data = minify_js(data.decode('utf-8')).encode('utf-8')
+        name = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        target = os.path.join(staging, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        sizes['built'] = len(data)
+        if kind in COMPRESSIBLE:
+            for encoding, suffix, compress in compressors:
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    with open(target + suffix, 'wb') as f:
+                        f.write(compressed)
+                    sizes[encoding] = len(compressed)
+        manifest[source] = f'{BUILD_DIR}/{name}'
+        report[source] = sizes
+    with open(os.path.join(staging, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    build_dir = os.path.join(static_folder, BUILD_DIR)
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    os.replace(staging, build_dir)
+    return report
+
+
+def load_manifest(static_folder):
+    """Returns the source -> built name mapping of the last build, empty without one"""
+    try:
+        with open(os.path.join(static_folder, BUILD_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _built_url(endpoint, values):
+    """Points url_for('static', filename=...) at the built file"""
+    if endpoint == 'static':
+        built = current_app.extensions['assets'].get(values.get('filename'))
+        if built is not None:
+            values['filename'] = built
+
+
+def serve_static(filename):
+    """Serves a static file, a built one precompressed when the client accepts it"""
+    app = current_app
+    if filename.startswith(f'{BUILD_DIR}/'):
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = app.send_static_file(filename)
+        # Built names change with their content
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+    if filename in VENDOR and not os.path.isfile(os.path.join(app.static_folder, filename)):
+        return redirect(VENDOR[filename])
+    return app.send_static_file(filename)
+
+
+def init_app(app):
+    """Loads the build manifest, and links to and serves the built assets"""
+    app.config.setdefault('ASSETS_USE_BUILD', True)
+    manifest = load_manifest(app.static_folder) if app.config['ASSETS_USE_BUILD'] else {}
+    app.extensions['assets'] = manifest
+    app.url_defaults(_built_url)
+    app.view_functions['static'] = serve_static
+    app.cli.add_command(assets_cli)
+
+
+assets_cli = AppGroup('assets', help='Fetch, purge, minify, fingerprint and compress the static assets.')
+
+
+@assets_cli.command('fetch')
+@click.option('--force', is_flag=True, help='Download the vendor files again.')
+def fetch_command(force):
+    """Download the pinned vendor files into static/vendor."""
+    for name, url in VENDOR.items():
+        path = os.path.join(current_app.static_folder, name)
+        if os.path.isfile(path) and not force:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        click.echo(f'Fetched {name} ({len(data)} bytes)')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Build the static assets into static/dist and write its manifest."""
+    app = current_app
+    missing = [name for name in VENDOR if not os.path.isfile(os.path.join(app.static_folder, name))]
+    if missing:
+        click.echo(f'Missing {", ".join(missing)}, run "flask assets fetch" to self-host them.', err=True)
+    template_folders = [os.path.join(app.root_path, app.template_folder)]
+    template_folders += [os.path.join(bp.root_path, bp.template_folder)
+                         for bp in app.blueprints.values() if bp.template_folder]
+    report = build(app.static_folder, template_folders)
+    fields = ('source', 'built', 'gzip', 'br')
+    click.echo(f'{"asset":40} ' + ' '.join(f'{field:>10}' for field in fields))
+    # Stylesheets and scripts are what every page waits for
+    code = {name: sizes for name, sizes in sorted(report.items())
+            if os.path.splitext(name)[1].lower() in ('.css', '.js')}
+    code['total'] = {field: sum(sizes.get(field, sizes['built']) for sizes in code.values()) for field in fields}
+    for name, sizes in code.items():
+        click.echo(f'{name:40} ' + ' '.join(f'{sizes.get(field, "-"):>10}' for field in fields))
+    click.echo(f'Built {len(report)} assets into {os.path.join(app.static_folder, BUILD_DIR)}.')
@@ -5,18 +5,26 @@ import os
 from dbase import db
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 from flask import Blueprint, flash, g, redirect, render_template, request, session, url_for, jsonify, current_app as app
-from flask_mail import Message
 from flask_login import login_user, logout_user, login_required, current_user
-from __init__ import mail
+from __init__ import login_manager
+from mailqueue import mail_queue
 from models import User
-from werkzeug.security import check_password_hash, generate_password_hash
+from passwords import password_hasher
+from ratelimit import rate_limiter
+from usercache import user_cache
 
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 s = URLSafeTimedSerializer('Thisisasecret!')
 
 
+def submitted_email():
+    """Rate limit key of the account a form is about, whatever IP it comes from"""
+    return request.form.get('email', '').strip().lower()
+
+
 @bp.route('/signup', methods=('GET', 'POST'))
+@rate_limiter.limit('10/hour')
 def signup():
     """Registers a new user"""
     if request.method == 'POST':
@@ -47,7 +55,7 @@ def signup():
                 error = f"User {username} or email {email} is already registered."
             else:
                 # Create a new user object and add it to the database
-                new_user = User(username=username, email=email, password=generate_password_hash(password))
+                new_user = User(username=username, email=email, password=password_hasher.hash(password))
                 db.session.add(new_user)
                 db.session.commit()
                 return redirect(url_for("auth.login"))
@@ -57,6 +65,8 @@ def signup():
     return render_template('signup.html')
 
 @bp.route('/login', methods=('GET', 'POST'))
+@rate_limiter.limit('20/minute')
+@rate_limiter.limit('5/minute', key=submitted_email)
 def login():
     """Logs in the user."""
     if request.method == 'POST':
@@ -75,10 +85,17 @@ def login():
 
             if user is None:
                 error = 'Incorrect email or password.'
-            elif not check_password_hash(user.password, password):
-                error = 'Incorrect email or password.'
+            else:
+                matches, upgraded = password_hasher.verify(user.password, password)
+                if not matches:
+                    error = 'Incorrect email or password.'
 
         if error is None:
+            if upgraded is not None:
+                # Stored with an older method or cost, replaced now the password is known
+                user.password = upgraded
+                db.session.commit()
+                user_cache.invalidate(user.id)
             login_user(user)
             return redirect(url_for('blog.index'))
         else:
@@ -87,6 +104,8 @@ def login():
     return render_template('login.html')
 
 @bp.route('/forgot_password', methods=['GET', 'POST'])
+@rate_limiter.limit('10/hour')
+@rate_limiter.limit('3/hour', key=submitted_email)
 def forgot_password():
     if request.method == 'GET':
         return render_template('forgot_password.html')
@@ -105,14 +124,16 @@ def forgot_password():
     # If it does, proceed to generate a token and send the email
     token = s.dumps(email, salt='email-confirm-salt')
 
-    msg = Message('Password Reset Request', sender=os.getenv('MAIL_USERNAME'), recipients=[email])
+    # Queued instead of sent inline, so the response does not wait on SMTP
     link = url_for('auth.reset_password', token=token, _external=True)
-    msg.body = 'Your link to reset your password is {}'.format(link)
-    mail.send(msg)
+    mail_queue.enqueue('Password Reset Request', [email],
+                       'Your link to reset your password is {}'.format(link),
+                       sender=os.getenv('MAIL_USERNAME'))
 
     return jsonify({'message': 'Please check your email for a password reset link.'}), 200
 
 @bp.route('/reset_password/<token>', methods=['GET', 'POST'])
+@rate_limiter.limit('10/hour')
 def reset_password(token):
     try:
         email = s.loads(token, salt='email-confirm-salt', max_age=3600)
@@ -132,9 +153,10 @@ def reset_password(token):
         if new_password is None:
             return jsonify({'message': 'Password is required.'}), 400
 
-        hashed_password = generate_password_hash(new_password)
+        hashed_password = password_hasher.hash(new_password)
         user.password = hashed_password
         db.session.commit()
+        user_cache.invalidate(user.id)
 
         # Notify user
         return jsonify({'message': 'Password has been reset successfully, please login.'}), 200
@@ -142,8 +164,13 @@ def reset_password(token):
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Loads the user object from the database"""
-    return User.query.get(int(user_id))
+    """Loads the logged in user from the user cache, falling back to the database"""
+    return user_cache.get(int(user_id))
+
+@bp.before_app_request
+def load_logged_in_user():
+    """Exposes the logged in user to templates as g.user"""
+    g.user = current_user if current_user.is_authenticated else None
 
 @bp.route('/logout')
 @login_required
@@ -0,0 +1,154 @@
+"""This module maintains the per-author totals shown on profile pages.
+
+author_stats holds, for every author, the number of published posts and
+drafts and the likes and comments their posts received. The views and
+jobs that change those numbers add their deltas with an UPDATE inside
+their own transaction, so the profile reads one row instead of counting.
+Rows are created on the first change of an author, and 'flask
+author-stats-rebuild' recomputes every row from the posts and comments.
+"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, delete, func, insert, select
+from dbase import db, insert_ignore
+from models import AuthorStats, Comment, Post, User
+
+COUNTERS = ('post_count', 'draft_count', 'like_count', 'comment_count')
+
+
+def status_counter(status):
+    """Returns the counter a post with a status counts towards"""
+    return 'post_count' if status == 'published' else 'draft_count'
+
+
+def _update(user_id, deltas):
+    stats = AuthorStats.__table__
+    values = {name: stats.c[name] + delta for name, delta in deltas.items()}
+    return db.session.execute(stats.update().where(stats.c.user_id == user_id).values(values)).rowcount
+
+
+def _create_and_update(user_id, deltas):
+    db.session.execute(insert_ignore(AuthorStats, [{'user_id': user_id}], 'user_id'))
+    _update(user_id, deltas)
+
+
+def adjust(user_id, **deltas):
+    """Adds deltas to the counters of an author inside the caller's transaction"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if deltas and not _update(user_id, deltas):
+        _create_and_update(user_id, deltas)
+
+
+def adjust_post_author(post_id, **deltas):
+    """Adds deltas to the counters of the author of a post inside the caller's transaction"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    author_id = select(Post.author_id).where(Post.id == post_id).scalar_subquery()
+    if deltas and not _update(author_id, deltas):
+        author_id = db.session.scalar(select(Post.author_id).where(Post.id == post_id))
+        if author_id is not None:
+            # The row is known to be missing, so skip adjust's first UPDATE
+            _create_and_update(author_id, deltas)
+
+
+def adjust_many(deltas):
+    """Adds {user id: {counter: delta}} inside the caller's transaction with one executemany UPDATE"""
+    deltas = {user_id: counters for user_id, counters in deltas.items() if any(counters.values())}
+    if not deltas:
+        return
+    user_ids = sorted(deltas)
+    # Rows missing when only subtracting would have nothing to subtract from
+    missing = [{'user_id': user_id} for user_id in user_ids if max(deltas[user_id].values()) > 0]
+    if missing:
+        db.session.execute(insert_ignore(AuthorStats, missing, 'user_id'))
+    stats = AuthorStats.__table__
+    db.session.execute(
+        stats.update()
+        .where(stats.c.user_id == bindparam('b_user_id'))
+        .values({name: stats.c[name] + bindparam(f'b_{name}') for name in COUNTERS}),
+        [{'b_user_id': user_id, **{f'b_{name}': deltas[user_id].get(name, 0) for name in COUNTERS}}
+         for user_id in user_ids]
+    )
+
+
+def add_post_counts(counter, post_deltas):
+    """Adds {post id: delta} to a counter of each post's author inside the caller's transaction"""
+    deltas = {}
+    for post_id, author_id in db.session.execute(select(Post.id, Post.author_id).where(Post.id.in_(post_deltas))):
+        counters = deltas.setdefault(author_id, {})
+        counters[counter] = counters.get(counter, 0) + post_deltas[post_id]
+    adjust_many(deltas)
+
+
+def _post_totals(*criteria):
+    """Returns {author id: counters} of the posts matching the criteria and the comments they received"""
+    comments = select(func.count()).where(Comment.post_id == Post.id).correlate(Post).scalar_subquery()
+    totals = {}
+    for author_id, status, count, likes, comment_count in db.session.execute(
+        select(Post.author_id, Post.status, func.count(), func.coalesce(func.sum(Post.like_count), 0),
+               func.coalesce(func.sum(comments), 0))
+        .where(*criteria)
+        .group_by(Post.author_id, Post.status)
+    ):
+        counters = totals.setdefault(author_id, dict.fromkeys(COUNTERS, 0))
+        counters[status_counter(status)] += count
+        counters['like_count'] += likes
+        counters['comment_count'] += comment_count
+    return totals
+
+
+def _comment_totals(*criteria):
+    """Returns {post author id: counters} of the comments matching the criteria"""
+    totals = {}
+    for author_id, count in db.session.execute(
+        select(Post.author_id, func.count())
+        .select_from(Comment)
+        .join(Post, Post.id == Comment.post_id)
+        .where(*criteria)
+        .group_by(Post.author_id)
+    ):
+        totals.setdefault(author_id, dict.fromkeys(COUNTERS, 0))['comment_count'] += count
+    return totals
+
+
+def _negated(totals):
+    return {user_id: {name: -value for name, value in counters.items()} for user_id, counters in totals.items()}
+
+
+def remove_posts(post_ids):
+    """Takes posts about to be deleted, with their likes and comments, out of their authors' counters"""
+    adjust_many(_negated(_post_totals(Post.id.in_(post_ids))))
+
+
+def remove_comments_by(user_id):
+    """Takes the comments of a user about to be deleted out of the counters of the posts' authors"""
+    adjust_many(_negated(_comment_totals(Comment.author_id == user_id)))
+
+
+def get_stats(user_id):
+    """Returns the counters of an author as a dict, zeros if they have none yet"""
+    row = db.session.get(AuthorStats, user_id)
+    return {name: getattr(row, name) if row is not None else 0 for name in COUNTERS}
+
+
+def rebuild(batch_size=500):
+    """Recomputes every author's counters, returns the number of rows"""
+    rows = _post_totals()
+    existing = set(db.session.scalars(select(User.id).where(User.id.in_(rows))))
+    values = [{'user_id': user_id, **counters} for user_id, counters in rows.items() if user_id in existing]
+    db.session.execute(delete(AuthorStats))
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(AuthorStats), values[start:start + batch_size])
+    db.session.commit()
+    return len(values)
+
+
+def init_app(app):
+    """Registers the rebuild command"""
+    app.cli.add_command(author_stats_rebuild_command)
+
+
+@click.command('author-stats-rebuild')
+@with_appcontext
+def author_stats_rebuild_command():
+    """Recompute the author totals from the posts and comments tables."""
+    click.echo(f'Rebuilt the totals of {rebuild()} authors.')
@@ -0,0 +1,478 @@
+"""This module benchmarks every blog and auth route.
+
+'flask bench seed' fills an empty database with generated users, tags,
+posts and comments at realistic ratios. 'flask bench run' then drives
+each route, either in-process through the WSGI test client or over HTTP
+against a real gunicorn server, reports requests per second and latency
+percentiles per route, and can save the results as a baseline or fail
+when they regress against one. Rate limits are switched off while
+benchmarking.
+"""
+import http.client
+import io
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+from dbase import db
+from models import Comment, Post, PostTag, Tag, User
+from profiler import percentile
+
+BENCH_PASSWORD = 'password'
+WORDS = (
+    'burnout balance focus remote team sleep stress career code review deploy '
+    'weekend habit mentor health python flask sprint deadline meeting break '
+    'coffee walk journal boundary growth pairing oncall incident rest calm'
+).split()
+
+bench_cli = AppGroup('bench', help='Seed a benchmark database and measure every route.')
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(users=100, posts_per_user=10, tags=40, comments_per_post=4, tags_per_post=3, seed=0):
+    """Inserts generated data in batches and returns the number of rows per table.
+
+    Posts per author and comments per post follow a skewed distribution
+    around the given averages, as a few prolific authors and popular
+    posts do on a real blog.
+    """
+    rng = random.Random(seed)
+    password = generate_password_hash(BENCH_PASSWORD)
+    db.session.execute(insert(User), [
+        {'username': f'bench{n}', 'email': f'bench{n}@example.com', 'password': password,
+         'bio': sentence(rng, 30)}
+        for n in range(users)
+    ])
+    db.session.execute(insert(Tag), [{'name': f'{word}-{n}'} for n, word in enumerate(itertools.islice(
+        itertools.cycle(WORDS), tags))])
+    user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+    tag_ids = db.session.scalars(select(Tag.id).order_by(Tag.id)).all()
+
+    started = datetime.now() - timedelta(days=365)
+    posts = []
+    for author_id in user_ids:
+        for _ in range(min(int(rng.expovariate(1 / posts_per_user)), posts_per_user * 10)):
+            created = started + timedelta(seconds=rng.randrange(365 * 86400), microseconds=rng.randrange(10 ** 6))
+            posts.append({
+                'title': sentence(rng, 6).capitalize(),
+                'body': '\n\n'.join(sentence(rng, 60) for _ in range(rng.randint(2, 8))),
+                'author_id': author_id,
+                'created': created,
+                'status': 'published' if rng.random() < 0.9 else 'draft',
+                'like_count': int(rng.paretovariate(1.5)) - 1,
+            })
+    for start in range(0, len(posts), 1000):
+        db.session.execute(insert(Post), posts[start:start + 1000])
+    post_rows = db.session.execute(select(Post.id, Post.created)).all()
+
+    post_tags, comments = [], []
+    for post_id, created in post_rows:
+        for tag_id in rng.sample(tag_ids, min(rng.randint(1, tags_per_post * 2 - 1), len(tag_ids))):
+            post_tags.append({'post_id': post_id, 'tag_id': tag_id})
+        for _ in range(min(int(rng.expovariate(1 / comments_per_post)), comments_per_post * 20)):
+            comments.append({
+                'post_id': post_id,
+                'author_id': rng.choice(user_ids),
+                'body': sentence(rng, 20),
+                'created': created + timedelta(seconds=rng.randrange(1, 30 * 86400)),
+            })
+    for rows, model in ((post_tags, PostTag), (comments, Comment)):
+        for start in range(0, len(rows), 1000):
+            db.session.execute(insert(model), rows[start:start + 1000])
+    db.session.commit()
+    return {'users': len(user_ids), 'tags': len(tag_ids), 'posts': len(post_rows),
+            'post_tags': len(post_tags), 'comments': len(comments)}
+
+
+class WSGIClient:
+    """Sends requests to the app in-process through the Flask test client"""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None, files=None):
+        if files:
+            data = dict(data or {}, **{
+                name: (io.BytesIO(content), filename) for name, (filename, content) in files.items()
+            })
+            response = self._client.open(path, method=method, data=data, content_type='multipart/form-data')
+        else:
+            response = self._client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class HTTPClient:
+    """Sends requests to a running server over HTTP, keeping its own cookies"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, data=None, files=None):
+        headers = {}
+        body = None
+        if files:
+            boundary = uuid.uuid4().hex
+            body = multipart_body(boundary, data or {}, files)
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif data is not None:
+            body = urlencode(data, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            for header in response.headers.get_all('Set-Cookie') or ():
+                for name, morsel in SimpleCookie(header).items():
+                    if morsel['expires'] and 'Thu, 01 Jan 1970' in morsel['expires']:
+                        self.cookies.pop(name, None)
+                    else:
+                        self.cookies[name] = morsel.value
+            return response.status
+        finally:
+            connection.close()
+
+
+def multipart_body(boundary, fields, files):
+    """Encodes form fields and (filename, content) files as multipart/form-data"""
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts)
+
+
+class Scenario:
+    """One benchmarked request: a route, how to build it and the statuses it may answer.
+
+    path and data are called for every request, with the result of setup
+    as argument when one is given. login is True to log the client in
+    once, or 'each' to log in again before every request.
+    """
+
+    def __init__(self, endpoint, method, path, data=None, files=None, login=False, setup=None,
+                 expect=(200, 302)):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.data = data
+        self.files = files
+        self.login = login
+        self.setup = setup
+        self.expect = expect
+
+    @property
+    def name(self):
+        return f'{self.method} {self.endpoint}'
+
+
+class Context:
+    """Ids and names the scenarios pick from, loaded once from the seeded database"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.app = current_app._get_current_object()
+        self.post_ids = db.session.scalars(select(Post.id).where(Post.status == 'published')).all()
+        self.tag_names = db.session.scalars(select(Tag.name)).all()
+        users = db.session.execute(
+            select(User.id, User.email).where(User.username.like('bench%')).order_by(User.id)
+        ).all()
+        if not self.post_ids or not self.tag_names or len(users) < 2:
+            raise click.ClickException('The database has no benchmark data, run "flask bench seed" first.')
+        # The last seeded user only resets its password, so the others can always log in
+        self.reset_email = users[-1].email
+        self.emails = [email for _, email in users[:-1]]
+        self.author_id = users[0].id
+
+    def post_id(self):
+        return self.rng.choice(self.post_ids)
+
+    def tag_name(self):
+        return self.rng.choice(self.tag_names)
+
+    def word(self):
+        return self.rng.choice(WORDS)
+
+    def unique(self):
+        return uuid.uuid4().hex[:12]
+
+    def scratch_post(self):
+        """Inserts a post for a scenario that deletes one"""
+        with self.app.app_context():
+            post = Post(title='Scratch', body='Scratch', author_id=self.author_id, status='draft')
+            db.session.add(post)
+            db.session.commit()
+            return post.id
+
+
+def reset_token(email):
+    from auth import s
+    return s.dumps(email, salt='email-confirm-salt')
+
+
+def scenarios(context):
+    """Returns a scenario for every method of every blog and auth route"""
+    # An empty file field, as browsers send when no image is picked
+    image = ('', b'')
+    return [
+        Scenario('blog.index', 'GET', lambda: '/blog/'),
+        Scenario('blog.post_detail', 'GET', lambda: f'/blog/{context.post_id()}/post_detail'),
+        Scenario('blog.search', 'GET', lambda: f'/blog/search?q={context.word()}'),
+        Scenario('blog.tag', 'GET', lambda: f'/blog/tags/{context.tag_name()}'),
+        Scenario('blog.tags', 'GET', lambda: '/blog/tags?' + urlencode(
+            {'tag': context.tag_name(), 'any': [context.tag_name(), context.tag_name()], 'not': context.tag_name()},
+            doseq=True)),
+        Scenario('blog.comment', 'GET', lambda: f'/blog/{context.post_id()}/comment'),
+        Scenario('blog.comment', 'POST', lambda: f'/blog/{context.post_id()}/comment',
+                 data=lambda: {'body': 'Benchmark comment'}, login=True),
+        Scenario('blog.create', 'GET', lambda: '/blog/create', login=True),
+        Scenario('blog.create', 'POST', lambda: '/blog/create', login=True,
+                 data=lambda: {'title': 'Benchmark post', 'body': sentence(context.rng, 200),
+                               'tags': context.tag_name(), 'action': 'Draft'}),
+        Scenario('blog.update_post', 'GET', lambda: f'/blog/{context.post_id()}/update', login=True),
+        Scenario('blog.update_post', 'POST', lambda: f'/blog/{context.post_id()}/update', login=True,
+                 data=lambda: {'title': 'Benchmark update', 'body': sentence(context.rng, 200)},
+                 files={'image': image}),
+        Scenario('blog.delete', 'POST', lambda post_id: f'/blog/{post_id}/delete', login=True,
+                 setup=context.scratch_post),
+        Scenario('blog.like_post', 'POST', lambda: f'/blog/like_post/{context.post_id()}'),
+        Scenario('blog.profile', 'GET', lambda: '/blog/profile', login=True),
+        Scenario('blog.update_profile', 'POST', lambda: '/blog/update_profile', login=True,
+                 data=lambda: {'first_name': 'Bench', 'last_name': 'Mark', 'bio': sentence(context.rng, 30)}),
+        Scenario('blog.privacy', 'GET', lambda: '/blog/privacy-policy'),
+        Scenario('blog.terms_of_service', 'GET', lambda: '/blog/terms-of-service'),
+        Scenario('blog.about_us', 'GET', lambda: '/blog/about'),
+        Scenario('blog.contact_us', 'GET', lambda: '/blog/contact-us'),
+        Scenario('auth.signup', 'GET', lambda: '/auth/signup'),
+        Scenario('auth.signup', 'POST', lambda: '/auth/signup', data=lambda: (lambda name: {
+            'username': name, 'email': f'{name}@example.com',
+            'password': BENCH_PASSWORD, 'confirm_password': BENCH_PASSWORD,
+        })(f'signup{context.unique()}')),
+        Scenario('auth.login', 'GET', lambda: '/auth/login'),
+        Scenario('auth.login', 'POST', lambda: '/auth/login',
+                 data=lambda: {'email': context.rng.choice(context.emails), 'password': BENCH_PASSWORD}),
+        Scenario('auth.forgot_password', 'GET', lambda: '/auth/forgot_password'),
+        Scenario('auth.forgot_password', 'POST', lambda: '/auth/forgot_password',
+                 data=lambda: {'email': context.reset_email}),
+        Scenario('auth.reset_password', 'GET', lambda token: f'/auth/reset_password/{token}',
+                 setup=lambda: reset_token(context.reset_email)),
+        Scenario('auth.reset_password', 'POST', lambda token: f'/auth/reset_password/{token}',
+                 data=lambda: {'password': BENCH_PASSWORD}, setup=lambda: reset_token(context.reset_email)),
+        Scenario('auth.logout', 'GET', lambda: '/auth/logout', login='each'),
+    ]
+
+
+def run_scenario(scenario, make_client, context, requests, concurrency):
+    """Sends a scenario's requests from concurrent clients and returns its statistics"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = itertools.count()
+
+    def worker():
+        client = make_client()
+        login = {'email': context.rng.choice(context.emails), 'password': BENCH_PASSWORD}
+        if scenario.login is True:
+            client.request('POST', '/auth/login', data=login)
+        while next(counter) < requests:
+            if scenario.login == 'each':
+                client.request('POST', '/auth/login', data=login)
+            args = (scenario.setup(),) if scenario.setup else ()
+            path = scenario.path(*args)
+            data = scenario.data() if scenario.data else None
+            started = time.perf_counter()
+            try:
+                status = client.request(scenario.method, path, data=data, files=scenario.files)
+            except Exception as e:
+                status = repr(e)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status not in scenario.expect:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_statuses': sorted(set(map(str, errors))),
+        'rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+    }
+
+
+def run(make_client, context, requests=50, concurrency=1, only=None):
+    """Runs every scenario and returns {scenario name: statistics}"""
+    results = {}
+    for scenario in scenarios(context):
+        if only and scenario.endpoint not in only and scenario.name not in only:
+            continue
+        results[scenario.name] = run_scenario(scenario, make_client, context, requests, concurrency)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Returns a description of every scenario slower than its baseline by more than tolerance"""
+    regressions = []
+    for name, stats in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {stats["p95_ms"]:.1f} ms, baseline {base["p95_ms"]:.1f} ms')
+        if stats['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f'{name}: {stats["rps"]:.1f} req/s, baseline {base["rps"]:.1f} req/s')
+        if stats['errors'] > base.get('errors', 0):
+            regressions.append(f'{name}: {stats["errors"]} errors {stats["error_statuses"]}')
+    return regressions
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, port, worker_class='sync'):
+    """Starts gunicorn serving app:app against the current app's database"""
+    env = dict(
+        os.environ,
+        DATABASE_URL=db.engine.url.render_as_string(hide_password=False),
+        SECRET_KEY=current_app.config['SECRET_KEY'],
+        SESSION_COOKIE_SECURE='false',
+        MAIL_QUEUE_THREAD='false',
+        RATELIMIT_ENABLED='false',
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--worker-class', worker_class,
+         '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException('gunicorn exited during startup')
+        try:
+            HTTPClient('127.0.0.1', port).request('GET', '/blog/about')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException('gunicorn did not start within 30 seconds')
+
+
+def print_report(results, regressions):
+    click.echo(f'{"route":34} {"reqs":>6} {"errors":>6} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for name, stats in results.items():
+        click.echo(f'{name:34} {stats["requests"]:>6} {stats["errors"]:>6} {stats["rps"]:>9.1f} '
+                   f'{stats["p50_ms"]:>9.1f} {stats["p95_ms"]:>9.1f} {stats["p99_ms"]:>9.1f}')
+    for regression in regressions:
+        click.echo(f'REGRESSION {regression}', err=True)
+
+
+@bench_cli.command('seed')
+@click.option('--users', default=100, help='Number of users.')
+@click.option('--posts-per-user', default=10, help='Average posts per user.')
+@click.option('--tags', default=40, help='Number of tags.')
+@click.option('--comments-per-post', default=4, help='Average comments per post.')
+@click.option('--seed', 'random_seed', default=0, help='Random seed.')
+def seed_command(users, posts_per_user, tags, comments_per_post, random_seed):
+    """Fill an empty database with benchmark data."""
+    if db.session.scalar(select(User.id).limit(1)) is not None:
+        raise click.ClickException('The database already has users, seed an empty database.')
+    counts = seed(users, posts_per_user, tags, comments_per_post, seed=random_seed)
+    click.echo(', '.join(f'{count} {table}' for table, count in counts.items()))
+
+    import authorstats
+    import feed
+    import rendering
+    import trending
+    rendering.rerender()
+    click.echo(f'Built {feed.rebuild()} feed entries.')
+    current_app.extensions['search_index'].rebuild()
+    authorstats.rebuild()
+    click.echo(f'Scored {trending.rebuild()} posts.')
+
+
+@bench_cli.command('run')
+@click.option('--server', type=click.Choice(['wsgi', 'gunicorn']), default='wsgi',
+              help='Drive the app in-process or through a gunicorn server.')
+@click.option('--workers', default=4, help='gunicorn worker processes.')
+@click.option('--worker-class', type=click.Choice(['sync', 'gevent']), default='sync',
+              help='gunicorn worker class, see gunicorn.conf.py.')
+@click.option('--requests', 'count', default=50, help='Requests per route.')
+@click.option('--concurrency', default=1, help='Concurrent clients per route.')
+@click.option('--route', 'routes', multiple=True, help='Only run these endpoints, e.g. blog.index.')
+@click.option('--output', type=click.Path(), help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(), help='Fail when results regress against this JSON file.')
+@click.option('--save-baseline', type=click.Path(), help='Write the results as the new baseline.')
+@click.option('--tolerance', default=0.25, help='Allowed slowdown before a route counts as regressed.')
+def run_command(server, workers, worker_class, count, concurrency, routes, output, baseline, save_baseline, tolerance):
+    """Benchmark every blog and auth route."""
+    context = Context(random.Random(0))
+    process = None
+    if server == 'gunicorn':
+        port = free_port()
+        process = start_gunicorn(workers, port, worker_class)
+        make_client = lambda: HTTPClient('127.0.0.1', port)
+    else:
+        app = current_app._get_current_object()
+        app.config.update(MAIL_QUEUE_THREAD=False, SESSION_COOKIE_SECURE=False, RATELIMIT_ENABLED=False)
+        make_client = lambda: WSGIClient(app)
+    try:
+        results = run(make_client, context, count, concurrency, set(routes))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    regressions = []
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+    print_report(results, regressions)
+    for path in filter(None, (output, save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressions:
+        sys.exit(1)
+
+
+def init_app(app):
+    """Registers the 'flask bench' commands"""
+    app.cli.add_command(bench_cli)
@@ -2,40 +2,54 @@
 import os
 import re
 from datetime import datetime
-from flask import Blueprint, flash, g, jsonify, redirect, render_template, request, session, url_for
-from sqlalchemy import func, or_
-from werkzeug.utils import secure_filename
+from flask import Blueprint, current_app, flash, g, jsonify, redirect, render_template, request, session, url_for
+from sqlalchemy import func, insert, or_
 from flask_login import current_user, login_required
+from markupsafe import Markup
+import authorstats
+from cache import page_cache
+import deletion
+import feed
 from dbase import db
-from models import Comment, Post, PostTag, Tag, User
+from models import Comment, FeedEntry, Post, PostTag, Tag, User
+from fulltext import search_index
+from images import save_upload
+from likes import like_buffer
+from pagination import keyset_page
+from queries import get_author_posts, get_comments_page, get_post_detail
+from querycount import query_budget
+from ratelimit import rate_limiter
+from rendering import render_post
+from replicas import read_replica
+from tagindex import tag_index
+import trending
+from tags import resolve_tags, tag_cache
+from usercache import user_cache
 
 
 bp = Blueprint('blog', __name__, url_prefix='/blog')
 
 @bp.route('/')
+@page_cache.cached(tags=lambda: ['feed'])
+@read_replica
 def index():
     """Returns the home page"""
-    posts = (
-        db.session.query(
-            Post.id, Post.title, Post.body, Post.created, Post.author_id, User.username,
-            db.func.group_concat(Tag.name).label('tags'), Post.image
-        )
-        .join(User, Post.author_id == User.id)
-        .outerjoin(PostTag, Post.id == PostTag.post_id)
-        .outerjoin(Tag, PostTag.tag_id == Tag.id)
-        .filter(Post.status == 'published')
-        .group_by(Post.id)
-        .order_by(Post.created.desc())
-        .all()
+    cursor = request.args.get('cursor')
+    # Feed rows are denormalized, see feed.py
+    posts, next_cursor = keyset_page(
+        FeedEntry.query, FeedEntry.created, FeedEntry.id, cursor, current_app.config['POSTS_PER_PAGE']
     )
-    return render_template('index.html', posts=posts)
+    # Read from the top of the score index, see trending.py
+    trending_posts = trending.top() if cursor is None else []
+    return render_template('index.html', posts=posts, trending_posts=trending_posts,
+                           cursor=cursor, next_cursor=next_cursor)
 
 @bp.route('/create', methods=('GET', 'POST'))
 @login_required
 def create():
     """Create a new post"""
-    # Query all tags from the database
-    tags = Tag.query.all()
+    # Tag names for the form come from the in-process tag cache
+    tags = tag_cache.names()
 
     if request.method == 'POST':
         title = request.form['title']
@@ -60,28 +74,31 @@ def create():
             status = 'published' if action == 'Publish' else 'draft'
             post = Post(title=title, body=body, author_id=current_user.id, status=status)
             db.session.add(post)
-            db.session.commit()
 
             if image:
-                filename = secure_filename(image.filename)
-                image.save(os.path.join('/home/taurai/ByteSerenity/static/public', filename))
-                post.image = 'public/' + filename
-
+                image_path = save_upload(image, 'post')
+                if image_path is None:
+                    flash('Unsupported image type.')
+                    return render_template('create.html', tags=tags)
+                post.image = image_path
+
+            # The post, any new tags and the post_tags rows share one transaction
+            db.session.flush()
+            authorstats.adjust(current_user.id, **{authorstats.status_counter(status): 1})
+            tag_ids = {}
             if selected_tags:
-                for tag_name in selected_tags:
-                    tag = Tag.query.filter_by(name=tag_name).first()
-                    if tag:
-                        post_tag = PostTag(post_id=post.id, tag_id=tag.id)
-                    else:  # If the tag doesn't exist, create a new one
-                        tag = Tag(name=tag_name)
-                        db.session.add(tag)
-                        db.session.commit()  # Commit the new tag creation
-
-                    post_tag = PostTag(post_id=post.id, tag_id=tag.id)  # Create the post_tag association
-                    db.session.add(post_tag)  # Add the association to the session
-                db.session.commit()  # Commit the post_tag associations
-
+                tag_ids = resolve_tags(selected_tags)
+                db.session.execute(insert(PostTag), [
+                    {'post_id': post.id, 'tag_id': tag_id} for tag_id in tag_ids.values()
+                ])
+
+            render_post(post)
+            search_index.index_post(post)
+            feed.sync_post(post)
             db.session.commit()
+            tag_cache.update(tag_ids)
+            tag_index.sync_post(post)
+            page_cache.invalidate('feed', f'post:{post.id}', *(f'tag:{name}' for name in tag_ids))
 
             if action == 'Publish':
                 return redirect(url_for('blog.index'))
@@ -91,44 +108,53 @@ def create():
     # Pass the tags to the template
     return render_template('create.html', tags=tags)
 
+def render_comment_list(post_id, cursor, endpoint, cursor_arg):
+    """Renders one page of a post's comments with a link to the next page"""
+    comments, next_cursor = get_comments_page(
+        post_id, cursor, current_app.config['COMMENTS_PER_PAGE']
+    )
+    more_url = url_for(endpoint, id=post_id, **{cursor_arg: next_cursor}) if next_cursor else None
+    return Markup(render_template('comment_list.html', comments=comments, more_url=more_url))
+
 @bp.route('/<int:id>/post_detail', methods=('GET',))
+@page_cache.cached(tags=lambda id: [f'post:{id}'])
+@query_budget(4)
+@read_replica
 def post_detail(id):
     """Shows post details"""
-    post = Post.query.get(id)
+    post = get_post_detail(id)
     if post is None:
         return "Post not Found"
-    comments = Comment.query.filter_by(post_id=id).all()
+    # The rendered comment list is shared by anonymous and logged in readers
+    cursor = request.args.get('comments')
+    comments_html = page_cache.fragment(
+        f'comments:{id}:{cursor}',
+        lambda: render_comment_list(id, cursor, 'blog.post_detail', 'comments'),
+        tags=[f'post:{id}']
+    )
     tags = [tag.name for tag in post.tags]
-    like_count = post.like_count
-    return render_template('post_detail.html', post=post, comments=comments, tags=tags, like_count=like_count)
+    like_count = like_buffer.count(post.id, post.like_count)
+    return render_template('post_detail.html', post=post, comments_html=comments_html, tags=tags, like_count=like_count)
 
 @bp.route('/search')
+@read_replica
 def search():
     """Searches for posts or categories"""
     query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
     if query == '':
         return render_template('search.html', posts=[])
     else:
-        posts = (
-            db.session.query(
-                Post.id, Post.title, Post.body, Post.created, Post.author_id, User.username,
-                db.func.group_concat(Tag.name).label('tags'), Post.image
-            )
-            .join(User, Post.author_id == User.id)
-            .outerjoin(PostTag, Post.id == PostTag.post_id)
-            .outerjoin(Tag, PostTag.tag_id == Tag.id)
-            .filter(
-                db.or_(
-                    Post.title.like('%' + query + '%'),
-                    Post.body.like('%' + query + '%'),
-                    Tag.name.like('%' + query + '%')
-                )
-            )
-            .group_by(Post.id)
-            .order_by(Post.created.desc())
-            .all()
-        )
-        return render_template('search.html', posts=posts)
+        # Rank matching post ids through the search index, then fetch just that page
+        post_ids, total = search_index.search(query, page)
+        posts = []
+        if post_ids:
+            rows = FeedEntry.query.filter(FeedEntry.id.in_(post_ids)).all()
+            rank = {post_id: position for position, post_id in enumerate(post_ids)}
+            posts = sorted(rows, key=lambda post: rank[post.id])
+        has_next = page * current_app.config['SEARCH_RESULTS_PER_PAGE'] < total
+        return render_template('search.html', posts=posts, query=query, page=page,
+                               has_next=has_next, total=total)
 
 @login_required
 @bp.route('/<int:id>/update', methods=('GET', 'POST'))
@@ -149,49 +175,81 @@ def update_post(id):
             flash(error)
         else:
             if image:
-                filename = secure_filename(image.filename)
-                image.save(os.path.join('/home/taurai/ByteSerenity/static/public/', filename))
-                post.image = 'public/' + filename
+                image_path = save_upload(image, 'post')
+                if image_path is None:
+                    flash('Unsupported image type.')
+                    return render_template('update_post.html', post=post)
+                post.image = image_path
             post.title = title
             post.body = body
+            if post.status != 'published':
+                authorstats.adjust(post.author_id, **{authorstats.status_counter(post.status): -1, 'post_count': 1})
             post.status = 'published'
+            render_post(post)
+            search_index.index_post(post)
+            feed.sync_post(post)
             db.session.commit()
+            tag_index.sync_post(post)
+            page_cache.invalidate('feed', f'post:{id}', *(f'tag:{tag.name}' for tag in post.tags))
             return redirect(url_for('blog.index'))
 
     return render_template('update_post.html', post=post)
 
+def render_tag_page(description, url_args, all_of=(), any_of=(), none_of=()):
+    """Renders a page of the posts matching a tag combination, newest first"""
+    cursor = request.args.get('cursor')
+    # Matched in the in-memory tag index, see tagindex.py
+    post_ids, next_cursor, total = tag_index.query(
+        all_of, any_of, none_of, cursor, current_app.config['POSTS_PER_PAGE']
+    )
+    posts = []
+    if post_ids:
+        rows = {post.id: post for post in FeedEntry.query.filter(FeedEntry.id.in_(post_ids))}
+        posts = [rows[post_id] for post_id in post_ids if post_id in rows]
+    return render_template(
+        'tag.html', posts=posts, description=description, total=total,
+        first_url=url_for(request.endpoint, **url_args) if cursor else None,
+        next_url=url_for(request.endpoint, cursor=next_cursor, **url_args) if next_cursor else None,
+    )
+
 @bp.route('/tags/<tag_name>')
+@page_cache.cached(tags=lambda tag_name: [f'tag:{tag_name}'])
+@read_replica
 def tag(tag_name):
-    """Shows tags"""
-    posts = (
-        db.session.query(Post.id, Post.title)
-        .join(PostTag, Post.id == PostTag.post_id)
-        .join(Tag, PostTag.tag_id == Tag.id)
-        .filter(Tag.name == tag_name)
-        .all()
-    )
-    return render_template('tag.html', posts=posts, tag_name=tag_name)
+    """Shows the posts with a tag"""
+    return render_tag_page(f'tagged with "{tag_name}"', {'tag_name': tag_name}, all_of=[tag_name])
+
+@bp.route('/tags')
+@page_cache.cached(tags=lambda: ['feed'])
+@read_replica
+def tags():
+    """Shows the posts with every ?tag=, any ?any= and none of the ?not= tags"""
+    all_of = request.args.getlist('tag')
+    any_of = request.args.getlist('any')
+    none_of = request.args.getlist('not')
+    parts = []
+    if all_of:
+        parts.append('tagged with ' + ' and '.join(f'"{name}"' for name in all_of))
+    if any_of:
+        parts.append('tagged with ' + ' or '.join(f'"{name}"' for name in any_of))
+    if none_of:
+        parts.append('not tagged with ' + ' or '.join(f'"{name}"' for name in none_of))
+    url_args = {'tag': all_of, 'any': any_of, 'not': none_of}
+    return render_tag_page(', '.join(parts) or 'with any tag', url_args, all_of, any_of, none_of)
 
 @bp.route('/<int:id>/delete', methods=('POST',))
 @login_required
 def delete(id):
     """Deletes a post"""
-    post_to_delete = db.session.query(Post).filter(Post.id == id).one_or_none()
-
-    # If the post exists, delete its comments first
-    if post_to_delete:
-        comments_to_delete = db.session.query(Comment).filter(Comment.post_id == id).all()
-        for comment in comments_to_delete:
-            db.session.delete(comment)
-
-        # Then delete the post
-        db.session.delete(post_to_delete)
-        db.session.commit()
+    # Comments, tag links, the feed row and an orphaned image go with it
+    deletion.delete_posts([id])
 
     # Redirect the user back to the index page
     return redirect(url_for('blog.index'))
 
 @bp.route('/<int:id>/comment', methods=('GET', 'POST'))
+@rate_limiter.limit('10/minute', key='user')
+@query_budget(8)
 def comment(id):
     """Create a new comment"""
     if request.method == 'POST':
@@ -212,22 +270,26 @@ def comment(id):
 
             # Add the new comment to the session
             db.session.add(comment)
+            trending.record_comment(id)
+            authorstats.adjust_post_author(id, comment_count=1)
 
             # Commit the session to save the changes in the database
             db.session.commit()
+            page_cache.invalidate(f'post:{id}')
 
             return redirect(url_for('blog.post_detail', id=id))
-    
-    comments = Comment.query.filter_by(post_id=id).all()
-        
-    return render_template('comments.html', comments=comments)
+
+    comments_html = render_comment_list(id, request.args.get('cursor'), 'blog.comment', 'cursor')
+    return render_template('comments.html', comments_html=comments_html)
 
 @bp.route('/privacy-policy')
+@page_cache.cached()
 def privacy():
     """Shows site privacy policy"""
     return render_template('privacy.html')
 
 @bp.route('/terms-of-service')
+@page_cache.cached()
 def terms_of_service():
     """Shows site terms of service"""
     return render_template('terms_of_service.html')
@@ -239,16 +301,26 @@ email_regex = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
 @login_required
 def profile():
     """Shows user profile"""
-    user = current_user 
-    posts = Post.query.filter_by(author_id=user.id, status='published').all() 
-    drafts = Post.query.filter_by(author_id=user.id, status='draft').all() 
-    return render_template('profile.html', user=user, posts=posts, drafts=drafts)
+    # current_user only holds the cached identity, the profile needs the full row
+    user = db.session.get(User, current_user.id)
+    per_page = current_app.config['PROFILE_POSTS_PER_PAGE']
+    # Posts and drafts are paged independently, each list keeping the other's position
+    cursors = {'posts': request.args.get('posts'), 'drafts': request.args.get('drafts')}
+    posts, next_posts = get_author_posts(user.id, 'published', cursors['posts'], per_page)
+    drafts, next_drafts = get_author_posts(user.id, 'draft', cursors['drafts'], per_page)
+    return render_template(
+        'profile.html', user=user, posts=posts, drafts=drafts, stats=authorstats.get_stats(user.id),
+        first_posts_url=url_for('blog.profile', drafts=cursors['drafts']) if cursors['posts'] else None,
+        next_posts_url=url_for('blog.profile', posts=next_posts, drafts=cursors['drafts']) if next_posts else None,
+        first_drafts_url=url_for('blog.profile', posts=cursors['posts']) if cursors['drafts'] else None,
+        next_drafts_url=url_for('blog.profile', posts=cursors['posts'], drafts=next_drafts) if next_drafts else None,
+    )
 
 @bp.route('/update_profile', methods=['POST'])
 @login_required
 def update_profile():
     """Updates user profile"""
-    user = current_user 
+    user = db.session.get(User, current_user.id)
 
     user.first_name = request.form.get('first_name')
     user.last_name = request.form.get('last_name')
@@ -257,9 +329,11 @@ def update_profile():
 
     avatar = request.files.get('avatar')
     if avatar:
-        filename = secure_filename(avatar.filename)
-        avatar.save(os.path.join('/home/taurai/ByteSerenity/static/public/', filename))
-        user.avatar = 'public/' + filename 
+        avatar_path = save_upload(avatar, 'avatar')
+        if avatar_path is None:
+            flash('Unsupported image type.')
+            return redirect(url_for('blog.profile'))
+        user.avatar = avatar_path
 
     if user.email and isinstance(user.email, str) and not re.fullmatch(email_regex, user.email):
         flash('Invalid email address.')
@@ -270,29 +344,37 @@ def update_profile():
         else:
             try:
                 db.session.commit()
+                user_cache.invalidate(user.id)
+                # Detail pages show the author's name and avatar
+                post_ids = db.session.query(Post.id).filter(Post.author_id == user.id)
+                page_cache.invalidate(*(f'post:{post_id}' for post_id, in post_ids))
                 flash('Profile updated successfully!')
             except Exception as e:
                 db.session.rollback()
                 flash('An error occurred while updating the profile.')
-            finally:
-                user = User.query.get(current_user.id)
 
     return redirect(url_for('blog.profile'))
 
 @bp.route('/about')
+@page_cache.cached()
 def about_us():
     """Shows the site about us section"""
     return render_template('about_us.html')
 
 @bp.route('/contact-us')
+@page_cache.cached()
 def contact_us():
     """Shows the site about us section"""
     return render_template('contact_us.html')
 
 @bp.route('/like_post/<int:id>', methods=['POST'])
+@rate_limiter.limit('60/minute')
 def like_post(id):
     """Enables users to like posts"""
-    post = Post.query.get(id)
-    post.like_count += 1
-    db.session.commit()
-    return jsonify({'like_count': post.like_count})
+    # Plain column read, the increment itself is buffered and written behind
+    stored_count = db.session.query(Post.like_count).filter(Post.id == id).scalar()
+    if stored_count is None:
+        return jsonify({'message': 'Post not found.'}), 404
+    like_buffer.like(id)
+    page_cache.invalidate(f'post:{id}')
+    return jsonify({'like_count': like_buffer.count(id, stored_count)})
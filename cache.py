@@ -0,0 +1,254 @@
+"""This module provides the response and fragment cache for anonymous views.
+
+Entries are stored in a pluggable backend (an in-memory LRU with TTL, or a
+directory shared by every gunicorn worker) and carry a set of tags such
+as 'feed' or 'post:42'. Each tag has a version token kept in the same
+backend; invalidating a tag replaces its token, so every entry written
+under the old token stops matching without having to be found and
+deleted.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app, request, session
+from flask_login import current_user
+from markupsafe import Markup
+
+
+class NullCache:
+    """Backend that stores nothing, used to switch caching off"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """Per-process LRU cache with a per-entry time to live"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemCache:
+    """Cache stored as one pickle file per key, shared across worker processes"""
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Drops the least recently written files once the directory is over its limit"""
+        try:
+            entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=os.path.getmtime)
+            for path in entries[:len(entries) - self.max_entries]:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class PageCache:
+    """Flask extension caching whole responses and rendered fragments by tag"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1000)
+        name = app.config['CACHE_BACKEND']
+        if name == 'filesystem':
+            backend = FileSystemCache(app.config['CACHE_DIR'], app.config['CACHE_MAX_ENTRIES'])
+        elif name == 'memory':
+            backend = MemoryCache(app.config['CACHE_MAX_ENTRIES'])
+        else:
+            backend = NullCache()
+        app.extensions['page_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['page_cache']
+
+    def _tag_versions(self, tags):
+        versions = {}
+        for tag in tags:
+            version = self.backend.get('tag:' + tag)
+            if version is None:
+                # A missing token (never set, or evicted) simply invalidates older entries
+                version = uuid.uuid4().hex
+                self.backend.set('tag:' + tag, version)
+            versions[tag] = version
+        return versions
+
+    def get(self, key):
+        """Returns a cached value, or None if it is missing or any of its tags changed"""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        versions, value = entry
+        for tag, version in versions.items():
+            if self.backend.get('tag:' + tag) != version:
+                return None
+        return value
+
+    def set(self, key, value, tags=(), timeout=None, versions=None):
+        """Stores a value under the current version of each of its tags.
+
+        Callers that build the value from the database should read the tag
+        versions first and pass them in, so an invalidation racing with the
+        build leaves the entry already stale.
+        """
+        if versions is None:
+            versions = self._tag_versions(tags)
+        timeout = timeout or current_app.config['CACHE_DEFAULT_TIMEOUT']
+        self.backend.set(key, (versions, value), timeout)
+
+    def invalidate(self, *tags):
+        """Expires every entry stored under any of the given tags"""
+        for tag in tags:
+            self.backend.set('tag:' + tag, uuid.uuid4().hex)
+
+    def fragment(self, key, producer, tags=(), timeout=None):
+        """Returns a cached rendered fragment, producing and storing it on a miss"""
+        value = self.get('fragment:' + key)
+        if value is None:
+            versions = self._tag_versions(tags)
+            value = str(producer())
+            self.set('fragment:' + key, value, timeout=timeout, versions=versions)
+        return Markup(value)
+
+    def cached(self, tags=lambda **kwargs: (), timeout=None):
+        """Decorates a view so anonymous GET responses are served from the cache.
+
+        tags is called with the view arguments and returns the tags that
+        invalidate the page.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                if not self._cacheable_request():
+                    return view(**kwargs)
+
+                key = 'page:' + request.full_path
+                cached = self.get(key)
+                if cached is not None:
+                    body, mimetype = cached
+                    response = current_app.response_class(body, mimetype=mimetype)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                versions = self._tag_versions(tags(**kwargs))
+                response = current_app.make_response(view(**kwargs))
+                if (response.status_code == 200 and not response.direct_passthrough
+                        and not session.modified and 'Set-Cookie' not in response.headers):
+                    self.set(key, (response.get_data(), response.mimetype), timeout=timeout, versions=versions)
+                    response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def _cacheable_request(self):
+        if request.method != 'GET' or current_user.is_authenticated:
+            return False
+        # Pages carrying flashed messages are personal to this visitor
+        return '_flashes' not in session
+
+
+page_cache = PageCache()
@@ -1,6 +1,16 @@
 """Initializes a flask sqlachemy database instance"""
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert
+from replicas import RoutingSession
 
 
-# Initialize SQLAlchemy with no settings
-db = SQLAlchemy()
+# Initialize SQLAlchemy with no settings, reads of read-only views may go to replicas
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def insert_ignore(model, rows, key):
+    """Builds an INSERT that skips rows whose unique key another transaction already inserted"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(model).values(rows).on_conflict_do_nothing(index_elements=[key])
+    return insert(model).values(rows).prefix_with('IGNORE')
@@ -0,0 +1,131 @@
+"""This module deletes posts and users with set-based statements.
+
+Comments, tag links, feed rows and scores of deleted posts are removed with one
+DELETE per table rather than loaded into the session and deleted one by
+one. The foreign keys cascade on MySQL as well, but SQLite only enforces
+them when asked, so the statements are issued explicitly. The ORM
+relationships use passive_deletes, so deleting a Post or User object
+never loads its children either.
+
+Once the deletion is committed, uploaded images no other post or user
+refers to are removed from storage with their variants, and the page,
+search, tag and user caches are invalidated.
+"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, or_, select
+import authorstats
+from cache import page_cache
+from dbase import db
+from fulltext import search_index
+from images import delete_image
+from models import AuthorStats, Comment, FeedEntry, Post, PostScore, PostTag, Tag, User
+from tagindex import tag_index
+from usercache import user_cache
+
+BATCH_SIZE = 500
+
+
+def _delete_post_rows(post_ids):
+    """Deletes posts and every row depending on them, returns (tag names, image names)"""
+    tag_names = db.session.scalars(
+        select(Tag.name).join(PostTag, PostTag.tag_id == Tag.id).where(PostTag.post_id.in_(post_ids)).distinct()
+    ).all()
+    images = db.session.scalars(
+        select(Post.image).where(Post.id.in_(post_ids), Post.image.isnot(None)).distinct()
+    ).all()
+    authorstats.remove_posts(post_ids)
+    db.session.execute(delete(Comment).where(Comment.post_id.in_(post_ids)))
+    db.session.execute(delete(PostTag).where(PostTag.post_id.in_(post_ids)))
+    db.session.execute(delete(FeedEntry).where(FeedEntry.id.in_(post_ids)))
+    db.session.execute(delete(PostScore).where(PostScore.post_id.in_(post_ids)))
+    for post_id in post_ids:
+        search_index.remove_post(post_id)
+    db.session.execute(delete(Post).where(Post.id.in_(post_ids)))
+    return tag_names, images
+
+
+def remove_orphaned_images(names):
+    """Removes the stored images no post or user refers to anymore, returns their names"""
+    if not names:
+        return []
+    referenced = set(db.session.scalars(select(Post.image).where(Post.image.in_(names))))
+    referenced.update(db.session.scalars(select(User.avatar).where(User.avatar.in_(names))))
+    orphaned = [name for name in names if name not in referenced]
+    for name in orphaned:
+        delete_image(name)
+    return orphaned
+
+
+def delete_posts(post_ids):
+    """Deletes posts with their comments, tag links, feed rows and orphaned images.
+
+    Commits, and returns the number of posts deleted.
+    """
+    post_ids = list(post_ids)
+    deleted = 0
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        batch = post_ids[start:start + BATCH_SIZE]
+        existing = db.session.scalars(select(Post.id).where(Post.id.in_(batch))).all()
+        if not existing:
+            continue
+        tag_names, images = _delete_post_rows(existing)
+        db.session.commit()
+        tag_index.remove_posts(existing)
+        page_cache.invalidate('feed', *(f'post:{id}' for id in existing), *(f'tag:{name}' for name in tag_names))
+        remove_orphaned_images(images)
+        deleted += len(existing)
+    return deleted
+
+
+def delete_user_content(user_id, delete_account=False):
+    """Deletes every post and comment of a user, and the account itself if asked.
+
+    Returns {'posts': n, 'comments': n} with the number of rows deleted.
+    """
+    deleted = {'posts': 0, 'comments': 0}
+    while True:
+        post_ids = db.session.scalars(
+            select(Post.id).where(Post.author_id == user_id).order_by(Post.id).limit(BATCH_SIZE)
+        ).all()
+        if not post_ids:
+            break
+        deleted['posts'] += delete_posts(post_ids)
+
+    # Comments left on other authors' posts
+    commented = db.session.scalars(select(Comment.post_id).where(Comment.author_id == user_id).distinct()).all()
+    authorstats.remove_comments_by(user_id)
+    deleted['comments'] = db.session.execute(delete(Comment).where(Comment.author_id == user_id)).rowcount
+
+    avatar = None
+    if delete_account:
+        avatar = db.session.scalar(select(User.avatar).where(User.id == user_id))
+        db.session.execute(delete(AuthorStats).where(AuthorStats.user_id == user_id))
+        db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+
+    page_cache.invalidate(*(f'post:{id}' for id in commented))
+    if delete_account:
+        user_cache.invalidate(user_id)
+        remove_orphaned_images([avatar] if avatar else [])
+    return deleted
+
+
+def init_app(app):
+    """Registers the user content deletion command"""
+    app.cli.add_command(delete_user_command)
+
+
+@click.command('delete-user')
+@click.argument('user')
+@click.option('--keep-account', is_flag=True, help='Only delete the posts and comments of the user.')
+@click.confirmation_option(prompt='This deletes every post and comment of the user. Continue?')
+@with_appcontext
+def delete_user_command(user, keep_account):
+    """Delete USER (email or username) with all their posts and comments."""
+    user_id = db.session.scalar(select(User.id).where(or_(User.email == user, User.username == user)))
+    if user_id is None:
+        raise click.ClickException(f'No user {user}.')
+    deleted = delete_user_content(user_id, delete_account=not keep_account)
+    click.echo(f'Deleted {deleted["posts"]} posts and {deleted["comments"]} comments'
+               + ('.' if keep_account else ' and the account.'))
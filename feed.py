@@ -0,0 +1,77 @@
+"""This module maintains the denormalized feed projection.
+
+Every published post has one feed_entries row holding what the feed and
+search listings show: the author's username, the title, the plain text excerpt
+and the comma separated tag names. The views that write posts refresh
+the row in the same transaction, so listings read a single table ordered
+by an index instead of joining and grouping posts, users and tags.
+"""
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import joinedload, selectinload
+from dbase import db
+from models import FeedEntry, Post
+from rendering import make_excerpt
+
+
+def feed_values(post):
+    """Returns the feed row of a post, built from its author and tags"""
+    return {
+        'id': post.id,
+        'author_id': post.author_id,
+        'username': post.author.username,
+        'title': post.title,
+        'excerpt': post.excerpt if post.excerpt is not None else make_excerpt(post.body),
+        'tags': ','.join(tag.name for tag in post.tags) or None,
+        'image': post.image,
+        'created': post.created,
+    }
+
+
+def sync_post(post):
+    """Adds, refreshes or removes the feed row of a post inside the caller's transaction"""
+    if post.status == 'published':
+        db.session.merge(FeedEntry(**feed_values(post)))
+    else:
+        remove_post(post.id)
+
+
+def remove_post(post_id):
+    """Removes the feed row of a post inside the caller's transaction"""
+    db.session.execute(delete(FeedEntry).where(FeedEntry.id == post_id))
+
+
+def rebuild(batch_size=500):
+    """Recreates every feed row from the posts table, returns the number of rows"""
+    db.session.execute(delete(FeedEntry))
+    total = 0
+    last_id = 0
+    while True:
+        posts = (
+            db.session.query(Post)
+            .options(joinedload(Post.author), selectinload(Post.tags))
+            .filter(Post.status == 'published', Post.id > last_id)
+            .order_by(Post.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not posts:
+            break
+        db.session.execute(insert(FeedEntry), [feed_values(post) for post in posts])
+        total += len(posts)
+        last_id = posts[-1].id
+    db.session.commit()
+    return total
+
+
+def init_app(app):
+    """Registers the rebuild command"""
+    app.cli.add_command(feed_rebuild_command)
+
+
+@click.command('feed-rebuild')
+@with_appcontext
+def feed_rebuild_command():
+    """Rebuild the feed projection from the posts table."""
+    click.echo(f'Rebuilt {rebuild()} feed entries.')
@@ -0,0 +1,357 @@
+"""This module provides the full-text search index used by blog.search.
+
+Three backends share one interface: MySQL FULLTEXT, SQLite FTS5 and an
+in-process inverted index. The backend is chosen with SEARCH_BACKEND
+('auto', 'mysql', 'sqlite' or 'memory'); 'auto' picks the one matching
+the database dialect. Only published posts are indexed. Index writes
+take effect when the session's transaction commits and are dropped when
+it rolls back.
+"""
+import math
+import re
+import threading
+from collections import Counter
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from dbase import db
+from models import Post, PostTag, Tag
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+PENDING_KEY = 'search_index_pending'
+
+
+def tokenize(value):
+    """Splits text into lowercase word tokens"""
+    return TOKEN_RE.findall((value or '').lower())
+
+
+def after_commit(callback):
+    """Runs callback once the current transaction commits, never if it rolls back"""
+    db.session.info.setdefault(PENDING_KEY, []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_pending(session):
+    for callback in session.info.pop(PENDING_KEY, ()):
+        callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+def post_tag_names(post):
+    """Returns the tag names of a post as a single space separated string"""
+    return ' '.join(tag.name for tag in post.tags)
+
+
+class SearchBackend:
+    """Interface implemented by every search backend"""
+
+    def index_post(self, post):
+        """Adds or refreshes a post in the index"""
+        raise NotImplementedError
+
+    def remove_post(self, post_id):
+        """Removes a post from the index"""
+        raise NotImplementedError
+
+    def search(self, query, page, per_page):
+        """Returns (post ids ordered by relevance, total number of matches)"""
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Rebuilds the whole index from the posts table"""
+        raise NotImplementedError
+
+
+class MemoryBackend(SearchBackend):
+    """In-process inverted index ranked with BM25.
+
+    The index is built from the database on first use and then kept up to
+    date by the write views, once their transaction commits. Each worker
+    process holds its own copy, so this backend suits single-process
+    deployments and tests.
+    """
+    k1 = 1.2
+    b = 0.75
+    # Title and tag terms count as many times as their weight
+    title_weight = 2
+    tag_weight = 2
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_length = {}
+        self._total_length = 0
+
+    def _document_terms(self, title, body, tags):
+        terms = Counter(tokenize(body))
+        for term in tokenize(title):
+            terms[term] += self.title_weight
+        for term in tokenize(tags):
+            terms[term] += self.tag_weight
+        return terms
+
+    def _add(self, post_id, terms):
+        self._discard(post_id)
+        self._doc_terms[post_id] = terms
+        self._doc_length[post_id] = sum(terms.values())
+        self._total_length += self._doc_length[post_id]
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[post_id] = frequency
+
+    def _discard(self, post_id):
+        terms = self._doc_terms.pop(post_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_length.pop(post_id)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(post_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+
+    def index_post(self, post):
+        # Read while the post is loaded, applied once the post is committed
+        post_id = post.id
+        terms = None
+        if post.status == 'published':
+            terms = self._document_terms(post.title, post.body, post_tag_names(post))
+        after_commit(lambda: self._apply(post_id, terms))
+
+    def remove_post(self, post_id):
+        after_commit(lambda: self._apply(post_id, None))
+
+    def _apply(self, post_id, terms):
+        with self._lock:
+            if not self._loaded:
+                # The post will be picked up when the index is first built
+                return
+            if terms is None:
+                self._discard(post_id)
+            else:
+                self._add(post_id, terms)
+
+    def search(self, query, page, per_page):
+        terms = set(tokenize(query))
+        with self._lock:
+            self._ensure_loaded()
+            count = len(self._doc_terms)
+            if not terms or not count:
+                return [], 0
+            average_length = self._total_length / count
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for post_id, frequency in postings.items():
+                    length = self._doc_length[post_id]
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[post_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores, key=lambda post_id: (-scores[post_id], -post_id))
+        start = (page - 1) * per_page
+        return ranked[start:start + per_page], len(ranked)
+
+    def rebuild(self):
+        rows = (
+            db.session.query(
+                Post.id, Post.title, Post.body,
+                db.func.group_concat(Tag.name).label('tags')
+            )
+            .outerjoin(PostTag, Post.id == PostTag.post_id)
+            .outerjoin(Tag, PostTag.tag_id == Tag.id)
+            .filter(Post.status == 'published')
+            .group_by(Post.id)
+            .all()
+        )
+        with self._lock:
+            self._postings = {}
+            self._doc_terms = {}
+            self._doc_length = {}
+            self._total_length = 0
+            for row in rows:
+                self._add(row.id, self._document_terms(row.title, row.body, row.tags))
+            self._loaded = True
+
+
+class SQLiteBackend(SearchBackend):
+    """SQLite FTS5 virtual table keyed by post id and ranked with bm25().
+
+    Index writes go through the current session, so they commit or roll
+    back together with the post itself.
+    """
+    table = 'posts_fts'
+
+    def __init__(self):
+        self._schema_ready = False
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            db.session.execute(text(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                'USING fts5(title, body, tags)'
+            ))
+            self._schema_ready = True
+
+    def index_post(self, post):
+        self.remove_post(post.id)
+        if post.status != 'published':
+            return
+        db.session.execute(
+            text(f'INSERT INTO {self.table} (rowid, title, body, tags) VALUES (:id, :title, :body, :tags)'),
+            {'id': post.id, 'title': post.title, 'body': post.body, 'tags': post_tag_names(post)}
+        )
+
+    def remove_post(self, post_id):
+        self._ensure_schema()
+        db.session.execute(text(f'DELETE FROM {self.table} WHERE rowid = :id'), {'id': post_id})
+
+    def search(self, query, page, per_page):
+        terms = set(tokenize(query))
+        if not terms:
+            return [], 0
+        self._ensure_schema()
+        # Quote every term so user input is never parsed as FTS5 syntax
+        match = ' OR '.join('"{}"'.format(term) for term in sorted(terms))
+        total = db.session.execute(
+            text(f'SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH :match'),
+            {'match': match}
+        ).scalar()
+        rows = db.session.execute(
+            text(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH :match '
+                f'ORDER BY bm25({self.table}, 2.0, 1.0, 2.0), rowid DESC LIMIT :limit OFFSET :offset'
+            ),
+            {'match': match, 'limit': per_page, 'offset': (page - 1) * per_page}
+        )
+        return [row[0] for row in rows], total
+
+    def rebuild(self):
+        self._ensure_schema()
+        db.session.execute(text(f'DELETE FROM {self.table}'))
+        for post in Post.query.filter_by(status='published').yield_per(500):
+            self.index_post(post)
+        db.session.commit()
+
+
+class MySQLBackend(SearchBackend):
+    """MySQL FULLTEXT search over posts(title, body) and tags(name).
+
+    Each index picks its own matching rows: posts whose title or body
+    match and, through post_tags, posts carrying a matching tag. Scores
+    are summed over the union of those rows only, so a search never scans
+    the posts table. InnoDB maintains FULLTEXT indexes on every write, so
+    the index hooks have nothing to do.
+    """
+
+    hits_sql = (
+        'SELECT posts.id AS post_id,'
+        ' MATCH (posts.title, posts.body) AGAINST (:query IN NATURAL LANGUAGE MODE) AS score'
+        ' FROM posts'
+        ' WHERE MATCH (posts.title, posts.body) AGAINST (:query IN NATURAL LANGUAGE MODE)'
+        " AND posts.status = 'published'"
+        ' UNION ALL '
+        'SELECT post_tags.post_id,'
+        ' MATCH (tags.name) AGAINST (:query IN NATURAL LANGUAGE MODE) AS score'
+        ' FROM tags'
+        ' JOIN post_tags ON post_tags.tag_id = tags.id'
+        ' JOIN posts ON posts.id = post_tags.post_id'
+        ' WHERE MATCH (tags.name) AGAINST (:query IN NATURAL LANGUAGE MODE)'
+        " AND posts.status = 'published'"
+    )
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def search(self, query, page, per_page):
+        if not tokenize(query):
+            return [], 0
+        total = db.session.execute(
+            text(f'SELECT COUNT(DISTINCT hits.post_id) FROM ({self.hits_sql}) AS hits'), {'query': query}
+        ).scalar()
+        if not total:
+            return [], 0
+        rows = db.session.execute(
+            text(
+                f'SELECT hits.post_id, SUM(hits.score) AS score FROM ({self.hits_sql}) AS hits '
+                'GROUP BY hits.post_id ORDER BY score DESC, hits.post_id DESC LIMIT :limit OFFSET :offset'
+            ),
+            {'query': query, 'limit': per_page, 'offset': (page - 1) * per_page}
+        )
+        return [row[0] for row in rows], total
+
+    def rebuild(self):
+        db.session.execute(text('OPTIMIZE TABLE posts, tags'))
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+    'mysql': MySQLBackend,
+}
+
+
+class SearchIndex:
+    """Flask extension that exposes the configured search backend"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.config.setdefault('SEARCH_RESULTS_PER_PAGE', 10)
+        name = app.config['SEARCH_BACKEND']
+        if name == 'auto':
+            dialect = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+            name = dialect if dialect in BACKENDS else 'memory'
+        app.extensions['search_index'] = BACKENDS[name]()
+        app.cli.add_command(search_reindex_command)
+
+    @property
+    def backend(self):
+        return current_app.extensions['search_index']
+
+    def index_post(self, post):
+        self.backend.index_post(post)
+
+    def remove_post(self, post_id):
+        self.backend.remove_post(post_id)
+
+    def search(self, query, page=1, per_page=None):
+        per_page = per_page or current_app.config['SEARCH_RESULTS_PER_PAGE']
+        return self.backend.search(query, max(page, 1), per_page)
+
+    def rebuild(self):
+        self.backend.rebuild()
+
+
+search_index = SearchIndex()
+
+
+@click.command('search-reindex')
+@with_appcontext
+def search_reindex_command():
+    """Rebuild the full-text search index from the posts table."""
+    search_index.rebuild()
+    click.echo('Rebuilt the search index.')
@@ -0,0 +1,31 @@
+"""gunicorn settings, loaded from the working directory by 'gunicorn app:app'.
+
+GUNICORN_WORKER_CLASS picks the serving mode:
+
+sync (default, recommended) -- each worker process serves one request at
+a time, so a request waiting on MySQL or SMTP holds the whole process.
+Run about 2 x CPU cores + 1 workers.
+
+gevent (experimental) -- each worker serves up to
+GUNICORN_WORKER_CONNECTIONS requests at once as greenlets, switching to
+another one whenever a request waits on the network. Queries only yield
+with a pure Python MySQL driver, so set DB_DRIVER=mysqlconnector too;
+that driver is slower per query than mysqldb. No measurement against
+MySQL shows it faster than sync workers yet, so compare both on your own
+database with 'flask bench run --worker-class' before switching. Run
+about one worker per CPU core. A worker's greenlets share its connection
+pool: at most DB_POOL_SIZE + DB_MAX_OVERFLOW of them hold a connection
+at a time and the others wait up to DB_POOL_TIMEOUT seconds, so keep
+workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) under MySQL's max_connections.
+"""
+import multiprocessing
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+_cores = multiprocessing.cpu_count()
+workers = int(os.environ.get('GUNICORN_WORKERS', _cores if worker_class == 'gevent' else _cores * 2 + 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# The app must be loaded after gevent patches each worker, never in the master
+preload_app = False
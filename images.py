@@ -0,0 +1,211 @@
+"""This module handles image uploads and their resized variants.
+
+Uploads are streamed to a local temporary file in chunks while being
+hashed, stored under their content-addressed name (see storage.py), and
+handed to a background thread pool that renders WebP and JPEG variants
+at the widths listed in VARIANTS. Templates pick variants with the
+image_variants() global through the picture macro, and fall back to the
+original until the variants exist.
+"""
+import contextlib
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.utils import secure_filename
+from storage import content_name, get_storage
+
+
+# Widths rendered for each kind of image, smallest first
+VARIANTS = {
+    'post': (480, 1280),
+    'avatar': (128, 256),
+}
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.avif'}
+CHUNK_SIZE = 64 * 1024
+VARIANT_RE = re.compile(r'-\d+w\.(webp|jpg)$')
+# Seconds before a variant found missing is looked up in storage again
+MISSING_TTL = 30
+
+_executor = None
+_executor_lock = threading.Lock()
+_ready = set()
+_missing = {}
+
+
+def variant_path(path, width, ext):
+    """Returns the storage name of one variant of an image"""
+    stem = os.path.splitext(path)[0]
+    return f'{stem}-{width}w.{ext}'
+
+
+def render_variants(source, name, kind, storage):
+    """Renders every variant of a local image file and stores the missing ones"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as original, tempfile.TemporaryDirectory() as workdir:
+        original = ImageOps.exif_transpose(original)
+        for width in VARIANTS[kind]:
+            targets = {ext: variant_path(name, width, ext) for ext in ('webp', 'jpg')}
+            if all(storage.exists(target) for target in targets.values()):
+                continue
+            image = original.copy()
+            image.thumbnail((width, width * 4), Image.LANCZOS)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            for ext, target in targets.items():
+                rendered = os.path.join(workdir, f'{width}.{ext}')
+                if ext == 'webp':
+                    image.save(rendered, 'WEBP', quality=80, method=4)
+                else:
+                    image.save(rendered, 'JPEG', quality=82, optimize=True, progressive=True)
+                storage.put(target, rendered)
+
+
+def _make_executor(workers):
+    """Returns a pool of OS threads, even under gevent workers.
+
+    gevent turns threading.Thread into greenlets, which would resize images
+    on the event loop and stall every other request of the worker.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+
+
+def _submit(source, name, kind):
+    """Renders variants in the background, then removes the local source file"""
+    global _executor
+    # Created on first use so no threads exist before gunicorn forks
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = _make_executor(current_app.config['IMAGE_WORKERS'])
+    storage = get_storage()
+    logger = current_app.logger
+
+    def run():
+        try:
+            render_variants(source, name, kind, storage)
+        except Exception:
+            logger.exception('Failed to render variants of %s', name)
+        finally:
+            os.remove(source)
+
+    return _executor.submit(run)
+
+
+def save_upload(upload, kind='post'):
+    """Streams an uploaded image into storage and queues its variants.
+
+    Returns the storage name of the original, or None when the file is not
+    an accepted image type. Uploading content that is already stored
+    returns the existing name without storing or processing it again.
+    """
+    ext = os.path.splitext(secure_filename(upload.filename or ''))[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        return None
+
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(suffix=ext)
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in iter(lambda: upload.stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+
+    name = content_name(digest.hexdigest(), ext)
+    storage = get_storage()
+    if storage.exists(name):
+        os.remove(tmp)
+        return name
+    try:
+        storage.put(name, tmp)
+    except Exception:
+        os.remove(tmp)
+        raise
+    _submit(tmp, name, kind)
+    return name
+
+
+def delete_image(name):
+    """Removes an image and its variants of every kind from storage"""
+    storage = get_storage()
+    names = [name] + [
+        variant_path(name, width, ext) for widths in VARIANTS.values() for width in widths for ext in ('webp', 'jpg')
+    ]
+    for stored in names:
+        storage.delete(stored)
+        _ready.discard(stored)
+        _missing.pop(stored, None)
+
+
+def _exists(name):
+    if name in _ready:
+        return True
+    checked = _missing.get(name)
+    if checked is not None and time.monotonic() - checked < MISSING_TTL:
+        return False
+    if get_storage().exists(name):
+        _ready.add(name)
+        _missing.pop(name, None)
+        return True
+    _missing[name] = time.monotonic()
+    return False
+
+
+def image_variants(path, kind='post'):
+    """Returns the src and WebP/JPEG srcset strings for an image, for templates"""
+    variants = {'src': None, 'webp': None, 'jpg': None}
+    if not path:
+        return variants
+    storage = get_storage()
+    variants['src'] = storage.url(path)
+    for ext in ('webp', 'jpg'):
+        candidates = [(variant_path(path, width, ext), width) for width in VARIANTS[kind]]
+        if all(_exists(candidate) for candidate, _ in candidates):
+            variants[ext] = ', '.join(f'{storage.url(candidate)} {width}w' for candidate, width in candidates)
+    return variants
+
+
+def init_app(app):
+    """Registers the template helper and the backfill command"""
+    app.config.setdefault('IMAGE_WORKERS', 2)
+    app.jinja_env.globals['image_variants'] = image_variants
+    app.cli.add_command(images_process_command)
+
+
+@click.command('images-process')
+@with_appcontext
+def images_process_command():
+    """Render missing variants for every post image and avatar."""
+    from models import Post, User
+    from dbase import db
+
+    storage = get_storage()
+    paths = [('post', path) for path, in db.session.query(Post.image).filter(Post.image.isnot(None))]
+    paths += [('avatar', path) for path, in db.session.query(User.avatar).filter(User.avatar.isnot(None))]
+    for kind, path in paths:
+        if VARIANT_RE.search(path) or not storage.exists(path):
+            continue
+        fd, tmp = tempfile.mkstemp(suffix=os.path.splitext(path)[1])
+        try:
+            with os.fdopen(fd, 'wb') as out, contextlib.closing(storage.open(path)) as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+            render_variants(tmp, path, kind, storage)
+            click.echo(f'Rendered {path}')
+        except Exception as e:
+            click.echo(f'Skipped {path}: {e}')
+        finally:
+            os.remove(tmp)
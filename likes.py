@@ -0,0 +1,175 @@
+"""This module buffers post likes and writes them behind in batches.
+
+Likes are added to a per-post counter in memory (or in Redis when
+LIKE_BUFFER_URL is set) and a background thread periodically flushes the
+aggregated deltas to posts.like_count with a single executemany UPDATE
+statement, adding them to the trending scores and author totals in the
+same transaction.
+Readers add the pending delta to the stored count.
+"""
+import atexit
+import threading
+from flask import current_app
+from sqlalchemy import bindparam
+from dbase import db
+import authorstats
+from models import Post
+import trending
+
+# Takes and clears the hash in one step, increments racing with it land in a fresh hash
+DRAIN_SCRIPT = """
+local counts = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return counts
+"""
+
+
+class LocalCounterStore:
+    """Thread-safe in-process counter store, the default and test stand-in"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, post_id, amount=1):
+        with self._lock:
+            total = self._counts.get(post_id, 0) + amount
+            self._counts[post_id] = total
+            return total
+
+    def pending(self, post_id):
+        return self._counts.get(post_id, 0)
+
+    def size(self):
+        return len(self._counts)
+
+    def drain(self):
+        """Atomically takes every pending delta, leaving the store empty"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return counts
+
+
+class RedisCounterStore:
+    """Counter store kept in a Redis hash and shared by every worker"""
+
+    def __init__(self, url, key='byteserenity:likes'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('LIKE_BUFFER_URL is set but the redis package is not installed')
+        self._redis = redis.Redis.from_url(url)
+        self._drain = self._redis.register_script(DRAIN_SCRIPT)
+        self._key = key
+
+    def incr(self, post_id, amount=1):
+        return self._redis.hincrby(self._key, post_id, amount)
+
+    def pending(self, post_id):
+        return int(self._redis.hget(self._key, post_id) or 0)
+
+    def size(self):
+        return self._redis.hlen(self._key)
+
+    def drain(self):
+        # Concurrent drains from several workers each get a disjoint set of deltas
+        counts = self._drain(keys=[self._key])
+        return {int(post_id): int(amount) for post_id, amount in zip(counts[::2], counts[1::2])}
+
+
+class LikeBuffer:
+    """Flask extension that aggregates likes and flushes them to the database"""
+
+    def __init__(self, app=None):
+        self._store = None
+        self._app = None
+        self._flusher = None
+        self._inflight = {}
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIKE_BUFFER_URL', None)
+        app.config.setdefault('LIKE_FLUSH_INTERVAL', 5)
+        app.config.setdefault('LIKE_FLUSH_THRESHOLD', 1000)
+        url = app.config['LIKE_BUFFER_URL']
+        self._store = RedisCounterStore(url) if url else LocalCounterStore()
+        if self._app is None:
+            atexit.register(self._flush_at_exit)
+        self._app = app
+        app.extensions['like_buffer'] = self
+
+    def like(self, post_id):
+        """Records one like for a post"""
+        self._store.incr(post_id)
+        self._ensure_flusher()
+        if self._store.size() >= current_app.config['LIKE_FLUSH_THRESHOLD']:
+            self._wakeup.set()
+
+    def count(self, post_id, stored_count):
+        """Returns the stored like count merged with the pending delta"""
+        # Deltas being written count too, until the UPDATE has committed
+        return (stored_count or 0) + self._store.pending(post_id) + self._inflight.get(post_id, 0)
+
+    def flush(self):
+        """Writes every pending delta in one batched UPDATE, returns the number of posts touched"""
+        with self._flush_lock:
+            deltas = self._store.drain()
+            if not deltas:
+                return 0
+            self._inflight = deltas
+            posts = Post.__table__
+            statement = (
+                posts.update()
+                .where(posts.c.id == bindparam('post_id'))
+                .values(like_count=posts.c.like_count + bindparam('delta'))
+            )
+            try:
+                # Sorted ids keep the row lock order stable across concurrent flushes
+                db.session.execute(statement, [
+                    {'post_id': post_id, 'delta': delta} for post_id, delta in sorted(deltas.items())
+                ])
+                trending.record_likes(deltas)
+                authorstats.add_post_counts('like_count', deltas)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Put the deltas back so they are retried on the next flush
+                for post_id, delta in deltas.items():
+                    self._store.incr(post_id, delta)
+                raise
+            finally:
+                self._inflight = {}
+            return len(deltas)
+
+    def _ensure_flusher(self):
+        # Started lazily so no thread exists before gunicorn forks its workers
+        if self._flusher is not None:
+            return
+        with self._start_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='like-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._app.config['LIKE_FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    self._app.logger.exception('Failed to flush buffered likes')
+
+    def _flush_at_exit(self):
+        with self._app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                self._app.logger.exception('Failed to flush buffered likes on exit')
+
+
+like_buffer = LikeBuffer()
@@ -0,0 +1,205 @@
+"""This module queues outbound mail in the database and sends it in the background.
+
+Views call mail_queue.enqueue(), which only inserts a row into
+outbound_mail, so no SMTP round trip happens inside a request. A worker,
+either a thread inside each app process or the 'flask mail-worker'
+command, claims due messages in batches, sends each batch over one
+reused SMTP connection at no more than MAIL_RATE_LIMIT messages per
+second, and reschedules failures with exponential backoff.
+"""
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+from dbase import db
+from models import OutboundMail
+
+
+# Errors that will not go away by retrying the same message
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+def retry_delay(attempts, base, cap):
+    """Returns the seconds to wait before the next attempt of a failed message"""
+    return min(base * 2 ** (attempts - 1), cap)
+
+
+class RateLimiter:
+    """Spaces calls evenly so no more than rate happen per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+class MailQueue:
+    """Flask extension storing outbound mail and draining it in batches"""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._worker = None
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_THREAD', True)
+        app.config.setdefault('MAIL_BATCH_SIZE', 50)
+        app.config.setdefault('MAIL_RATE_LIMIT', 5)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 6)
+        app.config.setdefault('MAIL_RETRY_DELAY', 30)
+        app.config.setdefault('MAIL_RETRY_MAX_DELAY', 3600)
+        app.config.setdefault('MAIL_LEASE_TIMEOUT', 300)
+        app.config.setdefault('MAIL_POLL_INTERVAL', 10)
+        self._app = app
+        app.extensions['mail_queue'] = self
+        app.cli.add_command(mail_worker_command)
+
+    def enqueue(self, subject, recipients, body, sender=None):
+        """Stores a message for every recipient and wakes the worker"""
+        now = datetime.now()
+        for recipient in recipients:
+            db.session.add(OutboundMail(
+                sender=sender, recipient=recipient, subject=subject, body=body,
+                status='pending', attempts=0, next_attempt=now, created=now,
+            ))
+        db.session.commit()
+        if current_app.config['MAIL_QUEUE_THREAD']:
+            self._ensure_worker()
+            self._wakeup.set()
+
+    def _claim(self, limit):
+        """Leases up to limit due messages to this worker.
+
+        A claimed message is pushed MAIL_LEASE_TIMEOUT into the future, so
+        if the worker dies mid-batch another one picks it up again later.
+        SKIP LOCKED lets concurrent workers claim disjoint batches.
+        """
+        now = datetime.now()
+        rows = (
+            db.session.query(OutboundMail)
+            .filter(OutboundMail.status == 'pending', OutboundMail.next_attempt <= now)
+            .order_by(OutboundMail.next_attempt, OutboundMail.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        lease = now + timedelta(seconds=current_app.config['MAIL_LEASE_TIMEOUT'])
+        claimed = []
+        for row in rows:
+            row.attempts += 1
+            row.next_attempt = lease
+            message = Message(row.subject, sender=row.sender, recipients=[row.recipient], body=row.body)
+            claimed.append((row.id, row.attempts, message))
+        db.session.commit()
+        return claimed
+
+    def send_batch(self):
+        """Sends one batch of due messages over a single SMTP connection.
+
+        Returns the number of messages claimed, 0 when the queue is idle.
+        """
+        config = current_app.config
+        claimed = self._claim(config['MAIL_BATCH_SIZE'])
+        if not claimed:
+            return 0
+
+        limiter = RateLimiter(config['MAIL_RATE_LIMIT'])
+        sent, failed = [], []
+        try:
+            with current_app.extensions['mail'].connect() as connection:
+                for index, (id, attempts, message) in enumerate(claimed):
+                    limiter.wait()
+                    try:
+                        connection.send(message)
+                    except PERMANENT_ERRORS as e:
+                        failed.append((id, config['MAIL_MAX_ATTEMPTS'], e))
+                    except smtplib.SMTPServerDisconnected as e:
+                        # The connection is gone, the rest of the batch is retried later
+                        failed.extend((rest_id, rest_attempts, e) for rest_id, rest_attempts, _ in claimed[index:])
+                        break
+                    except Exception as e:
+                        failed.append((id, attempts, e))
+                    else:
+                        sent.append(id)
+        except Exception as e:
+            # Connecting or closing failed, retry whatever was not confirmed as sent
+            done = set(sent) | {id for id, _, _ in failed}
+            failed.extend((id, attempts, e) for id, attempts, _ in claimed if id not in done)
+
+        now = datetime.now()
+        if sent:
+            db.session.query(OutboundMail).filter(OutboundMail.id.in_(sent)).update(
+                {'status': 'sent', 'sent': now, 'last_error': None}, synchronize_session=False
+            )
+        for id, attempts, error in failed:
+            values = {'last_error': repr(error)}
+            if attempts >= config['MAIL_MAX_ATTEMPTS']:
+                values['status'] = 'failed'
+            else:
+                delay = retry_delay(attempts, config['MAIL_RETRY_DELAY'], config['MAIL_RETRY_MAX_DELAY'])
+                values['next_attempt'] = now + timedelta(seconds=delay)
+            db.session.query(OutboundMail).filter(OutboundMail.id == id).update(values, synchronize_session=False)
+            current_app.logger.warning('Failed to send queued mail %s: %r', id, error)
+        db.session.commit()
+        return len(claimed)
+
+    def drain(self):
+        """Sends batches until no message is due, returns the number claimed"""
+        total = 0
+        while True:
+            count = self.send_batch()
+            if not count:
+                return total
+            total += count
+
+    def _ensure_worker(self):
+        # Started lazily so no thread exists before gunicorn forks its workers
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='mail-worker', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._app.app_context():
+                try:
+                    self.drain()
+                except Exception:
+                    self._app.logger.exception('Failed to send queued mail')
+                finally:
+                    db.session.remove()
+            self._wakeup.wait(self._app.config['MAIL_POLL_INTERVAL'])
+            self._wakeup.clear()
+
+
+mail_queue = MailQueue()
+
+
+@click.command('mail-worker')
+@click.option('--once', is_flag=True, help='Send every due message and exit.')
+@with_appcontext
+def mail_worker_command(once):
+    """Send queued mail, polling for new messages until interrupted."""
+    queue = current_app.extensions['mail_queue']
+    while True:
+        count = queue.drain()
+        if count:
+            click.echo(f'Processed {count} messages')
+        if once:
+            return
+        time.sleep(current_app.config['MAIL_POLL_INTERVAL'])
@@ -0,0 +1,81 @@
+"""Full-text indexes, outbound mail queue, feed projection and rendered bodies
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-05-20 00:00:00
+
+Run 'flask feed-rebuild' and 'flask posts-rerender' after upgrading to
+fill the new table and columns for existing posts.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def is_mysql():
+    return op.get_context().dialect.name == 'mysql'
+
+
+def upgrade():
+    if is_mysql():
+        op.create_index('ix_posts_title_body_fulltext', 'posts', ['title', 'body'], mysql_prefix='FULLTEXT')
+        op.create_index('ix_tags_name_fulltext', 'tags', ['name'], mysql_prefix='FULLTEXT')
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.add_column(sa.Column('body_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('excerpt', sa.String(length=300), nullable=True))
+        batch_op.add_column(sa.Column('render_version', sa.Integer(), nullable=True))
+
+    op.create_table(
+        'outbound_mail',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sender', sa.String(length=100), nullable=True),
+        sa.Column('recipient', sa.String(length=100), nullable=False),
+        sa.Column('subject', sa.String(length=256), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('sent', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_outbound_mail_status_next_attempt', 'outbound_mail', ['status', 'next_attempt'])
+
+    op.create_table(
+        'feed_entries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=50), nullable=False),
+        sa.Column('title', sa.String(length=256), nullable=False),
+        sa.Column('excerpt', sa.String(length=300), nullable=False),
+        sa.Column('tags', sa.Text(), nullable=True),
+        sa.Column('image', sa.String(length=256), nullable=True),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['id'], ['posts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_feed_entries_created_id', 'feed_entries', ['created', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_feed_entries_created_id', table_name='feed_entries')
+    op.drop_table('feed_entries')
+    op.drop_index('ix_outbound_mail_status_next_attempt', table_name='outbound_mail')
+    op.drop_table('outbound_mail')
+
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('render_version')
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('body_html')
+
+    if is_mysql():
+        op.drop_index('ix_tags_name_fulltext', table_name='tags')
+        op.drop_index('ix_posts_title_body_fulltext', table_name='posts')
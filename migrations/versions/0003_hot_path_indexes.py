@@ -0,0 +1,32 @@
+"""Composite indexes for the profile, comment and tag queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-01 00:00:00
+
+The feed is read from feed_entries, indexed on (created, id) in 0002,
+so posts needs no (status, created) index of its own.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # An author's published posts or drafts on the profile page
+    op.create_index('ix_posts_author_id_status_created', 'posts', ['author_id', 'status', 'created'])
+    # A post's comments oldest first, see queries.get_comments_page
+    op.create_index('ix_comments_post_id_created_id', 'comments', ['post_id', 'created', 'id'])
+    # Posts of a tag; the primary key only covers lookups by post_id
+    op.create_index('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id'])
+
+
+def downgrade():
+    op.drop_index('ix_post_tags_tag_id_post_id', table_name='post_tags')
+    op.drop_index('ix_comments_post_id_created_id', table_name='comments')
+    op.drop_index('ix_posts_author_id_status_created', table_name='posts')
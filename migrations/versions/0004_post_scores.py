@@ -0,0 +1,33 @@
+"""Decayed engagement scores of posts for the trending list
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-06-15 00:00:00
+
+Run 'flask trending-rebuild' after upgrading to score existing posts.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'post_scores',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(precision=53), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('post_id'),
+    )
+    op.create_index('ix_post_scores_score', 'post_scores', ['score'])
+
+
+def downgrade():
+    op.drop_index('ix_post_scores_score', table_name='post_scores')
+    op.drop_table('post_scores')
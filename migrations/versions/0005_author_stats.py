@@ -0,0 +1,46 @@
+"""Per-author post, draft, like and comment totals
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-06-22 00:00:00
+
+The table is filled from the existing posts and comments, later changes
+are applied incrementally by authorstats.py.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'author_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('draft_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('like_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.execute("""
+        INSERT INTO author_stats (user_id, post_count, draft_count, like_count, comment_count)
+        SELECT users.id,
+               (SELECT COUNT(*) FROM posts WHERE posts.author_id = users.id AND posts.status = 'published'),
+               (SELECT COUNT(*) FROM posts WHERE posts.author_id = users.id AND posts.status <> 'published'),
+               (SELECT COALESCE(SUM(posts.like_count), 0) FROM posts WHERE posts.author_id = users.id),
+               (SELECT COUNT(*) FROM comments JOIN posts ON posts.id = comments.post_id
+                WHERE posts.author_id = users.id)
+        FROM users
+        WHERE EXISTS (SELECT 1 FROM posts WHERE posts.author_id = users.id)
+    """)
+
+
+def downgrade():
+    op.drop_table('author_stats')
@@ -1,9 +1,10 @@
 """This module defines the models for the application"""
 from dbase import db
+from flask_login import UserMixin
 from sqlalchemy.sql import func
 
 
-class User(db.Model):
+class User(UserMixin, db.Model):
     """Defines the user class"""
     __tablename__ = 'users'
 
@@ -17,8 +18,9 @@ class User(db.Model):
     bio = db.Column(db.Text, nullable=True)
     avatar = db.Column(db.String(100), nullable=True)
 
-    posts = db.relationship('Post', backref='author', lazy=True)
-    comments = db.relationship('Comment', backref='author', lazy=True)
+    # Children are deleted in bulk by deletion.py, never loaded to be deleted
+    posts = db.relationship('Post', backref='author', lazy=True, passive_deletes=True)
+    comments = db.relationship('Comment', backref='author', lazy=True, passive_deletes=True)
 
     def __repr__(self):
         return f'{self.username}'
@@ -36,9 +38,21 @@ class Post(db.Model):
     status = db.Column(db.String(50), nullable=False)
     image = db.Column(db.String(256))
     like_count = db.Column(db.Integer, nullable=False, default=0)
-
-    comments = db.relationship('Comment', backref='post', lazy=True)
-    tags = db.relationship('Tag', secondary='post_tags', backref=db.backref('posts', lazy=True))
+    # Rendered at write time by rendering.render_post
+    body_html = db.Column(db.Text, nullable=True)
+    excerpt = db.Column(db.String(300), nullable=True)
+    render_version = db.Column(db.Integer, nullable=True)
+
+    comments = db.relationship('Comment', backref='post', lazy=True, passive_deletes=True)
+    tags = db.relationship('Tag', secondary='post_tags', backref=db.backref('posts', lazy=True),
+                           passive_deletes=True)
+
+    __table_args__ = (
+        # Backs MySQL full-text search, see fulltext.MySQLBackend
+        db.Index('ix_posts_title_body_fulltext', 'title', 'body', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        # Access paths of the hot queries, see migrations/versions/0003_hot_path_indexes.py
+        db.Index('ix_posts_author_id_status_created', 'author_id', 'status', 'created'),
+    )
 
     def __repr__(self):
         return f'{self.title}'
@@ -53,6 +67,10 @@ class Comment(db.Model):
     body = db.Column(db.Text, nullable=False)
     created = db.Column(db.DateTime, nullable=False, default=func.now())
 
+    __table_args__ = (
+        db.Index('ix_comments_post_id_created_id', 'post_id', 'created', 'id'),
+    )
+
     def __repr__(self):
         return f'<Comment {self.id}>'
 
@@ -63,6 +81,10 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(256), unique=True, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_tags_name_fulltext', 'name', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
+
     def __repr__(self):
         return f'{self.name}'
 
@@ -73,5 +95,84 @@ class PostTag(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
     tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
 
+    __table_args__ = (
+        db.Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id'),
+    )
+
     def __repr__(self):
         return f'<PostTag {self.post_id}, {self.tag_id}>'
+
+class OutboundMail(db.Model):
+    """Defines the outbound mail queue drained by the mail worker"""
+    __tablename__ = 'outbound_mail'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(100), nullable=True)
+    recipient = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False)
+    last_error = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, nullable=False)
+    sent = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Workers claim due messages in (status, next_attempt) order
+        db.Index('ix_outbound_mail_status_next_attempt', 'status', 'next_attempt'),
+    )
+
+    def __repr__(self):
+        return f'<OutboundMail {self.id} to {self.recipient}>'
+
+class FeedEntry(db.Model):
+    """Defines the denormalized feed row of a published post, kept in sync by feed.py"""
+    __tablename__ = 'feed_entries'
+
+    id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    author_id = db.Column(db.Integer, nullable=False)
+    username = db.Column(db.String(50), nullable=False)
+    title = db.Column(db.String(256), nullable=False)
+    excerpt = db.Column(db.String(300), nullable=False)
+    tags = db.Column(db.Text, nullable=True)
+    image = db.Column(db.String(256))
+    created = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # The feed is read newest first with keyset pagination on (created, id)
+        db.Index('ix_feed_entries_created_id', 'created', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<FeedEntry {self.id}>'
+
+class PostScore(db.Model):
+    """Defines the decayed engagement score of a post, kept by trending.py"""
+    __tablename__ = 'post_scores'
+
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    # log2 of the decayed score scaled to a fixed origin, see trending.py
+    score = db.Column(db.Float(precision=53), nullable=True)
+
+    __table_args__ = (
+        # Trending posts are read highest score first
+        db.Index('ix_post_scores_score', 'score'),
+    )
+
+    def __repr__(self):
+        return f'<PostScore {self.post_id}>'
+
+class AuthorStats(db.Model):
+    """Defines the totals shown on an author's profile, kept by authorstats.py"""
+    __tablename__ = 'author_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    draft_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Likes and comments received on the author's posts
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<AuthorStats {self.user_id}>'
@@ -0,0 +1,57 @@
+"""This module provides keyset (cursor) pagination helpers"""
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created, id):
+    """Encodes the (created, id) of the last row on a page as an opaque token"""
+    raw = f'{created.isoformat()}|{id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decodes a cursor token, returns None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created, id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(query, created_col, id_col, cursor, page_size, newest_first=True):
+    """Returns one page of rows and the cursor of the next page.
+
+    The query is ordered by (created, id), descending unless newest_first
+    is False, and resumed strictly after the cursor position, so the
+    database walks the index instead of skipping over an OFFSET. One
+    extra row is fetched to tell whether a next page exists.
+    """
+    position = decode_cursor(cursor)
+    if position is not None:
+        created, id = position
+        if newest_first:
+            query = query.filter(or_(
+                created_col < created,
+                and_(created_col == created, id_col < id)
+            ))
+        else:
+            query = query.filter(or_(
+                created_col > created,
+                and_(created_col == created, id_col > id)
+            ))
+    if newest_first:
+        query = query.order_by(created_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(created_col.asc(), id_col.asc())
+    rows = query.limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created, last.id)
+    return rows, next_cursor
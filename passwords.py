@@ -0,0 +1,214 @@
+"""This module hashes and checks passwords off the request worker.
+
+Hashes are computed in a small pool of worker processes (native threads
+under gevent workers, where hashlib releases the GIL), so a burst of
+logins does not hold the worker that serves page views. At most
+PASSWORD_HASH_QUEUE operations may be running or waiting per worker;
+beyond that, and when PASSWORD_HASH_TIMEOUT expires, the request fails
+fast with 503 instead of queueing behind the others. A pool broken by a
+worker that died is replaced and the operation retried once. With the
+default sync workers, which serve one request at a time,
+PASSWORD_HASH_WORKERS defaults to 0 and hashes are computed inline.
+
+PASSWORD_HASH_METHOD is any werkzeug method, e.g. 'scrypt:32768:8:1' or
+'pbkdf2:sha256:600000'. Hashes made with another method or cost are
+replaced after the next successful login. Latency percentiles per
+operation are added to the profiler report, and 'flask password-hash-cost'
+times a method on this machine.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from profiler import percentile
+
+BUSY_MESSAGE = 'The server is busy, please try again in a moment.'
+# Parameters werkzeug fills in when a method leaves them out
+METHOD_DEFAULTS = {
+    'scrypt': ['32768', '8', '1'],
+    'pbkdf2': ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)],
+}
+
+
+def normalize_method(method):
+    """Returns a werkzeug hash method with every parameter spelled out"""
+    name, *params = method.split(':')
+    if name not in METHOD_DEFAULTS:
+        raise ValueError(f'Unsupported password hash method {method!r}')
+    return ':'.join([name] + params + METHOD_DEFAULTS[name][len(params):])
+
+
+def needs_rehash(password_hash, method):
+    """Tells whether a stored hash was made with another method or cost"""
+    return password_hash.split('$', 1)[0] != method
+
+
+def hash_password(password, method):
+    """Returns (hash, seconds spent), run in a pool worker"""
+    started = time.perf_counter()
+    return generate_password_hash(password, method), time.perf_counter() - started
+
+
+def verify_password(password_hash, password, method):
+    """Returns ((matches, upgraded hash or None), seconds spent), run in a pool worker"""
+    started = time.perf_counter()
+    upgraded = None
+    matches = check_password_hash(password_hash, password)
+    if matches and needs_rehash(password_hash, method):
+        upgraded = generate_password_hash(password, method)
+    return (matches, upgraded), time.perf_counter() - started
+
+
+def _make_executor(workers):
+    """Returns a process pool, or a pool of native threads under gevent workers.
+
+    Forking a monkey-patched process leaves the children with a broken
+    event loop, while hashlib releases the GIL so native threads hash in
+    parallel without blocking greenlets.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+class PasswordHasher:
+    """Flask extension running password hashing in a bounded worker pool"""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = None
+        self._timings = {}
+        self._rejected = {}
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 0)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+        app.config.setdefault('PASSWORD_HASH_SAMPLES', 1000)
+        app.config['PASSWORD_HASH_METHOD'] = normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE'])
+        app.extensions['password_hasher'] = self
+        app.cli.add_command(password_hash_cost_command)
+
+    def _run(self, operation, function, *args):
+        config = current_app.config
+        if not self._slots.acquire(blocking=False):
+            self._count_rejected(operation)
+            raise ServiceUnavailable(BUSY_MESSAGE, retry_after=1)
+        started = time.perf_counter()
+        if not config['PASSWORD_HASH_WORKERS']:
+            try:
+                result, spent = function(*args)
+            finally:
+                self._slots.release()
+        else:
+            result, spent = self._run_in_pool(operation, function, args)
+        self._record(operation, time.perf_counter() - started, spent)
+        return result
+
+    def _pool(self, broken=None):
+        """Returns the executor, created on first use and replaced when it is the broken one"""
+        if self._executor is None or self._executor is broken:
+            with self._executor_lock:
+                # Created on first use so no processes exist before gunicorn forks
+                if self._executor is None or self._executor is broken:
+                    if broken is not None:
+                        current_app.logger.warning('A password hash worker died, replacing the pool')
+                        broken.shutdown(wait=False)
+                    self._executor = _make_executor(current_app.config['PASSWORD_HASH_WORKERS'])
+        return self._executor
+
+    def _run_in_pool(self, operation, function, args):
+        """Runs a task in the pool holding the slot taken by _run, once more on a new pool if it broke"""
+        executor = None
+        for attempt in range(2):
+            if attempt and not self._slots.acquire(blocking=False):
+                break
+            try:
+                executor = self._pool(broken=executor)
+                future = executor.submit(function, *args)
+            except BrokenProcessPool:
+                self._slots.release()
+                continue
+            except BaseException:
+                self._slots.release()
+                raise
+            # A hash that timed out keeps running in the pool, so its slot is only freed once it ends
+            future.add_done_callback(lambda _: self._slots.release())
+            try:
+                return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+            except TimeoutError:
+                future.cancel()
+                break
+            except BrokenProcessPool:
+                continue
+        self._count_rejected(operation)
+        raise ServiceUnavailable(BUSY_MESSAGE, retry_after=1)
+
+    def hash(self, password):
+        """Returns the hash of a password made with PASSWORD_HASH_METHOD"""
+        return self._run('hash', hash_password, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+    def verify(self, password_hash, password):
+        """Returns (matches, upgraded hash), the upgraded hash being None when the stored one is current"""
+        return self._run('verify', verify_password, password_hash, password,
+                         current_app.config['PASSWORD_HASH_METHOD'])
+
+    def _record(self, operation, wall, spent):
+        with self._stats_lock:
+            timings = self._timings.get(operation)
+            if timings is None:
+                timings = self._timings[operation] = deque(maxlen=current_app.config['PASSWORD_HASH_SAMPLES'])
+            timings.append((wall * 1000, spent * 1000))
+
+    def _count_rejected(self, operation):
+        with self._stats_lock:
+            self._rejected[operation] = self._rejected.get(operation, 0) + 1
+
+    def stats(self):
+        """Returns the latency percentiles and rejections of each operation in this worker"""
+        with self._stats_lock:
+            timings = {operation: list(samples) for operation, samples in self._timings.items()}
+            rejected = dict(self._rejected)
+        stats = {}
+        for operation in sorted(set(timings) | set(rejected)):
+            samples = timings.get(operation, [])
+            stats[operation] = {'count': len(samples), 'rejected': rejected.get(operation, 0)}
+            for field, values in (('wall_ms', [wall for wall, _ in samples]),
+                                  ('hash_ms', [spent for _, spent in samples])):
+                stats[operation][field] = {
+                    'p50': percentile(values, 0.50),
+                    'p95': percentile(values, 0.95),
+                    'p99': percentile(values, 0.99),
+                }
+        return stats
+
+
+password_hasher = PasswordHasher()
+
+
+@click.command('password-hash-cost')
+@click.option('--method', help='werkzeug hash method, PASSWORD_HASH_METHOD by default.')
+@click.option('--rounds', default=5, help='Number of hashes to time.')
+@with_appcontext
+def password_hash_cost_command(method, rounds):
+    """Time a password hash method on this machine."""
+    method = normalize_method(method or current_app.config['PASSWORD_HASH_METHOD'])
+    spent = [hash_password('benchmark password', method)[1] * 1000 for _ in range(rounds)]
+    click.echo(f'{method}: p50 {percentile(spent, 0.50):.1f} ms, max {max(spent):.1f} ms per hash')
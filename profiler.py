@@ -0,0 +1,220 @@
+"""This module profiles requests without an external APM.
+
+When PROFILER_ENABLED is set, every request records its wall time, the
+number and duration of its SQL statements and the time spent rendering
+Jinja templates. Records are kept in a bounded ring buffer per worker
+and periodically written to the instance folder, where the
+'flask profile-report' command merges them. The same report is served as
+JSON at /_profiler to requests carrying PROFILER_TOKEN.
+"""
+import hmac
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+import click
+from flask import Blueprint, abort, current_app, g, has_request_context, jsonify, request
+from flask import before_render_template, template_rendered
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+bp = Blueprint('profiler', __name__)
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def summarize(records, limit=10):
+    """Builds the per-endpoint percentiles and the slowest requests from records"""
+    by_endpoint = {}
+    for record in records:
+        by_endpoint.setdefault(record['endpoint'], []).append(record)
+
+    endpoints = {}
+    for endpoint, rows in by_endpoint.items():
+        stats = {'count': len(rows)}
+        for field in ('wall_ms', 'sql_ms', 'render_ms', 'sql_count'):
+            values = [row[field] for row in rows]
+            stats[field] = {
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+            }
+        endpoints[endpoint] = stats
+
+    slowest = sorted(records, key=lambda record: record['wall_ms'], reverse=True)[:limit]
+    return {'endpoints': endpoints, 'slowest': slowest}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g:
+        conn.info.setdefault('profiler_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('profiler_start')
+    if not starts or not has_request_context() or 'profile' not in g:
+        return
+    elapsed = (time.perf_counter() - starts.pop()) * 1000
+    profile = g.profile
+    profile['sql_count'] += 1
+    profile['sql_ms'] += elapsed
+    if len(profile['queries']) < current_app.config['PROFILER_MAX_QUERIES']:
+        profile['queries'].append({'statement': statement, 'ms': round(elapsed, 3)})
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context() and 'profile' in g:
+        g.profile['render_stack'].append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    if not has_request_context() or 'profile' not in g:
+        return
+    stack = g.profile['render_stack']
+    if stack:
+        started = stack.pop()
+        # Nested renders (fragments) are already inside the outer render time
+        if not stack:
+            g.profile['render_ms'] += (time.perf_counter() - started) * 1000
+
+
+class Profiler:
+    """Flask extension collecting per-request timings into a ring buffer"""
+
+    def __init__(self, app=None):
+        self._records = deque()
+        self._lock = threading.Lock()
+        self._last_dump = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_ENABLED', False)
+        app.config.setdefault('PROFILER_BUFFER_SIZE', 1000)
+        app.config.setdefault('PROFILER_MAX_QUERIES', 50)
+        app.config.setdefault('PROFILER_TOKEN', None)
+        app.config.setdefault('PROFILER_DUMP_INTERVAL', 10)
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiler'))
+        app.extensions['profiler'] = self
+        app.cli.add_command(profile_report_command)
+        if not app.config['PROFILER_ENABLED']:
+            return
+
+        self._records = deque(maxlen=app.config['PROFILER_BUFFER_SIZE'])
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_after_render, app)
+        app.register_blueprint(bp)
+
+    def _start(self):
+        g.profile = {
+            'started': time.perf_counter(),
+            'sql_count': 0,
+            'sql_ms': 0.0,
+            'render_ms': 0.0,
+            'render_stack': [],
+            'queries': [],
+        }
+
+    def _finish(self, response):
+        profile = g.pop('profile', None)
+        if profile is None or request.endpoint == 'profiler.report':
+            return response
+        record = {
+            'timestamp': time.time(),
+            'endpoint': request.endpoint or request.path,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'wall_ms': round((time.perf_counter() - profile['started']) * 1000, 3),
+            'sql_count': profile['sql_count'],
+            'sql_ms': round(profile['sql_ms'], 3),
+            'render_ms': round(profile['render_ms'], 3),
+            'queries': profile['queries'],
+        }
+        with self._lock:
+            self._records.append(record)
+        if time.time() - self._last_dump >= current_app.config['PROFILER_DUMP_INTERVAL']:
+            self.dump()
+        return response
+
+    def records(self):
+        """Returns a copy of the buffered records of this worker"""
+        with self._lock:
+            return list(self._records)
+
+    def dump(self):
+        """Writes this worker's buffer to the profiler folder for the CLI report"""
+        self._last_dump = time.time()
+        directory = current_app.config['PROFILER_DIR']
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.records(), f)
+        os.replace(tmp_path, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+profiler = Profiler()
+
+
+@bp.route('/_profiler')
+def report():
+    """Returns the profiling report of this worker as JSON"""
+    token = current_app.config['PROFILER_TOKEN']
+    supplied = request.headers.get('X-Profiler-Token') or request.args.get('token')
+    if not token or not supplied or not hmac.compare_digest(supplied, token):
+        abort(404)
+    limit = request.args.get('limit', 10, type=int)
+    report = summarize(current_app.extensions['profiler'].records(), limit)
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is not None:
+        report['password_hashing'] = hasher.stats()
+    return jsonify(report)
+
+
+@click.command('profile-report')
+@click.option('--limit', default=10, help='Number of slowest requests to show.')
+@click.option('--queries/--no-queries', default=True, help='Show the SQL of the slowest requests.')
+@with_appcontext
+def profile_report_command(limit, queries):
+    """Print endpoint percentiles and the slowest requests from every worker."""
+    directory = current_app.config['PROFILER_DIR']
+    records = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name)) as f:
+                    records.extend(json.load(f))
+    if not records:
+        click.echo('No profiling data. Set PROFILER_ENABLED and serve some requests first.')
+        return
+
+    report = summarize(records, limit)
+    click.echo(f'{"endpoint":40} {"count":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"sql p95":>8}')
+    for endpoint, stats in sorted(report['endpoints'].items(), key=lambda item: -item[1]['wall_ms']['p95']):
+        wall = stats['wall_ms']
+        click.echo(f'{endpoint:40} {stats["count"]:>6} {wall["p50"]:>9.1f} {wall["p95"]:>9.1f} '
+                   f'{wall["p99"]:>9.1f} {stats["sql_count"]["p95"]:>8}')
+
+    click.echo('\nSlowest requests:')
+    for record in report['slowest']:
+        click.echo(f'{record["wall_ms"]:>9.1f} ms  {record["method"]} {record["path"]} -> {record["status"]} '
+                   f'({record["sql_count"]} queries, {record["sql_ms"]:.1f} ms SQL, '
+                   f'{record["render_ms"]:.1f} ms render)')
+        if queries:
+            for query in record['queries']:
+                click.echo(f'    {query["ms"]:>8.3f} ms  {" ".join(query["statement"].split())}')
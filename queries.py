@@ -0,0 +1,46 @@
+"""This module holds the queries behind the post detail, comment, profile and tag views.
+
+Their access paths are covered by the indexes in models.py, which
+tests/test_indexes.py checks with EXPLAIN.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+from dbase import db
+from models import Comment, Post, User
+from pagination import keyset_page
+
+
+def get_post_detail(id):
+    """Loads a post with its author and tags in two statements, or None"""
+    return (
+        Post.query
+        .options(
+            joinedload(Post.author).load_only(
+                User.username, User.first_name, User.last_name, User.avatar
+            ),
+            selectinload(Post.tags)
+        )
+        .filter(Post.id == id)
+        .one_or_none()
+    )
+
+
+def get_comments_page(post_id, cursor, per_page):
+    """Returns one oldest-first page of comments with their authors and the next cursor"""
+    query = (
+        Comment.query
+        .options(joinedload(Comment.author).load_only(User.username))
+        .filter(Comment.post_id == post_id)
+    )
+    return keyset_page(query, Comment.created, Comment.id, cursor, per_page, newest_first=False)
+
+
+def get_author_posts(author_id, status, cursor=None, per_page=20):
+    """Returns one newest-first page of an author's posts with a status and the next cursor.
+
+    Only the id, title and creation time are loaded, never the bodies.
+    """
+    query = (
+        db.session.query(Post.id, Post.title, Post.created)
+        .filter(Post.author_id == author_id, Post.status == status)
+    )
+    return keyset_page(query, Post.created, Post.id, cursor, per_page)
@@ -0,0 +1,67 @@
+"""This module counts SQL statements per request and enforces query budgets"""
+import contextlib
+import functools
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a view issues more queries than its budget"""
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g._query_count = g.get('_query_count', 0) + 1
+
+
+def query_count():
+    """Returns the number of SQL statements issued in the current app context"""
+    return g.get('_query_count', 0)
+
+
+class QueryCounter:
+    """Counts the statements issued inside a with block"""
+
+    def __init__(self):
+        self._start = None
+        self._end = None
+
+    @property
+    def count(self):
+        end = query_count() if self._end is None else self._end
+        return end - self._start
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Context manager yielding a QueryCounter for the statements run inside it"""
+    counter = QueryCounter()
+    counter._start = query_count()
+    try:
+        yield counter
+    finally:
+        counter._end = query_count()
+
+
+def query_budget(limit):
+    """Decorates a view with the most SQL statements it may issue.
+
+    An overrun is logged, or raised as QueryBudgetExceeded when
+    QUERY_BUDGET_STRICT is set (it defaults to on under TESTING), so tests
+    fail as soon as a view regresses into N+1 loading.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with count_queries() as counter:
+                response = view(*args, **kwargs)
+            if counter.count > limit:
+                message = f'{view.__name__} issued {counter.count} queries, budget is {limit}'
+                if current_app.config.get('QUERY_BUDGET_STRICT', current_app.testing):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,183 @@
+"""This module throttles abusive clients with token buckets.
+
+Views decorated with rate_limiter.limit('10/minute') get one bucket per
+route, rule and client key (the client IP, the logged in user, or any
+value returned by a key function). A bucket holds at most the rule's
+count of tokens and refills continuously at count per period; a request
+takes one token, and a request finding the bucket empty is answered with
+429 Too Many Requests and a Retry-After header.
+
+A bucket is two numbers, the tokens left and when it was last updated.
+They are kept in a per-worker LRU capped at RATELIMIT_MAX_KEYS, or in
+Redis when RATELIMIT_STORAGE_URL is set, so every worker shares the same
+limits; Redis buckets expire once they would be full again. Limits are
+skipped altogether when RATELIMIT_ENABLED is off.
+
+Behind a reverse proxy, set PROXY_COUNT so the client IP is read from
+X-Forwarded-For instead of being the proxy's for every request.
+"""
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Refills a bucket, takes the cost if it is there and returns the seconds to wait otherwise
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class Limit:
+    """A rule such as '10/minute': a burst of 10 requests, refilled at 10 a minute"""
+
+    def __init__(self, rule):
+        count, _, period = rule.partition('/')
+        if period not in PERIODS:
+            raise ValueError(f'Invalid rate limit {rule!r}, expected count/second|minute|hour|day')
+        self.rule = rule
+        self.capacity = int(count)
+        self.rate = self.capacity / PERIODS[period]
+
+
+class LocalBucketStore:
+    """Thread-safe in-process buckets, least recently used ones evicted first"""
+
+    def __init__(self, max_keys=10000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+
+    def take(self, key, rate, capacity, cost=1):
+        """Takes cost tokens from a bucket, returns 0 or the seconds until they are available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                # An evicted bucket starts again full, which only ever lets more requests through
+                self._buckets.popitem(last=False)
+            return wait
+
+    def size(self):
+        return len(self._buckets)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBucketStore:
+    """Buckets kept in Redis hashes and shared by every worker"""
+
+    def __init__(self, url, prefix='byteserenity:ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATELIMIT_STORAGE_URL is set but the redis package is not installed')
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(TAKE_SCRIPT)
+        self._prefix = prefix
+
+    def take(self, key, rate, capacity, cost=1):
+        # Wall clock time, as the buckets are shared across hosts
+        return float(self._take(keys=[self._prefix + key], args=[rate, capacity, time.time(), cost]))
+
+    def clear(self):
+        for key in self._redis.scan_iter(f'{self._prefix}*'):
+            self._redis.delete(key)
+
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+
+def user_or_ip():
+    """Keys logged in clients by user and anonymous ones by IP"""
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}'
+    return f'ip:{client_ip()}'
+
+
+KEY_FUNCTIONS = {'ip': client_ip, 'user': user_or_ip}
+
+
+class RateLimiter:
+    """Flask extension applying token bucket limits to views"""
+
+    def __init__(self, app=None):
+        self._store = LocalBucketStore()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE_URL', None)
+        app.config.setdefault('RATELIMIT_MAX_KEYS', 10000)
+        url = app.config['RATELIMIT_STORAGE_URL']
+        if url:
+            self._store = RedisBucketStore(url)
+        else:
+            self._store = LocalBucketStore(app.config['RATELIMIT_MAX_KEYS'])
+        app.extensions['rate_limiter'] = self
+
+    def hit(self, scope, limit, key):
+        """Counts one request against a bucket, raising 429 when it is empty"""
+        wait = self._store.take(f'{scope}:{limit.rule}:{key}', limit.rate, limit.capacity)
+        if wait > 0:
+            raise TooManyRequests(retry_after=max(1, math.ceil(wait)))
+
+    def limit(self, rule, key='ip', methods=('POST',), scope=None):
+        """Decorator limiting a view to rule per client key.
+
+        key is 'ip', 'user' (the user id, or the IP when logged out) or a
+        function of the request returning the key, where an empty key skips
+        the limit. Only requests with one of methods are counted, and scope
+        names the bucket, the view's endpoint by default.
+        """
+        limit = Limit(rule)
+        key_function = KEY_FUNCTIONS.get(key, key)
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                if current_app.config['RATELIMIT_ENABLED'] and request.method in methods:
+                    value = key_function()
+                    if value:
+                        self.hit(scope or request.endpoint, limit, value)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def clear(self):
+        self._store.clear()
+
+
+rate_limiter = RateLimiter()
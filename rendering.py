@@ -0,0 +1,91 @@
+"""This module renders post bodies once, when a post is saved.
+
+The stored body_html is what the detail page shows and the plain text
+excerpt is what listings show, so neither is computed per request.
+RENDER_VERSION is stored with each post; bump it whenever render_body
+changes and run 'flask posts-rerender' to bring existing posts up to date.
+"""
+import html
+import re
+import click
+from flask.cli import with_appcontext
+from markupsafe import Markup
+from sqlalchemy import bindparam, or_
+from cache import page_cache
+from dbase import db
+from models import FeedEntry, Post
+
+RENDER_VERSION = 1
+# Characters of plain text kept in a post excerpt, including the ellipsis
+EXCERPT_LENGTH = 200
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def render_body(body):
+    """Returns the HTML of a post body, with line breaks kept as <br> tags"""
+    return Markup((body or '').replace('\n', '<br>\n'))
+
+
+def make_excerpt(body, length=EXCERPT_LENGTH):
+    """Returns the start of a body as plain text, cut at a word boundary"""
+    text = ' '.join(html.unescape(TAG_RE.sub(' ', body or '')).split())
+    if len(text) <= length:
+        return text
+    return text[:length - 3].rsplit(' ', 1)[0] + '...'
+
+
+def render_post(post):
+    """Stores the rendered HTML and excerpt of a post's current body"""
+    post.body_html = str(render_body(post.body))
+    post.excerpt = make_excerpt(post.body)
+    post.render_version = RENDER_VERSION
+
+
+def rerender(batch_size=500, everything=False):
+    """Re-renders posts from an older renderer version, returns the post ids"""
+    posts = Post.__table__
+    stale = or_(posts.c.render_version.is_(None), posts.c.render_version < RENDER_VERSION)
+    updated = []
+    last_id = 0
+    while True:
+        query = db.session.query(Post.id, Post.body).filter(Post.id > last_id)
+        if not everything:
+            query = query.filter(stale)
+        rows = query.order_by(Post.id).limit(batch_size).all()
+        if not rows:
+            break
+        values = [
+            {'post_id': id, 'body_html': str(render_body(body)), 'excerpt': make_excerpt(body)}
+            for id, body in rows
+        ]
+        db.session.execute(
+            posts.update().where(posts.c.id == bindparam('post_id')).values(
+                body_html=bindparam('body_html'), excerpt=bindparam('excerpt'), render_version=RENDER_VERSION
+            ),
+            values,
+        )
+        entries = FeedEntry.__table__
+        db.session.execute(
+            entries.update().where(entries.c.id == bindparam('post_id')).values(excerpt=bindparam('excerpt')),
+            [{'post_id': value['post_id'], 'excerpt': value['excerpt']} for value in values],
+        )
+        db.session.commit()
+        updated.extend(id for id, _ in rows)
+        last_id = rows[-1].id
+    return updated
+
+
+def init_app(app):
+    """Registers the re-render command"""
+    app.cli.add_command(posts_rerender_command)
+
+
+@click.command('posts-rerender')
+@click.option('--all', 'everything', is_flag=True, help='Re-render every post, not only outdated ones.')
+@with_appcontext
+def posts_rerender_command(everything):
+    """Re-render post bodies and excerpts with the current renderer."""
+    updated = rerender(everything=everything)
+    if updated:
+        page_cache.invalidate('feed', *(f'post:{id}' for id in updated))
+    click.echo(f'Re-rendered {len(updated)} posts.')
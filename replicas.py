@@ -0,0 +1,129 @@
+"""This module routes the reads of read-only views to replica databases.
+
+Every URI in SQLALCHEMY_REPLICA_URIS gets its own engine. Views
+decorated with read_replica run their plain SELECTs, built or textual
+like the full-text search queries, on a replica picked at random among
+those whose replication lag is under REPLICA_MAX_LAG; everything else,
+including locking reads and any statement after the session has written,
+goes to the primary. A client that just wrote is kept on the primary for
+REPLICA_STICKY_SECONDS so it reads its own writes.
+"""
+import functools
+import random
+import re
+import threading
+import time
+from flask import current_app, g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import TextClause
+
+STICKY_KEY = '_db_primary_until'
+TEXT_SELECT_RE = re.compile(r'\s*select\b', re.I)
+LOCKING_RE = re.compile(r'\bfor\s+(update|share)\b|\block\s+in\s+share\s+mode\b', re.I)
+
+
+def replica_lag(engine):
+    """Returns how many seconds a replica is behind its source, None if it is not replicating"""
+    if engine.dialect.name != 'mysql':
+        return 0
+    with engine.connect() as connection:
+        status = connection.exec_driver_sql('SHOW REPLICA STATUS').mappings().first()
+    if status is None:
+        # A server left configured as a replica, or promoted, is not fit to read from
+        return None
+    return status.get('Seconds_Behind_Source')
+
+
+class ReplicaSet:
+    """Holds the replica engines of an app and which of them are fit to read from"""
+
+    def __init__(self, engines):
+        self.engines = engines
+        self._lock = threading.Lock()
+        self._checked = {}
+
+    def healthy(self):
+        """Returns the replica engines lagging no more than REPLICA_MAX_LAG"""
+        config = current_app.config
+        now = time.monotonic()
+        healthy = []
+        for engine in self.engines:
+            checked_at, ok = self._checked.get(engine, (None, False))
+            if checked_at is None or now - checked_at >= config['REPLICA_CHECK_INTERVAL']:
+                try:
+                    lag = replica_lag(engine)
+                    ok = lag is not None and lag <= config['REPLICA_MAX_LAG']
+                except Exception:
+                    current_app.logger.warning('Replica %r is unreachable', engine.url, exc_info=True)
+                    ok = False
+                with self._lock:
+                    self._checked[engine] = (now, ok)
+            if ok:
+                healthy.append(engine)
+        return healthy
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+class RoutingSession(Session):
+    """Session sending the plain SELECTs of read_replica views to a replica"""
+
+    wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            replicas = current_app.extensions['replicas'].healthy()
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if not has_request_context() or not g.get('read_replica'):
+            return False
+        if 'replicas' not in current_app.extensions:
+            return False
+        if self.wrote or self._flushing:
+            return False
+        if isinstance(clause, TextClause):
+            if not TEXT_SELECT_RE.match(clause.text) or LOCKING_RE.search(clause.text):
+                return False
+        elif not isinstance(clause, Select) or clause._for_update_arg is not None:
+            return False
+        return flask_session.get(STICKY_KEY, 0) <= time.time()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(db_session, flush_context):
+    db_session.wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(db_session):
+    if db_session.wrote and has_request_context() and 'replicas' in current_app.extensions:
+        flask_session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+
+
+def read_replica(view):
+    """Marks a view as read-only so its queries may run on a replica"""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def init_app(app):
+    """Creates an engine per replica URI, with the primary's engine options"""
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('REPLICA_MAX_LAG', 5)
+    app.config.setdefault('REPLICA_CHECK_INTERVAL', 5)
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+    uris = app.config['SQLALCHEMY_REPLICA_URIS']
+    if not uris:
+        return
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    app.extensions['replicas'] = ReplicaSet([create_engine(uri, **options) for uri in uris])
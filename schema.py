@@ -0,0 +1,87 @@
+"""This module runs the Alembic migrations in migrations/ against the app database.
+
+'flask db upgrade' brings a database to the latest schema. A database
+created by 'flask init-db' is stamped with the latest revision, and one
+created before migrations existed should be stamped with the baseline
+('flask db stamp 0001') before upgrading.
+"""
+import os
+import click
+from alembic import command
+from alembic.config import Config as AlembicConfig
+from flask.cli import AppGroup
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+db_cli = AppGroup('db', help='Manage database migrations.')
+
+
+def alembic_config():
+    """Returns the Alembic configuration of the migrations folder"""
+    config = AlembicConfig(os.path.join(MIGRATIONS_DIR, 'alembic.ini'))
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return config
+
+
+def include_object_for(dialect_name):
+    """Returns the Alembic include_object hook for a database dialect.
+
+    Tables that exist in the database but not in the models, such as the
+    SQLite FTS index, are left alone, and FULLTEXT indexes only exist on
+    MySQL.
+    """
+    def include_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table' and reflected and compare_to is None:
+            return False
+        if type_ == 'index' and name and name.endswith('_fulltext'):
+            return dialect_name == 'mysql'
+        return True
+    return include_object
+
+
+def upgrade(revision='head'):
+    command.upgrade(alembic_config(), revision)
+
+
+def stamp(revision='head'):
+    command.stamp(alembic_config(), revision)
+
+
+@db_cli.command('upgrade')
+@click.argument('revision', default='head')
+def upgrade_command(revision):
+    """Upgrade the database to a revision, the latest by default."""
+    upgrade(revision)
+
+
+@db_cli.command('downgrade')
+@click.argument('revision')
+def downgrade_command(revision):
+    """Downgrade the database to a revision."""
+    command.downgrade(alembic_config(), revision)
+
+
+@db_cli.command('stamp')
+@click.argument('revision', default='head')
+def stamp_command(revision):
+    """Record a revision as applied without running migrations."""
+    stamp(revision)
+
+
+@db_cli.command('current')
+def current_command():
+    """Show the revision of the database."""
+    command.current(alembic_config())
+
+
+@db_cli.command('revision')
+@click.option('-m', '--message', required=True, help='Description of the change.')
+@click.option('--autogenerate', is_flag=True, help='Compare the models with the database.')
+def revision_command(message, autogenerate):
+    """Create a new migration script."""
+    command.revision(alembic_config(), message=message, autogenerate=autogenerate)
+
+
+def init_app(app):
+    """Registers the 'flask db' commands"""
+    app.cli.add_command(db_cli)
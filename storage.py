@@ -0,0 +1,143 @@
+"""This module stores uploaded files by content hash.
+
+Names look like 'public/ab/cd/<sha256>.jpg': the hash is sharded over two
+directory levels so no directory grows unbounded, identical uploads map
+to the same name, and a name never changes content, which makes its
+responses safe to cache forever. Files live either on local disk under
+UPLOAD_FOLDER or in an S3-compatible bucket (STORAGE_BACKEND).
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from flask import current_app, request, url_for
+
+
+PREFIX = 'public'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+HASHED_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(-\d+w)?\.\w+$')
+
+
+def content_name(digest, ext):
+    """Returns the sharded storage name of a file with the given hex digest"""
+    return f'{PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalStorage:
+    """Stores files under UPLOAD_FOLDER, which is served as static/public"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        if not name.startswith(PREFIX + '/'):
+            raise ValueError(f'{name} is outside the upload folder')
+        return os.path.join(self.directory, *name[len(PREFIX) + 1:].split('/'))
+
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    def put(self, name, source):
+        """Copies a local file into storage under a name"""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        os.close(fd)
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, path)
+
+    def open(self, name):
+        return open(self._path(name), 'rb')
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def url(self, name):
+        return url_for('static', filename=name)
+
+
+class S3Storage:
+    """Stores files in an S3-compatible bucket such as AWS S3 or MinIO.
+
+    Any client exposing the boto3 S3 calls used here can be passed in,
+    which is how tests run against a local stand-in.
+    """
+
+    def __init__(self, bucket, public_url, endpoint_url=None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError('STORAGE_BACKEND is s3 but the boto3 package is not installed')
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/')
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=name)
+        except Exception as e:
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def put(self, name, source):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_file(source, self.bucket, name, ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': IMMUTABLE if HASHED_RE.search(name) else 'public, max-age=3600',
+        })
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=name)['Body']
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def url(self, name):
+        return f'{self.public_url}/{name}'
+
+
+def get_storage():
+    """Returns the storage backend of the current app"""
+    return current_app.extensions['storage']
+
+
+def _cache_hashed_static(response):
+    """Marks content-hashed static files as cacheable forever"""
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        if HASHED_RE.search(request.view_args.get('filename', '')):
+            response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def init_app(app):
+    """Creates the configured storage backend"""
+    app.config.setdefault('STORAGE_BACKEND', 'local')
+    if app.config['STORAGE_BACKEND'] == 's3':
+        backend = S3Storage(
+            app.config['S3_BUCKET'],
+            app.config['S3_PUBLIC_URL'],
+            endpoint_url=app.config.get('S3_ENDPOINT_URL'),
+        )
+    else:
+        backend = LocalStorage(app.config['UPLOAD_FOLDER'])
+    app.extensions['storage'] = backend
+    app.after_request(_cache_hashed_static)
@@ -0,0 +1,181 @@
+"""This module answers tag queries from an in-memory bitmap index.
+
+Every published post gets a slot, slots being numbered in (created, id)
+order, and every tag a bitmap (a Python int) with the bit of each of its
+posts' slots set. AND, OR and NOT combinations of tags are then single
+integer operations, counts are population counts, and the newest posts
+of a result are its highest set bits, so no query reaches the database
+except the one loading the titles of the page shown.
+
+The index is loaded from post_tags on first use and kept up to date by
+sync_post and remove_posts in the worker that made the change. Other
+workers see the change when they reload, at most TAG_INDEX_TIMEOUT
+seconds later. Deleted posts leave an empty slot until that reload.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import current_app
+from sqlalchemy import select
+from dbase import db
+from models import Post, PostTag, Tag
+from pagination import decode_cursor, encode_cursor
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def bitmap_from_slots(slots, size):
+    """Builds a bitmap from slot numbers in one pass over a byte array"""
+    bits = bytearray(size // 8 + 1)
+    for slot in slots:
+        bits[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class TagIndex:
+    """Flask extension holding the tag -> post bitmaps of one worker"""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._clear()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TAG_INDEX_TIMEOUT', 300)
+        app.extensions['tag_index'] = self
+
+    def _clear(self):
+        self._keys = []      # slot -> (created, post id), ascending
+        self._slots = {}     # post id -> slot
+        self._tags = {}      # tag name -> bitmap of slots
+        self._live = 0       # bitmap of the slots of published posts
+        self._loaded_at = None
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _ensure_loaded(self):
+        timeout = current_app.config['TAG_INDEX_TIMEOUT']
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < timeout:
+            return
+        rows = db.session.execute(
+            select(Post.id, Post.created, Tag.name)
+            .outerjoin(PostTag, PostTag.post_id == Post.id)
+            .outerjoin(Tag, Tag.id == PostTag.tag_id)
+            .where(Post.status == 'published')
+            .order_by(Post.created, Post.id)
+        )
+        keys, slots, tag_slots = [], {}, {}
+        for post_id, created, name in rows:
+            slot = slots.get(post_id)
+            if slot is None:
+                slot = slots[post_id] = len(keys)
+                keys.append((created, post_id))
+            if name is not None:
+                tag_slots.setdefault(name, []).append(slot)
+        tags = {name: bitmap_from_slots(numbers, len(keys)) for name, numbers in tag_slots.items()}
+        with self._lock:
+            self._keys, self._slots, self._tags = keys, slots, tags
+            self._live = (1 << len(keys)) - 1
+            self._loaded_at = time.monotonic()
+
+    def _insert_slot(self, key):
+        """Gives a new post a slot, shifting the slots of newer posts up by one"""
+        slot = bisect_left(self._keys, key)
+        if slot == len(self._keys):
+            self._keys.append(key)
+        else:
+            # Only happens when an older draft gets published
+            insort(self._keys, key)
+            low = (1 << slot) - 1
+            for name, bitmap in self._tags.items():
+                self._tags[name] = (bitmap & low) | ((bitmap >> slot) << (slot + 1))
+            self._live = (self._live & low) | ((self._live >> slot) << (slot + 1))
+            for post_id, other in self._slots.items():
+                if other >= slot:
+                    self._slots[post_id] = other + 1
+        self._slots[key[1]] = slot
+        return slot
+
+    def _clear_slot(self, slot):
+        mask = ~(1 << slot)
+        for name, bitmap in self._tags.items():
+            if bitmap >> slot & 1:
+                self._tags[name] = bitmap & mask
+        self._live &= mask
+
+    def sync_post(self, post):
+        """Adds, updates or removes a post after its changes are committed"""
+        if self._loaded_at is None:
+            # The post will be picked up when the index is first loaded
+            return
+        names = [tag.name for tag in post.tags] if post.status == 'published' else []
+        key = (post.created, post.id)
+        with self._lock:
+            slot = self._slots.get(post.id)
+            if slot is not None:
+                self._clear_slot(slot)
+            if post.status != 'published':
+                return
+            if slot is None:
+                slot = self._insert_slot(key)
+            bit = 1 << slot
+            self._live |= bit
+            for name in names:
+                self._tags[name] = self._tags.get(name, 0) | bit
+
+    def remove_posts(self, post_ids):
+        with self._lock:
+            for post_id in post_ids:
+                slot = self._slots.get(post_id)
+                if slot is not None:
+                    self._clear_slot(slot)
+
+    def _match(self, all_of, any_of, none_of):
+        result = self._live
+        for name in all_of:
+            result &= self._tags.get(name, 0)
+        if any_of:
+            union = 0
+            for name in any_of:
+                union |= self._tags.get(name, 0)
+            result &= union
+        for name in none_of:
+            result &= ~self._tags.get(name, 0)
+        return result
+
+    def counts(self):
+        """Returns {tag name: number of published posts} for every tag in use"""
+        self._ensure_loaded()
+        with self._lock:
+            counts = {name: popcount(bitmap & self._live) for name, bitmap in self._tags.items()}
+        return {name: count for name, count in counts.items() if count}
+
+    def query(self, all_of=(), any_of=(), none_of=(), cursor=None, page_size=10):
+        """Returns (post ids newest first, next page cursor, total matches).
+
+        Posts must have every tag of all_of, at least one of any_of when
+        given, and none of none_of.
+        """
+        self._ensure_loaded()
+        position = decode_cursor(cursor)
+        with self._lock:
+            result = self._match(all_of, any_of, none_of)
+            total = popcount(result)
+            if position is not None:
+                result &= (1 << bisect_left(self._keys, position)) - 1
+            ids = []
+            slot = None
+            while result and len(ids) < page_size:
+                slot = result.bit_length() - 1
+                ids.append(self._keys[slot][1])
+                result ^= 1 << slot
+            next_cursor = encode_cursor(*self._keys[slot]) if result else None
+        return ids, next_cursor, total
+
+
+tag_index = TagIndex()
@@ -0,0 +1,83 @@
+"""This module resolves tag names to ids in batches and caches them per process"""
+import threading
+import time
+from flask import current_app
+from sqlalchemy import select
+from dbase import db, insert_ignore
+from models import Tag
+
+
+class TagCache:
+    """In-process tag name -> id map, refreshed from the tags table after a timeout.
+
+    Tags are never renamed or deleted, so a cached id stays valid; the
+    timeout only bounds how long tags created by other workers stay
+    missing from the create form.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._loaded_at = None
+
+    def _fresh(self):
+        timeout = current_app.config.get('TAG_CACHE_TIMEOUT', 300)
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < timeout
+
+    def _ensure_loaded(self):
+        if self._fresh():
+            return
+        rows = db.session.execute(select(Tag.name, Tag.id)).all()
+        with self._lock:
+            self._ids = dict(rows)
+            self._loaded_at = time.monotonic()
+
+    def names(self):
+        """Returns every tag name in alphabetical order"""
+        self._ensure_loaded()
+        return sorted(self._ids)
+
+    def get_many(self, names):
+        """Returns the cached ids of the names it knows"""
+        return {name: self._ids[name] for name in names if name in self._ids}
+
+    def update(self, ids):
+        with self._lock:
+            self._ids.update(ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}
+            self._loaded_at = None
+
+
+tag_cache = TagCache()
+
+
+def resolve_tags(names):
+    """Returns a {name: id} map for the given tag names, creating missing tags.
+
+    Known names come from the cache, the rest are fetched with one IN query
+    and any still missing are inserted in a single INSERT ... IGNORE, then
+    read back with a locking read so rows committed concurrently by other
+    requests are seen. Runs inside the caller's transaction.
+    """
+    names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+    if not names:
+        return {}
+
+    ids = tag_cache.get_many(names)
+    missing = [name for name in names if name not in ids]
+    if missing:
+        found = dict(db.session.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+        ids.update(found)
+        # Only committed tags are cached, ids created below could still roll back
+        tag_cache.update(found)
+        missing = [name for name in missing if name not in found]
+    if missing:
+        db.session.execute(insert_ignore(Tag, [{'name': name} for name in missing], 'name'))
+        created = db.session.execute(
+            select(Tag.name, Tag.id).where(Tag.name.in_(missing)).with_for_update(read=True)
+        ).all()
+        ids.update(created)
+    return {name: ids[name] for name in names}
@@ -0,0 +1,103 @@
+import gzip
+import os
+import tempfile
+import unittest
+import brotli
+from flask import Flask, url_for
+import assets
+
+TAILWIND = (
+    '/*! tailwindcss v2.2.19 | MIT License */'
+    '*,::before,::after{box-sizing:border-box}'
+    '.hidden{display:none}.block{display:block}'
+    '.text-gray-300{color:#d1d5db}.hover\\:text-gray-200:hover{color:#e5e7eb}'
+    '.w-1\\/2{width:50%}.animate-spin{animation:spin 1s linear infinite}'
+    '@keyframes spin{to{transform:rotate(360deg)}}'
+    '@media (min-width:640px){.sm\\:w-1\\/2{width:50%}.sm\\:flex{display:flex}}'
+    '@media (min-width:1536px){.\\32xl\\:block{display:block}}'
+)
+
+class TestPurge(unittest.TestCase):
+    def test_unused_classes_are_removed(self):
+        used = {'hidden', 'text-gray-300', 'hover:text-gray-200', 'sm:w-1/2', '2xl:block'}
+        purged = assets.purge_css(TAILWIND, used)
+        self.assertTrue(purged.startswith('/*! tailwindcss'))
+        for kept in ('*,::before,::after{', '.hidden{', '.hover\\:text-gray-200:hover{',
+                     '@media (min-width:640px){.sm\\:w-1\\/2{width:50%}}', '.\\32xl\\:block{'):
+            self.assertIn(kept, purged)
+        for removed in ('.block{', '.w-1\\/2{', 'sm\\:flex', 'animate-spin', '@keyframes'):
+            self.assertNotIn(removed, purged)
+
+    def test_minify_keeps_strings(self):
+        self.assertEqual(assets.minify_js("  var url = 'http://example.com'; // comment\n\n  /* block */ f();\n"),
+                         "var url = 'http://example.com';\nf();")
+        self.assertEqual(assets.minify_css('a , b {\n  color : red ;\n}\n/* note */'), 'a,b{color : red}')
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        static = os.path.join(self.root.name, 'static')
+        templates = os.path.join(self.root.name, 'templates')
+        self.write('static/vendor/tailwind.min.css', TAILWIND)
+        self.write('static/scripts/blog.js', '// Toggles the menu\n$("#menu").toggleClass("hidden");\n')
+        self.write('static/styles/images/logo.png', '\x89PNG')
+        self.write('static/public/ab/upload.jpg', 'upload')
+        self.write('templates/page.html', '<p class="text-gray-300 sm:w-1/2">'
+                                          '<script src="{{ url_for(\'static\', filename=\'scripts/blog.js\') }}">')
+        self.report = assets.build(static, [templates])
+
+        self.app = Flask(__name__, static_folder=static, template_folder=templates)
+        assets.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.root.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_manifest(self):
+        manifest = self.app.extensions['assets']
+        self.assertEqual(sorted(manifest), ['scripts/blog.js', 'styles/images/logo.png', 'vendor/tailwind.min.css'])
+        self.assertRegex(manifest['vendor/tailwind.min.css'], r'^dist/vendor/tailwind\.min\.[0-9a-f]{12}\.css$')
+        css = self.report['vendor/tailwind.min.css']
+        self.assertLess(css['br'], css['built'])
+        self.assertLess(css['built'], css['source'])
+        # Images are fingerprinted but not compressed
+        self.assertNotIn('gzip', self.report['styles/images/logo.png'])
+
+        with self.app.test_request_context():
+            self.assertEqual(url_for('static', filename='scripts/blog.js'), f'/static/{manifest["scripts/blog.js"]}')
+            self.assertEqual(url_for('static', filename='public/ab/upload.jpg'), '/static/public/ab/upload.jpg')
+
+    def test_precompressed_files_are_served(self):
+        with self.app.test_request_context():
+            url = url_for('static', filename='vendor/tailwind.min.css')
+        built = self.client.get(url, headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', built.headers)
+        self.assertEqual(built.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn('.hidden{display:none}', built.get_data(as_text=True))
+        self.assertNotIn('.block{', built.get_data(as_text=True))
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(brotli.decompress(response.data), built.data)
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, br;q=0'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), built.data)
+
+    def test_vendor_files_fall_back_to_cdn(self):
+        os.remove(os.path.join(self.root.name, 'static/vendor/tailwind.min.css'))
+        self.app.extensions['assets'].clear()
+        response = self.client.get('/static/vendor/tailwind.min.css')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, assets.VENDOR['vendor/tailwind.min.css'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+import authorstats
+from dbase import db
+from models import AuthorStats, Comment, Post, User
+from queries import get_author_posts
+
+class TestAuthorStats(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.alice = User(username='alice', email='alice@example.com', password='x')
+        self.bob = User(username='bob', email='bob@example.com', password='x')
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_post(self, author, status='published', created=None):
+        post = Post(title='Post', body='Body ' * 1000, author_id=author.id, status=status,
+                    created=created or datetime(2024, 1, 1))
+        db.session.add(post)
+        db.session.flush()
+        authorstats.adjust(author.id, **{authorstats.status_counter(status): 1})
+        return post
+
+    def add_comment(self, post, author):
+        db.session.add(Comment(post_id=post.id, author_id=author.id, body='Nice'))
+        authorstats.adjust_post_author(post.id, comment_count=1)
+
+    def rebuilt(self):
+        """Returns the stats of both users as recomputed from scratch"""
+        incremental = {user.id: authorstats.get_stats(user.id) for user in (self.alice, self.bob)}
+        authorstats.rebuild()
+        return incremental, {user.id: authorstats.get_stats(user.id) for user in (self.alice, self.bob)}
+
+    def test_incremental_updates_match_rebuild(self):
+        first = self.add_post(self.alice)
+        second = self.add_post(self.alice)
+        draft = self.add_post(self.alice, status='draft')
+        other = self.add_post(self.bob)
+        self.add_comment(first, self.bob)
+        self.add_comment(first, self.alice)
+        self.add_comment(other, self.alice)
+        # A flush of buffered likes
+        for post, likes in ((first, 3), (second, 1), (other, 2)):
+            post.like_count += likes
+        authorstats.add_post_counts('like_count', {first.id: 3, second.id: 1, other.id: 2})
+        # The draft gets published
+        authorstats.adjust(self.alice.id, draft_count=-1, post_count=1)
+        draft.status = 'published'
+        db.session.commit()
+
+        self.assertEqual(authorstats.get_stats(self.alice.id),
+                         {'post_count': 3, 'draft_count': 0, 'like_count': 4, 'comment_count': 2})
+        incremental, rebuilt = self.rebuilt()
+        self.assertEqual(incremental, rebuilt)
+
+    def test_removals(self):
+        first = self.add_post(self.alice)
+        second = self.add_post(self.alice, status='draft')
+        other = self.add_post(self.bob)
+        for post in (first, second, other):
+            self.add_comment(post, self.bob)
+        db.session.commit()
+
+        authorstats.remove_posts([first.id])
+        db.session.query(Comment).filter_by(post_id=first.id).delete()
+        db.session.delete(first)
+        authorstats.remove_comments_by(self.bob.id)
+        db.session.query(Comment).filter_by(author_id=self.bob.id).delete()
+        db.session.commit()
+
+        self.assertEqual(authorstats.get_stats(self.alice.id),
+                         {'post_count': 0, 'draft_count': 1, 'like_count': 0, 'comment_count': 0})
+        incremental, rebuilt = self.rebuilt()
+        self.assertEqual(incremental, rebuilt)
+
+    def test_authors_without_row(self):
+        self.assertEqual(authorstats.get_stats(self.bob.id), dict.fromkeys(authorstats.COUNTERS, 0))
+        self.assertIsNone(db.session.get(AuthorStats, self.bob.id))
+
+    def test_author_posts_are_paged_without_bodies(self):
+        start = datetime(2024, 1, 1)
+        ids = [self.add_post(self.alice, created=start + timedelta(hours=n)).id for n in range(7)]
+        self.add_post(self.alice, status='draft')
+        db.session.commit()
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = get_author_posts(self.alice.id, 'published', cursor, per_page=3)
+            self.assertLessEqual(len(rows), 3)
+            seen.extend(row.id for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(seen, ids[::-1])
+        self.assertEqual(set(rows[0]._fields), {'id', 'title', 'created'})
+
+if __name__ == '__main__':
+    unittest.main()
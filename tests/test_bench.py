@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import bench
+from __init__ import create_app
+from config import Config
+from dbase import db
+from models import Post, User
+
+class TestBench(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with mock.patch.multiple(
+            Config,
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(self.tmp.name, 'bench.db'),
+            UPLOAD_FOLDER=os.path.join(self.tmp.name, 'uploads'),
+            MAIL_QUEUE_THREAD=False,
+            SESSION_COOKIE_SECURE=False,
+        ):
+            self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.counts = bench.seed(users=5, posts_per_user=2, tags=5, comments_per_post=2)
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def test_seed(self):
+        self.assertEqual(self.counts['users'], User.query.count())
+        self.assertEqual(self.counts['posts'], Post.query.count())
+
+    def test_scenarios_cover_every_route(self):
+        routes = {
+            (rule.endpoint, method)
+            for rule in self.app.url_map.iter_rules()
+            if rule.endpoint.split('.')[0] in ('auth', 'blog')
+            for method in rule.methods - {'HEAD', 'OPTIONS'}
+        }
+        covered = {(scenario.endpoint, scenario.method) for scenario in bench.scenarios(bench.Context(None))}
+        self.assertEqual(routes - covered, set())
+
+    def test_run_without_errors(self):
+        context = bench.Context(bench.random.Random(0))
+        results = bench.run(lambda: bench.WSGIClient(self.app), context, requests=3, concurrency=2, only={
+            'blog.index', 'blog.post_detail', 'POST blog.comment', 'POST blog.delete', 'auth.logout',
+        })
+        self.assertEqual(len(results), 5)
+        for name, stats in results.items():
+            self.assertEqual((stats['requests'], stats['errors']), (3, 0), name)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'GET blog.index': {'p95_ms': 10.0, 'rps': 100.0, 'errors': 0}}
+        fine = {'GET blog.index': {'p95_ms': 11.0, 'rps': 90.0, 'errors': 0, 'error_statuses': []}}
+        slow = {'GET blog.index': {'p95_ms': 20.0, 'rps': 50.0, 'errors': 1, 'error_statuses': ['500']}}
+        self.assertEqual(bench.compare(fine, baseline), [])
+        self.assertEqual(len(bench.compare(slow, baseline)), 3)
+
+if __name__ == '__main__':
+    unittest.main()
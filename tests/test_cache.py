@@ -0,0 +1,79 @@
+import tempfile
+import time
+import unittest
+from flask import Flask
+from flask_login import LoginManager
+from cache import FileSystemCache, MemoryCache, PageCache
+
+class TestMemoryCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expires_entries(self):
+        cache = MemoryCache()
+        cache.set('a', 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+class TestFileSystemCache(unittest.TestCase):
+    def test_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            FileSystemCache(directory).set('a', {'x': 1}, timeout=60)
+            self.assertEqual(FileSystemCache(directory).get('a'), {'x': 1})
+            FileSystemCache(directory).delete('a')
+            self.assertIsNone(FileSystemCache(directory).get('a'))
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = 'test'
+        LoginManager(self.app).user_loader(lambda user_id: None)
+        self.cache = PageCache(self.app)
+        self.renders = 0
+
+        @self.app.route('/posts/<int:id>')
+        @self.cache.cached(tags=lambda id: [f'post:{id}'])
+        def post(id):
+            self.renders += 1
+            return f'post {id} render {self.renders}'
+
+        self.client = self.app.test_client()
+
+    def test_invalidate_tag(self):
+        with self.app.app_context():
+            self.cache.set('key', 'value', tags=['post:1', 'feed'])
+            self.assertEqual(self.cache.get('key'), 'value')
+            self.cache.invalidate('post:2')
+            self.assertEqual(self.cache.get('key'), 'value')
+            self.cache.invalidate('feed')
+            self.assertIsNone(self.cache.get('key'))
+
+    def test_fragment(self):
+        with self.app.app_context():
+            self.assertEqual(self.cache.fragment('f', lambda: '<b>1</b>', tags=['post:1']), '<b>1</b>')
+            self.assertEqual(self.cache.fragment('f', lambda: '<b>2</b>', tags=['post:1']), '<b>1</b>')
+            self.cache.invalidate('post:1')
+            self.assertEqual(self.cache.fragment('f', lambda: '<b>3</b>', tags=['post:1']), '<b>3</b>')
+
+    def test_cached_view(self):
+        first = self.client.get('/posts/1')
+        second = self.client.get('/posts/1')
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.renders, 1)
+
+        with self.app.app_context():
+            self.cache.invalidate('post:1')
+        self.assertEqual(self.client.get('/posts/1').headers['X-Cache'], 'MISS')
+        self.assertEqual(self.renders, 2)
+
+if __name__ == '__main__':
+    unittest.main()
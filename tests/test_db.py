@@ -0,0 +1,35 @@
+import unittest
+from flask import Flask
+from greenlet import getcurrent, greenlet
+from __init__ import close_db, get_db
+from dbase import db
+
+class TestGetDb(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+
+    def test_greenlets_get_their_own_session(self):
+        """Requests interleaved on one thread, as gevent runs them, never share a session"""
+        main = getcurrent()
+        sessions = {}
+
+        def request(name):
+            with self.app.app_context():
+                first = get_db()
+                main.switch()
+                self.assertIs(get_db(), first)
+                sessions[name] = first
+                close_db()
+
+        a, b = greenlet(request), greenlet(request)
+        a.switch('a')
+        b.switch('b')
+        a.switch()
+        b.switch()
+        self.assertTrue(a.dead and b.dead)
+        self.assertIsNot(sessions['a'], sessions['b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+from flask import Flask
+from sqlalchemy import event
+import deletion
+import feed
+import images
+import storage
+from cache import page_cache
+from dbase import db
+from fulltext import search_index
+from models import Comment, FeedEntry, Post, PostTag, Tag, User
+from usercache import user_cache
+
+class TestDeletion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__, static_folder=self.tmp.name, static_url_path='/static')
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(self.tmp.name, 'test.db'),
+            UPLOAD_FOLDER=os.path.join(self.tmp.name, 'public'),
+        )
+        db.init_app(self.app)
+        storage.init_app(self.app)
+        images.init_app(self.app)
+        page_cache.init_app(self.app)
+        user_cache.init_app(self.app)
+        search_index.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.alice = User(username='alice', email='alice@example.com', password='x', avatar=self.store('avatar.jpg'))
+        self.bob = User(username='bob', email='bob@example.com', password='x')
+        tag = Tag(name='Burnout')
+        db.session.add_all([self.alice, self.bob, tag])
+        db.session.flush()
+        self.own = self.add_post(self.alice, self.store('own.jpg'), tag)
+        self.shared = self.add_post(self.alice, self.store('shared.jpg'), tag)
+        self.other = self.add_post(self.bob, 'public/shared.jpg', tag)
+        db.session.add_all([
+            Comment(post_id=self.own.id, author_id=self.bob.id, body='From bob'),
+            Comment(post_id=self.other.id, author_id=self.alice.id, body='From alice'),
+            Comment(post_id=self.other.id, author_id=self.bob.id, body='Own'),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def store(self, filename):
+        """Stores an image with one of its variants, returns its storage name"""
+        name = 'public/' + filename
+        for stored in (name, images.variant_path(name, 480, 'webp')):
+            path = os.path.join(self.tmp.name, stored)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'image')
+        return name
+
+    def stored(self, name):
+        return os.path.exists(os.path.join(self.tmp.name, name))
+
+    def add_post(self, author, image, tag):
+        post = Post(title='Post', body='Body', author_id=author.id, status='published', image=image,
+                    created=datetime(2024, 1, 1))
+        db.session.add(post)
+        db.session.flush()
+        db.session.add(PostTag(post_id=post.id, tag_id=tag.id))
+        feed.sync_post(post)
+        return post
+
+    def test_delete_posts_uses_bulk_statements(self):
+        db.session.add_all([Comment(post_id=self.own.id, author_id=self.bob.id, body='More') for _ in range(100)])
+        db.session.commit()
+        post_id = self.own.id
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+        with mock.patch.object(page_cache, 'invalidate') as invalidate:
+            self.assertEqual(deletion.delete_posts([post_id, 9999]), 1)
+        self.assertLess(len(statements), 15)
+
+        self.assertIsNone(db.session.get(Post, post_id))
+        self.assertEqual(Comment.query.filter_by(post_id=post_id).count(), 0)
+        self.assertEqual(PostTag.query.filter_by(post_id=post_id).count(), 0)
+        self.assertIsNone(db.session.get(FeedEntry, post_id))
+        invalidate.assert_called_once_with('feed', f'post:{post_id}', 'tag:Burnout')
+        # The image and its variants go, as no other post uses them
+        self.assertFalse(self.stored('public/own.jpg'))
+        self.assertFalse(self.stored(images.variant_path('public/own.jpg', 480, 'webp')))
+
+    def test_images_still_referenced_are_kept(self):
+        deletion.delete_posts([self.shared.id])
+        self.assertTrue(self.stored('public/shared.jpg'))
+
+    def test_delete_user_content(self):
+        alice_id, other_id = self.alice.id, self.other.id
+        deleted = deletion.delete_user_content(alice_id, delete_account=True)
+        self.assertEqual(deleted, {'posts': 2, 'comments': 1})
+        self.assertIsNone(db.session.get(User, alice_id))
+        self.assertEqual([post.id for post in Post.query], [other_id])
+        self.assertEqual([comment.body for comment in Comment.query], ['Own'])
+        self.assertFalse(self.stored('public/avatar.jpg'))
+        self.assertTrue(self.stored('public/shared.jpg'))
+
+    def test_delete_user_content_keeping_the_account(self):
+        deletion.delete_user_content(self.alice.id)
+        self.assertIsNotNone(db.session.get(User, self.alice.id))
+        self.assertEqual(Post.query.filter_by(author_id=self.alice.id).count(), 0)
+        self.assertTrue(self.stored('public/avatar.jpg'))
+
+if __name__ == '__main__':
+    unittest.main()
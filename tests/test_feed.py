@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime
+from flask import Flask
+import feed
+from dbase import db
+from models import FeedEntry, Post, PostTag, Tag, User
+
+class TestFeed(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.user = User(username='testuser', email='test@example.com', password='x')
+        db.session.add(self.user)
+        db.session.flush()
+        self.tags = [Tag(name='Burnout'), Tag(name='Zen')]
+        db.session.add_all(self.tags)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_post(self, title, status='published', tags=()):
+        post = Post(title=title, body='word ' * 100, author_id=self.user.id, status=status,
+                    created=datetime(2024, 1, 1))
+        db.session.add(post)
+        db.session.flush()
+        db.session.add_all([PostTag(post_id=post.id, tag_id=tag.id) for tag in tags])
+        db.session.flush()
+        return post
+
+    def test_sync_post_follows_status(self):
+        post = self.add_post('Draft', status='draft')
+        feed.sync_post(post)
+        db.session.commit()
+        self.assertEqual(FeedEntry.query.count(), 0)
+
+        post.status = 'published'
+        post.title = 'Published'
+        feed.sync_post(post)
+        db.session.commit()
+        entry = db.session.get(FeedEntry, post.id)
+        self.assertEqual((entry.title, entry.username), ('Published', 'testuser'))
+        self.assertTrue(entry.excerpt.endswith('...'))
+
+        feed.remove_post(post.id)
+        db.session.commit()
+        self.assertEqual(FeedEntry.query.count(), 0)
+
+    def test_rebuild_denormalizes_tags(self):
+        tagged = self.add_post('Tagged', tags=self.tags)
+        untagged = self.add_post('Untagged')
+        self.add_post('Draft', status='draft')
+        db.session.commit()
+
+        self.assertEqual(feed.rebuild(batch_size=1), 2)
+        self.assertEqual(sorted(db.session.get(FeedEntry, tagged.id).tags.split(',')), ['Burnout', 'Zen'])
+        self.assertIsNone(db.session.get(FeedEntry, untagged.id).tags)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from flask import Flask
+from dbase import db
+from fulltext import SearchIndex, tokenize
+from models import Post, PostTag, Tag, User
+
+class SearchBackendTests:
+    backend = None
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app.config['SEARCH_BACKEND'] = self.backend
+        db.init_app(self.app)
+        self.index = SearchIndex(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.user = User(username='testuser', email='test@example.com', password='x')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_post(self, title, body, status='published', tags=()):
+        post = Post(title=title, body=body, author_id=self.user.id, status=status)
+        db.session.add(post)
+        db.session.flush()
+        for name in tags:
+            tag = Tag.query.filter_by(name=name).first() or Tag(name=name)
+            db.session.add(tag)
+            db.session.flush()
+            db.session.add(PostTag(post_id=post.id, tag_id=tag.id))
+        self.index.index_post(post)
+        db.session.commit()
+        return post
+
+    def test_ranks_title_matches_first(self):
+        self.index.rebuild()
+        body_match = self.add_post('Weekly notes', 'a long day of burnout and more words here')
+        title_match = self.add_post('Burnout', 'short')
+        ids, total = self.index.search('burnout')
+        self.assertEqual(total, 2)
+        self.assertEqual(ids, [title_match.id, body_match.id])
+
+    def test_matches_tags_and_skips_drafts(self):
+        self.index.rebuild()
+        tagged = self.add_post('Hello', 'World', tags=['Mental Health'])
+        self.add_post('Mental draft', 'Mental', status='draft')
+        ids, total = self.index.search('mental')
+        self.assertEqual((ids, total), ([tagged.id], 1))
+
+    def test_update_and_remove(self):
+        self.index.rebuild()
+        post = self.add_post('Zebra', 'stripes')
+        post.title = 'Lion'
+        self.index.index_post(post)
+        db.session.commit()
+        self.assertEqual(self.index.search('zebra'), ([], 0))
+        self.assertEqual(self.index.search('lion'), ([post.id], 1))
+
+        self.index.remove_post(post.id)
+        db.session.commit()
+        self.assertEqual(self.index.search('lion'), ([], 0))
+
+    def test_rolled_back_writes_are_not_indexed(self):
+        self.index.rebuild()
+        post = self.add_post('Zebra', 'stripes')
+        post_id = post.id
+        post.title = 'Lion'
+        self.index.index_post(post)
+        db.session.rollback()
+        # A later commit does not apply the rolled back write either
+        self.add_post('Tiger', 'stripes')
+        self.assertEqual(self.index.search('lion'), ([], 0))
+        self.assertEqual(self.index.search('zebra'), ([post_id], 1))
+
+    def test_pagination(self):
+        self.index.rebuild()
+        posts = [self.add_post(f'Post {i}', 'zen') for i in range(5)]
+        first, total = self.index.search('zen', page=1, per_page=2)
+        last, _ = self.index.search('zen', page=3, per_page=2)
+        self.assertEqual(total, 5)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(last), 1)
+        self.assertEqual(len(set(first) | set(last)), 3)
+        self.assertTrue(set(first) <= {post.id for post in posts})
+
+class TestMemoryBackend(SearchBackendTests, unittest.TestCase):
+    backend = 'memory'
+
+class TestSQLiteBackend(SearchBackendTests, unittest.TestCase):
+    backend = 'sqlite'
+
+class TestTokenize(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Work-life Balance, 2024!'), ['work', 'life', 'balance', '2024'])
+        self.assertEqual(tokenize(None), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+import images
+import storage
+
+def jpeg_bytes(color, size=(1600, 1200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+class TestImages(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__, static_folder=self.static.name, static_url_path='/static')
+        self.app.config['UPLOAD_FOLDER'] = os.path.join(self.static.name, 'public')
+        storage.init_app(self.app)
+        images.init_app(self.app)
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+        self.static.cleanup()
+
+    def upload(self, data, filename='photo.jpg'):
+        return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+    @mock.patch('images._submit')
+    def test_save_upload_deduplicates_by_content(self, submit):
+        data = jpeg_bytes('red')
+        first = images.save_upload(self.upload(data, 'a.jpg'))
+        second = images.save_upload(self.upload(data, 'b.jpg'))
+        other = images.save_upload(self.upload(jpeg_bytes('blue'), 'a.jpg'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^public/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertTrue(os.path.isfile(os.path.join(self.static.name, first)))
+        # Identical content is only processed once
+        self.assertEqual(submit.call_count, 2)
+        for call in submit.call_args_list:
+            os.remove(call.args[0])
+
+    def test_rejects_other_file_types(self):
+        self.assertIsNone(images.save_upload(self.upload(b'<script>', 'page.html')))
+
+    def test_render_variants_and_srcset(self):
+        with mock.patch('images._submit') as submit:
+            path = images.save_upload(self.upload(jpeg_bytes('green')))
+        source = submit.call_args.args[0]
+        self.assertIsNone(images.image_variants(path)['webp'])
+
+        images.render_variants(source, path, 'post', storage.get_storage())
+        os.remove(source)
+        with Image.open(os.path.join(self.static.name, images.variant_path(path, 480, 'webp'))) as thumb:
+            self.assertEqual(thumb.size, (480, 360))
+        images._missing.clear()
+        variants = images.image_variants(path)
+        self.assertIn('-480w.webp 480w', variants['webp'])
+        self.assertIn('-1280w.jpg 1280w', variants['jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
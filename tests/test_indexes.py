@@ -0,0 +1,130 @@
+"""Checks with EXPLAIN that the hot queries use the indexes created by the migrations.
+
+Runs against a temporary SQLite database, or the database in
+TEST_DATABASE_URL (for example a scratch MySQL schema).
+"""
+import os
+import re
+import tempfile
+import unittest
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import event
+import schema
+from dbase import db
+from models import Comment, FeedEntry, Post, PostTag, Tag, User
+from pagination import encode_cursor, keyset_page
+from queries import get_author_posts, get_comments_page, get_post_detail
+from tagindex import tag_index
+
+SQLITE_PLAN_RE = re.compile(r'(SCAN|SEARCH) (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+)| USING (INTEGER PRIMARY KEY))?')
+
+
+def explain(connection, statement, parameters):
+    """Returns a {table: index} map of a query plan, None meaning a full table scan"""
+    plan = {}
+    if connection.dialect.name == 'sqlite':
+        for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+            match = SQLITE_PLAN_RE.match(row[-1])
+            if match:
+                kind, table, index, rowid = match.groups()
+                plan[table] = 'PRIMARY' if rowid else index
+    else:
+        for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings():
+            plan[row['table']] = None if row['type'] == 'ALL' else row['key']
+    return plan
+
+
+class TestIndexes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+            'TEST_DATABASE_URL', 'sqlite:///' + os.path.join(self.tmp.name, 'test.db')
+        )
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        schema.upgrade()
+
+        user = User(username='testuser', email='test@example.com', password='x')
+        tag = Tag(name='Burnout')
+        db.session.add_all([user, tag])
+        db.session.flush()
+        post = Post(title='Post', body='Body', author_id=user.id, status='published', created=datetime(2024, 1, 1))
+        db.session.add(post)
+        db.session.flush()
+        db.session.add_all([
+            PostTag(post_id=post.id, tag_id=tag.id),
+            Comment(post_id=post.id, author_id=user.id, body='Comment', created=datetime(2024, 1, 2)),
+            FeedEntry(id=post.id, author_id=user.id, username='testuser', title='Post', excerpt='Body',
+                      created=post.created),
+        ])
+        db.session.commit()
+        self.user_id, self.post_id = user.id, post.id
+
+    def tearDown(self):
+        db.session.remove()
+        schema.command.downgrade(schema.alembic_config(), 'base')
+        db.engine.dispose()
+        self.ctx.pop()
+        self.tmp.cleanup()
+
+    def plans(self, run):
+        """Runs a function and returns the merged query plans of the SELECTs it issued"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            run()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        db.session.remove()
+        self.assertTrue(statements)
+
+        plan = {}
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                plan.update(explain(connection, statement, parameters))
+        return plan
+
+    def assertNoFullScans(self, plan):
+        scanned = [table for table, index in plan.items() if index is None]
+        self.assertEqual(scanned, [], f'full table scan in {plan}')
+
+    def test_feed_page(self):
+        cursor = encode_cursor(datetime(2024, 2, 1), 10)
+        plan = self.plans(lambda: keyset_page(
+            FeedEntry.query, FeedEntry.created, FeedEntry.id, cursor, 10
+        ))
+        self.assertEqual(plan['feed_entries'], 'ix_feed_entries_created_id')
+
+    def test_profile_posts(self):
+        plan = self.plans(lambda: get_author_posts(self.user_id, 'published'))
+        self.assertEqual(plan['posts'], 'ix_posts_author_id_status_created')
+
+    def test_tag_index_load(self):
+        tag_index.init_app(self.app)
+        tag_index.clear()
+        try:
+            plan = self.plans(lambda: tag_index.query(all_of=['Burnout']))
+        finally:
+            tag_index.clear()
+        # Every published post is loaded once, the tags of each are looked up by key
+        self.assertNoFullScans({table: index for table, index in plan.items() if table != 'posts'})
+        self.assertEqual(plan['tags'], 'PRIMARY')
+
+    def test_post_detail(self):
+        def run():
+            get_post_detail(self.post_id)
+            get_comments_page(self.post_id, None, 50)
+        plan = self.plans(run)
+        self.assertNoFullScans(plan)
+        self.assertEqual(plan['comments'], 'ix_comments_post_id_created_id')
+
+if __name__ == '__main__':
+    unittest.main()
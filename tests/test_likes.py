@@ -0,0 +1,77 @@
+import threading
+import unittest
+from unittest import mock
+from flask import Flask
+from dbase import db
+from likes import LikeBuffer, LocalCounterStore
+from models import Post, User
+
+class TestLikeBuffer(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.likes = LikeBuffer(self.app)
+        # Flushes are driven by the tests, not the background thread
+        self.likes._flusher = object()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        user = User(username='testuser', email='test@example.com', password='x')
+        db.session.add(user)
+        db.session.flush()
+        self.post = Post(title='Post', body='Body', author_id=user.id, status='published', like_count=5)
+        db.session.add(self.post)
+        db.session.commit()
+
+    def tearDown(self):
+        self.likes._store.drain()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def stored_count(self):
+        return db.session.query(Post.like_count).filter(Post.id == self.post.id).scalar()
+
+    def test_count_merges_pending_likes(self):
+        self.likes.like(self.post.id)
+        self.likes.like(self.post.id)
+        self.assertEqual(self.stored_count(), 5)
+        self.assertEqual(self.likes.count(self.post.id, self.stored_count()), 7)
+
+    def test_flush_applies_aggregated_delta(self):
+        for _ in range(3):
+            self.likes.like(self.post.id)
+        self.assertEqual(self.likes.flush(), 1)
+        self.assertEqual(self.stored_count(), 8)
+        self.assertEqual(self.likes.count(self.post.id, self.stored_count()), 8)
+        self.assertEqual(self.likes.flush(), 0)
+
+    def test_failed_flush_keeps_deltas(self):
+        self.likes.like(self.post.id)
+        with mock.patch.object(db.session, 'execute', side_effect=RuntimeError('down')):
+            with self.assertRaises(RuntimeError):
+                self.likes.flush()
+        self.assertEqual(self.likes.count(self.post.id, self.stored_count()), 6)
+        self.likes.flush()
+        self.assertEqual(self.stored_count(), 6)
+
+class TestLocalCounterStore(unittest.TestCase):
+    def test_concurrent_increments_are_not_lost(self):
+        store = LocalCounterStore()
+
+        def work():
+            for _ in range(1000):
+                store.incr(1)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.drain(), {1: 8000})
+        self.assertEqual(store.pending(1), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import smtplib
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from flask import Flask
+from flask_mail import Mail
+from dbase import db
+from mailqueue import MailQueue, retry_delay
+from models import OutboundMail
+
+class LocalSMTP:
+    """Stand-in for smtplib.SMTP that records connections and deliveries"""
+    connections = []
+    fail_for = set()
+
+    def __init__(self, host, port):
+        self.sent = []
+        LocalSMTP.connections.append(self)
+
+    def set_debuglevel(self, level):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def sendmail(self, sender, recipients, message, mail_options=(), rcpt_options=()):
+        if set(recipients) & self.fail_for:
+            raise smtplib.SMTPDataError(451, b'Try again later')
+        self.sent.append(recipients)
+
+    def quit(self):
+        pass
+
+class TestMailQueue(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite://',
+            MAIL_SERVER='localhost',
+            MAIL_USE_TLS=False,
+            MAIL_DEFAULT_SENDER='noreply@example.com',
+            MAIL_QUEUE_THREAD=False,
+            MAIL_RATE_LIMIT=0,
+        )
+        db.init_app(self.app)
+        Mail(self.app)
+        self.queue = MailQueue(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        LocalSMTP.connections = []
+        patcher = mock.patch('flask_mail.smtplib.SMTP', LocalSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def statuses(self):
+        return dict(db.session.query(OutboundMail.recipient, OutboundMail.status))
+
+    def test_batch_reuses_one_connection(self):
+        self.queue.enqueue('Hello', ['a@example.com', 'b@example.com', 'c@example.com'], 'Body')
+        self.assertEqual(self.queue.drain(), 3)
+        self.assertEqual(len(LocalSMTP.connections), 1)
+        self.assertEqual(len(LocalSMTP.connections[0].sent), 3)
+        self.assertEqual(set(self.statuses().values()), {'sent'})
+        self.assertEqual(self.queue.drain(), 0)
+
+    def test_failed_message_is_retried_with_backoff(self):
+        self.queue.enqueue('Hello', ['a@example.com', 'b@example.com'], 'Body')
+        with mock.patch.object(LocalSMTP, 'fail_for', {'b@example.com'}):
+            self.queue.drain()
+        self.assertEqual(self.statuses(), {'a@example.com': 'sent', 'b@example.com': 'pending'})
+        failed = OutboundMail.query.filter_by(recipient='b@example.com').one()
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.next_attempt, datetime.now() + timedelta(seconds=20))
+        self.assertIn('SMTPDataError', failed.last_error)
+
+        # Not due yet, then sent once its retry time has come
+        self.assertEqual(self.queue.drain(), 0)
+        failed.next_attempt = datetime.now()
+        db.session.commit()
+        self.assertEqual(self.queue.drain(), 1)
+        self.assertEqual(self.statuses()['b@example.com'], 'sent')
+
+    def test_gives_up_after_max_attempts(self):
+        self.app.config['MAIL_MAX_ATTEMPTS'] = 1
+        self.queue.enqueue('Hello', ['a@example.com'], 'Body')
+        with mock.patch.object(LocalSMTP, 'sendmail', side_effect=smtplib.SMTPDataError(451, b'No')):
+            self.queue.drain()
+        self.assertEqual(self.statuses(), {'a@example.com': 'failed'})
+
+    def test_retry_delay_is_capped(self):
+        self.assertEqual([retry_delay(n, 30, 200) for n in (1, 2, 3, 4)], [30, 60, 120, 200])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from dbase import db
+from models import Post, User
+from pagination import decode_cursor, encode_cursor, keyset_page
+
+class TestPagination(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        user = User(username='testuser', email='test@example.com', password='x')
+        db.session.add(user)
+        db.session.flush()
+        start = datetime(2024, 1, 1)
+        # Two posts share a timestamp so the id tie-breaker is exercised
+        for i in range(7):
+            created = start + timedelta(days=min(i, 5))
+            db.session.add(Post(title=f'Post {i}', body='Body', author_id=user.id,
+                                status='published', created=created))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_cursor_round_trip(self):
+        created = datetime(2024, 5, 17, 10, 30, 1)
+        self.assertEqual(decode_cursor(encode_cursor(created, 42)), (created, 42))
+
+    def test_decode_invalid_cursor(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+
+    def test_pages_cover_all_rows_once(self):
+        seen = []
+        cursor = None
+        while True:
+            rows, cursor = keyset_page(Post.query, Post.created, Post.id, cursor, 3)
+            seen.extend(row.title for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(seen, ['Post 6', 'Post 5', 'Post 4', 'Post 3', 'Post 2', 'Post 1', 'Post 0'])
+
+    def test_last_page_has_no_cursor(self):
+        rows, cursor = keyset_page(Post.query, Post.created, Post.id, None, 7)
+        self.assertEqual(len(rows), 7)
+        self.assertIsNone(cursor)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import signal
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash
+from passwords import PasswordHasher, needs_rehash, normalize_method
+
+class TestPasswordHasher(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.hasher = PasswordHasher(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_normalize_method(self):
+        self.assertEqual(normalize_method('scrypt'), 'scrypt:32768:8:1')
+        self.assertEqual(normalize_method('pbkdf2:sha512'), 'pbkdf2:sha512:600000')
+        self.assertEqual(normalize_method('scrypt:16384:8:1'), 'scrypt:16384:8:1')
+        with self.assertRaises(ValueError):
+            normalize_method('md5')
+
+    def test_hash_and_verify(self):
+        password_hash = self.hasher.hash('secret')
+        self.assertFalse(needs_rehash(password_hash, 'pbkdf2:sha256:2000'))
+        self.assertEqual(self.hasher.verify(password_hash, 'secret'), (True, None))
+        self.assertEqual(self.hasher.verify(password_hash, 'wrong'), (False, None))
+        stats = self.hasher.stats()
+        self.assertEqual((stats['hash']['count'], stats['verify']['count']), (1, 2))
+        self.assertGreater(stats['verify']['wall_ms']['p99'], 0)
+
+    def test_outdated_hash_is_upgraded_on_success(self):
+        old_hash = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+        self.assertEqual(self.hasher.verify(old_hash, 'wrong'), (False, None))
+        matches, upgraded = self.hasher.verify(old_hash, 'secret')
+        self.assertTrue(matches)
+        self.assertTrue(upgraded.startswith('pbkdf2:sha256:2000$'))
+        self.assertEqual(self.hasher.verify(upgraded, 'secret'), (True, None))
+
+    def test_process_pool(self):
+        self.app.config['PASSWORD_HASH_WORKERS'] = 1
+        try:
+            password_hash = self.hasher.hash('secret')
+            self.assertEqual(self.hasher.verify(password_hash, 'secret'), (True, None))
+        finally:
+            self.hasher._executor.shutdown()
+
+    def test_dead_worker_is_replaced(self):
+        self.app.config['PASSWORD_HASH_WORKERS'] = 1
+        try:
+            self.hasher.hash('secret')
+            broken = self.hasher._executor
+            for pid in list(broken._processes):
+                os.kill(pid, signal.SIGKILL)
+            password_hash = self.hasher.hash('secret')
+            self.assertIsNot(self.hasher._executor, broken)
+            self.assertEqual(self.hasher.verify(password_hash, 'secret'), (True, None))
+        finally:
+            self.hasher._executor.shutdown()
+
+    def test_full_queue_fails_fast(self):
+        for _ in range(self.app.config['PASSWORD_HASH_QUEUE']):
+            self.hasher._slots.acquire()
+        with self.assertRaises(ServiceUnavailable) as raised:
+            self.hasher.hash('secret')
+        self.assertEqual(raised.exception.retry_after, 1)
+        self.assertEqual(self.hasher.stats()['hash']['rejected'], 1)
+
+    def free_slots(self):
+        taken = 0
+        while self.hasher._slots.acquire(blocking=False):
+            taken += 1
+        for _ in range(taken):
+            self.hasher._slots.release()
+        return taken
+
+    def test_timed_out_hash_keeps_its_slot(self):
+        self.app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_TIMEOUT=0.05)
+        self.hasher._executor = ThreadPoolExecutor(1)
+        done = threading.Event()
+        try:
+            with self.assertRaises(ServiceUnavailable):
+                self.hasher._run('hash', lambda: (done.wait(), 0))
+            self.assertEqual(self.hasher.stats()['hash']['rejected'], 1)
+            # The hash still runs in the pool and holds its slot
+            self.assertEqual(self.free_slots(), self.app.config['PASSWORD_HASH_QUEUE'] - 1)
+        finally:
+            done.set()
+            self.hasher._executor.shutdown()
+        self.assertEqual(self.free_slots(), self.app.config['PASSWORD_HASH_QUEUE'])
+
+if __name__ == '__main__':
+    unittest.main()
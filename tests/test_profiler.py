@@ -0,0 +1,64 @@
+import tempfile
+import unittest
+from flask import Flask, render_template_string
+from dbase import db
+from models import Post
+from profiler import Profiler, percentile, summarize
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.dump_dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app.config['PROFILER_ENABLED'] = True
+        self.app.config['PROFILER_TOKEN'] = 'secret'
+        self.app.config['PROFILER_DIR'] = self.dump_dir.name
+        db.init_app(self.app)
+        self.profiler = Profiler(self.app)
+
+        @self.app.route('/posts')
+        def posts():
+            count = Post.query.count()
+            return render_template_string('{{ count }} posts', count=count)
+
+        with self.app.app_context():
+            db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.dump_dir.cleanup()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_records_sql_and_render(self):
+        self.client.get('/posts')
+        self.client.get('/posts')
+        records = self.profiler.records()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['endpoint'], 'posts')
+        self.assertEqual(records[0]['sql_count'], 1)
+        self.assertEqual(len(records[0]['queries']), 1)
+        self.assertGreater(records[0]['render_ms'], 0)
+
+        report = summarize(records)
+        self.assertEqual(report['endpoints']['posts']['count'], 2)
+
+    def test_report_requires_token(self):
+        self.client.get('/posts')
+        self.assertEqual(self.client.get('/_profiler').status_code, 404)
+        response = self.client.get('/_profiler', headers={'X-Profiler-Token': 'secret'})
+        self.assertEqual(response.json['endpoints']['posts']['count'], 1)
+
+    def test_cli_report(self):
+        self.client.get('/posts')
+        result = self.app.test_cli_runner().invoke(args=['profile-report'])
+        self.assertIn('posts', result.output)
+        self.assertIn('SELECT count(*)', result.output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from flask import Flask
+from __init__ import create_app
+from config import Config
+from dbase import db
+from models import Comment, Post, Tag, User
+from queries import get_comments_page, get_post_detail
+from querycount import QueryBudgetExceeded, count_queries, query_budget
+
+class TestQueries(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app.config['TESTING'] = True
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        author = User(username='author', email='author@example.com', password='x')
+        self.post = Post(title='Post', body='Body', author=author, status='published',
+                         tags=[Tag(name='Burnout'), Tag(name='Mental Health')])
+        db.session.add(self.post)
+        start = datetime(2024, 1, 1)
+        for i in range(30):
+            commenter = User(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            db.session.add(Comment(post=self.post, author=commenter, body=f'Comment {i}',
+                                   created=start + timedelta(minutes=i)))
+        db.session.commit()
+        self.post_id = self.post.id
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_post_detail_query_count(self):
+        with count_queries() as counter:
+            post = get_post_detail(self.post_id)
+            self.assertEqual(post.author.username, 'author')
+            self.assertEqual(sorted(tag.name for tag in post.tags), ['Burnout', 'Mental Health'])
+        self.assertEqual(counter.count, 2)
+
+    def test_comments_page_query_count(self):
+        with count_queries() as counter:
+            comments, cursor = get_comments_page(self.post_id, None, 20)
+            usernames = [comment.author.username for comment in comments]
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(usernames, [f'user{i}' for i in range(20)])
+
+        comments, cursor = get_comments_page(self.post_id, cursor, 20)
+        self.assertEqual([comment.body for comment in comments], [f'Comment {i}' for i in range(20, 30)])
+        self.assertIsNone(cursor)
+
+    def test_query_budget(self):
+        @query_budget(1)
+        def lazy_view():
+            return [comment.author.username for comment in Comment.query.limit(3).all()]
+
+        with self.assertRaises(QueryBudgetExceeded):
+            lazy_view()
+
+class TestViewBudgets(unittest.TestCase):
+    """Requests the budgeted views through the app with overruns raised"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with mock.patch.multiple(
+            Config,
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(self.tmp.name, 'test.db'),
+            UPLOAD_FOLDER=os.path.join(self.tmp.name, 'uploads'),
+            MAIL_QUEUE_THREAD=False,
+            SESSION_COOKIE_SECURE=False,
+            RATELIMIT_ENABLED=False,
+        ):
+            self.app = create_app()
+        self.app.config.update(TESTING=True, QUERY_BUDGET_STRICT=True)
+        with self.app.app_context():
+            db.create_all()
+            author = User(username='author', email='author@example.com', password='x')
+            reader = User(username='reader', email='reader@example.com', password='x')
+            post = Post(title='Post', body='Body', author=author, status='published',
+                        tags=[Tag(name='Burnout'), Tag(name='Mental Health')])
+            db.session.add_all([post, reader])
+            for i in range(60):
+                db.session.add(Comment(post=post, author=reader if i % 2 else author, body=f'Comment {i}',
+                                       created=datetime(2024, 1, 1) + timedelta(minutes=i)))
+            db.session.commit()
+            self.post_id, self.reader_id = post.id, reader.id
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_post_detail(self):
+        response = self.client.get(f'/blog/{self.post_id}/post_detail')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Comment 49', response.data)
+
+    def test_comment(self):
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.reader_id)
+        response = self.client.post(f'/blog/{self.post_id}/comment', data={'body': 'Nice'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(f'/blog/{self.post_id}/comment')
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(Comment.query.filter_by(body='Nice').count(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
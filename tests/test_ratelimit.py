@@ -0,0 +1,101 @@
+import unittest
+from unittest import mock
+from flask import Flask, request
+from flask_login import LoginManager, UserMixin, login_user
+from ratelimit import Limit, LocalBucketStore, RateLimiter
+
+class User(UserMixin):
+    def __init__(self, id):
+        self.id = id
+
+class TestLocalBucketStore(unittest.TestCase):
+    @mock.patch('ratelimit.time.monotonic')
+    def test_bucket_refills_over_time(self, monotonic):
+        store = LocalBucketStore()
+        monotonic.return_value = 100.0
+        self.assertEqual([store.take('k', rate=1, capacity=3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(store.take('k', rate=1, capacity=3), 1.0)
+        # Half a second later half a token is back
+        monotonic.return_value = 100.5
+        self.assertAlmostEqual(store.take('k', rate=1, capacity=3), 0.5)
+        monotonic.return_value = 101.0
+        self.assertEqual(store.take('k', rate=1, capacity=3), 0)
+        # Other keys have their own bucket
+        self.assertEqual(store.take('other', rate=1, capacity=3), 0)
+
+    def test_least_recently_used_buckets_are_evicted(self):
+        store = LocalBucketStore(max_keys=100)
+        for n in range(1000):
+            store.take(f'client{n}', rate=1, capacity=1)
+        self.assertEqual(store.size(), 100)
+
+    def test_limit_rules(self):
+        limit = Limit('30/minute')
+        self.assertEqual((limit.capacity, limit.rate), (30, 0.5))
+        with self.assertRaises(ValueError):
+            Limit('30/fortnight')
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = 'test'
+        login_manager = LoginManager(self.app)
+        login_manager.user_loader(User)
+        limiter = RateLimiter(self.app)
+
+        @self.app.route('/like', methods=['GET', 'POST'])
+        @limiter.limit('2/minute')
+        def like():
+            return 'ok'
+
+        @self.app.route('/comment', methods=['POST'])
+        @limiter.limit('1/minute', key='user')
+        def comment():
+            return 'ok'
+
+        @self.app.route('/login/<int:id>')
+        def login(id):
+            login_user(User(id))
+            return 'ok'
+
+        @self.app.route('/reset', methods=['POST'])
+        @limiter.limit('1/hour', key=lambda: request.form.get('email'))
+        def reset():
+            return 'ok'
+
+        self.client = self.app.test_client()
+
+    def post(self, path, ip='10.0.0.1', client=None, **kwargs):
+        return (client or self.client).post(path, environ_base={'REMOTE_ADDR': ip}, **kwargs)
+
+    def test_exhausted_bucket_answers_429(self):
+        self.assertEqual([self.post('/like').status_code for _ in range(2)], [200, 200])
+        response = self.post('/like')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '30')
+        # Other clients and other methods are not affected
+        self.assertEqual(self.post('/like', ip='10.0.0.2').status_code, 200)
+        self.assertEqual(self.client.get('/like').status_code, 200)
+
+    def test_user_keys(self):
+        alice, bob = self.app.test_client(), self.app.test_client()
+        alice.get('/login/1')
+        bob.get('/login/2')
+        self.assertEqual(self.post('/comment', client=alice).status_code, 200)
+        self.assertEqual(self.post('/comment', client=alice, ip='10.0.0.9').status_code, 429)
+        # Same IP, different user
+        self.assertEqual(self.post('/comment', client=bob).status_code, 200)
+
+    def test_key_function(self):
+        self.assertEqual(self.post('/reset', data={'email': 'a@example.com'}).status_code, 200)
+        self.assertEqual(self.post('/reset', ip='10.0.0.2', data={'email': 'a@example.com'}).status_code, 429)
+        self.assertEqual(self.post('/reset', data={'email': 'b@example.com'}).status_code, 200)
+        # Without a key the limit does not apply
+        self.assertEqual([self.post('/reset').status_code for _ in range(3)], [200, 200, 200])
+
+    def test_disabled(self):
+        self.app.config['RATELIMIT_ENABLED'] = False
+        self.assertEqual({self.post('/like').status_code for _ in range(5)}, {200})
+
+if __name__ == '__main__':
+    unittest.main()
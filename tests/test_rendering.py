@@ -0,0 +1,53 @@
+import unittest
+from flask import Flask
+import rendering
+from dbase import db
+from models import FeedEntry, Post, User
+from rendering import make_excerpt, render_body, render_post
+
+class TestRendering(unittest.TestCase):
+    def test_render_body_keeps_line_breaks(self):
+        self.assertEqual(render_body('one\ntwo'), 'one<br>\ntwo')
+
+    def test_excerpt_is_plain_text_cut_at_a_word(self):
+        self.assertEqual(make_excerpt('<b>Bold</b> &amp;\n\nplain'), 'Bold & plain')
+        excerpt = make_excerpt('word ' * 100, length=50)
+        self.assertLessEqual(len(excerpt), 50)
+        self.assertTrue(excerpt.endswith('word...'))
+
+class TestRerender(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        user = User(username='testuser', email='test@example.com', password='x')
+        db.session.add(user)
+        db.session.flush()
+        self.current = Post(title='Current', body='a\nb', author_id=user.id, status='published')
+        render_post(self.current)
+        self.stale = Post(title='Stale', body='c\nd', author_id=user.id, status='published')
+        db.session.add_all([self.current, self.stale])
+        db.session.flush()
+        db.session.add(FeedEntry(id=self.stale.id, author_id=user.id, username='testuser',
+                                 title='Stale', excerpt='old', created=self.stale.created))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_rerender_updates_outdated_posts_only(self):
+        self.assertEqual(rendering.rerender(batch_size=1), [self.stale.id])
+        db.session.expire_all()
+        self.assertEqual(self.stale.body_html, 'c<br>\nd')
+        self.assertEqual(self.stale.render_version, rendering.RENDER_VERSION)
+        self.assertEqual(db.session.get(FeedEntry, self.stale.id).excerpt, 'c d')
+        self.assertEqual(rendering.rerender(), [])
+        self.assertEqual(len(rendering.rerender(everything=True)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from flask import Flask, jsonify
+from sqlalchemy import event
+import feed
+import replicas
+from __init__ import create_app
+from config import Config
+from dbase import db
+from fulltext import search_index
+from models import FeedEntry, Post, Tag, User
+from replicas import read_replica
+
+class TestReplicaRouting(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config.update(
+            SECRET_KEY='test',
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(self.tmp.name, 'primary.db'),
+            SQLALCHEMY_REPLICA_URIS=['sqlite:///' + os.path.join(self.tmp.name, 'replica.db')],
+        )
+        replicas.init_app(self.app)
+        db.init_app(self.app)
+
+        @self.app.route('/read')
+        @read_replica
+        def read():
+            return jsonify([tag.name for tag in Tag.query.order_by(Tag.id)])
+
+        @self.app.route('/write', methods=['POST'])
+        def write():
+            db.session.add(Tag(name='new'))
+            db.session.commit()
+            return 'ok'
+
+        @self.app.route('/write_then_read', methods=['POST'])
+        @read_replica
+        def write_then_read():
+            db.session.add(Tag(name='mine'))
+            db.session.flush()
+            return jsonify([tag.name for tag in Tag.query.order_by(Tag.id)])
+
+        # The replica is a second local database holding different rows
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(Tag(name='primary'))
+            db.session.commit()
+            with self.app.extensions['replicas'].engines[0].begin() as connection:
+                Tag.__table__.create(connection)
+                connection.execute(Tag.__table__.insert(), [{'name': 'replica'}])
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        self.app.extensions['replicas'].dispose()
+        self.tmp.cleanup()
+
+    def test_read_only_view_uses_replica(self):
+        self.assertEqual(self.client.get('/read').json, ['replica'])
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with mock.patch('replicas.replica_lag', return_value=60):
+            self.assertEqual(self.client.get('/read').json, ['primary'])
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        with mock.patch('replicas.replica_lag', side_effect=OSError('down')):
+            self.assertEqual(self.client.get('/read').json, ['primary'])
+
+    def test_server_not_replicating_falls_back_to_primary(self):
+        engine = mock.MagicMock()
+        engine.dialect.name = 'mysql'
+        connection = engine.connect.return_value.__enter__.return_value
+        connection.exec_driver_sql.return_value.mappings.return_value.first.return_value = None
+        self.assertIsNone(replicas.replica_lag(engine))
+        with mock.patch('replicas.replica_lag', return_value=None):
+            self.assertEqual(self.client.get('/read').json, ['primary'])
+
+    def test_reads_after_a_write_use_primary(self):
+        self.assertEqual(self.client.post('/write_then_read').json, ['primary', 'mine'])
+
+    def test_client_reads_its_own_writes(self):
+        self.client.post('/write')
+        self.assertEqual(self.client.get('/read').json, ['primary', 'new'])
+        with self.client.session_transaction() as session:
+            session.pop(replicas.STICKY_KEY)
+        self.assertEqual(self.client.get('/read').json, ['replica'])
+
+class TestSearchOnReplica(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        primary = os.path.join(self.tmp.name, 'primary.db')
+        replica = os.path.join(self.tmp.name, 'replica.db')
+        with mock.patch.multiple(
+            Config,
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + primary,
+            SQLALCHEMY_REPLICA_URIS=['sqlite:///' + replica],
+            SEARCH_BACKEND='sqlite',
+            UPLOAD_FOLDER=os.path.join(self.tmp.name, 'uploads'),
+            MAIL_QUEUE_THREAD=False,
+            SESSION_COOKIE_SECURE=False,
+            RATELIMIT_ENABLED=False,
+        ):
+            self.app = create_app()
+        with self.app.app_context():
+            db.create_all()
+            user = User(username='alice', email='alice@example.com', password='x')
+            db.session.add(user)
+            db.session.flush()
+            post = Post(title='Zen garden', body='Raking gravel', author_id=user.id, status='published')
+            db.session.add(post)
+            db.session.flush()
+            feed.sync_post(post)
+            search_index.index_post(post)
+            db.session.commit()
+            db.engine.dispose()
+            # The replica is a copy, then the primary drifts from it
+            shutil.copy(primary, replica)
+            db.session.query(FeedEntry).update({'title': 'Primary copy'})
+            db.session.commit()
+        self.replica_statements = []
+        event.listen(self.app.extensions['replicas'].engines[0], 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: self.replica_statements.append(statement))
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        self.app.extensions['replicas'].dispose()
+        self.tmp.cleanup()
+
+    def test_search_queries_run_on_replica(self):
+        response = self.client.get('/blog/search?q=gravel')
+        self.assertIn(b'Zen garden', response.data)
+        self.assertNotIn(b'Primary copy', response.data)
+        statements = ' '.join(self.replica_statements)
+        self.assertIn('posts_fts MATCH', statements)
+        self.assertIn('FROM feed_entries', statements)
+
+if __name__ == '__main__':
+    unittest.main()
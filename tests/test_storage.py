@@ -0,0 +1,97 @@
+import io
+import os
+import tempfile
+import unittest
+from flask import Flask
+import storage
+
+class NotFound(Exception):
+    response = {'Error': {'Code': '404'}}
+
+class LocalS3Client:
+    """Stand-in for a MinIO/S3 endpoint implementing the calls S3Storage uses"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, 'rb') as f:
+            self.objects[(bucket, key)] = (f.read(), ExtraArgs)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound()
+        return {}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+class StorageTests:
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'source.jpg')
+        with open(self.source, 'wb') as f:
+            f.write(b'image bytes')
+        self.name = storage.content_name(storage.hash_file(self.source), '.jpg')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_open_delete(self):
+        self.assertFalse(self.storage.exists(self.name))
+        self.storage.put(self.name, self.source)
+        self.assertTrue(self.storage.exists(self.name))
+        with self.storage.open(self.name) as f:
+            self.assertEqual(f.read(), b'image bytes')
+        self.storage.delete(self.name)
+        self.assertFalse(self.storage.exists(self.name))
+
+class TestLocalStorage(StorageTests, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = storage.LocalStorage(os.path.join(self.tmp.name, 'public'))
+
+    def test_sharded_layout(self):
+        self.storage.put(self.name, self.source)
+        digest = storage.hash_file(self.source)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp.name, 'public', digest[:2], digest[2:4], digest + '.jpg')))
+
+class TestS3Storage(StorageTests, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = LocalS3Client()
+        self.storage = storage.S3Storage('uploads', 'https://cdn.example.com/', client=self.client)
+
+    def test_url_and_headers(self):
+        self.storage.put(self.name, self.source)
+        self.assertEqual(self.storage.url(self.name), 'https://cdn.example.com/' + self.name)
+        extra = self.client.objects[('uploads', self.name)][1]
+        self.assertEqual(extra['CacheControl'], storage.IMMUTABLE)
+        self.assertEqual(extra['ContentType'], 'image/jpeg')
+
+class TestStaticCacheHeaders(unittest.TestCase):
+    def test_hashed_files_are_immutable(self):
+        with tempfile.TemporaryDirectory() as static:
+            app = Flask(__name__, static_folder=static, static_url_path='/static')
+            app.config['UPLOAD_FOLDER'] = os.path.join(static, 'public')
+            storage.init_app(app)
+            name = storage.content_name('ab' * 32, '.jpg')
+            os.makedirs(os.path.dirname(os.path.join(static, name)))
+            for filename in (name, 'public/legacy.jpg'):
+                with open(os.path.join(static, filename), 'wb') as f:
+                    f.write(b'x')
+
+            client = app.test_client()
+            hashed = client.get('/static/' + name)
+            self.assertEqual(hashed.headers['Cache-Control'], storage.IMMUTABLE)
+            self.assertIsNotNone(hashed.headers.get('ETag'))
+            hashed.close()
+            legacy = client.get('/static/public/legacy.jpg')
+            self.assertNotIn('immutable', legacy.headers.get('Cache-Control', ''))
+            legacy.close()
+
+if __name__ == '__main__':
+    unittest.main()
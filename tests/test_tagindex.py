@@ -0,0 +1,118 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from dbase import db
+from models import Post, PostTag, Tag, User
+from tagindex import TagIndex
+
+TAG_NAMES = ['Burnout', 'Zen', 'Sleep', 'Focus']
+
+class TestTagIndex(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.index = TagIndex(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        user = User(username='testuser', email='test@example.com', password='x')
+        self.tags = {name: Tag(name=name) for name in TAG_NAMES}
+        db.session.add_all([user, *self.tags.values()])
+        db.session.flush()
+        self.user_id = user.id
+        rng = random.Random(1)
+        self.start = datetime(2024, 1, 1)
+        for n in range(60):
+            self.add_post(self.start + timedelta(hours=rng.randrange(1000)), rng.sample(TAG_NAMES, rng.randint(0, 3)),
+                          status='published' if n % 10 else 'draft')
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_post(self, created, names, status='published'):
+        post = Post(title='Post', body='Body', author_id=self.user_id, status=status, created=created)
+        db.session.add(post)
+        db.session.flush()
+        db.session.add_all([PostTag(post_id=post.id, tag_id=self.tags[name].id) for name in names])
+        return post
+
+    def expected(self, all_of=(), any_of=(), none_of=()):
+        """Returns the matching post ids newest first, computed from the database"""
+        posts = Post.query.filter_by(status='published').order_by(Post.created.desc(), Post.id.desc()).all()
+        ids = []
+        for post in posts:
+            names = {tag.name for tag in post.tags}
+            if (set(all_of) <= names and (not any_of or names & set(any_of)) and not names & set(none_of)):
+                ids.append(post.id)
+        return ids
+
+    def pages(self, all_of=(), any_of=(), none_of=(), page_size=7):
+        """Returns every matching id by following the cursors"""
+        ids, cursor, total = self.index.query(all_of, any_of, none_of, None, page_size)
+        while cursor:
+            page, cursor, _ = self.index.query(all_of, any_of, none_of, cursor, page_size)
+            ids.extend(page)
+        self.assertEqual(len(ids), total)
+        return ids
+
+    def assertMatchesDatabase(self):
+        rng = random.Random(2)
+        for _ in range(30):
+            all_of, any_of, none_of = (rng.sample(TAG_NAMES, rng.randint(0, 2)) for _ in range(3))
+            self.assertEqual(self.pages(all_of, any_of, none_of), self.expected(all_of, any_of, none_of),
+                             (all_of, any_of, none_of))
+
+    def test_queries(self):
+        self.assertMatchesDatabase()
+        self.assertEqual(self.pages(), self.expected())
+        self.assertEqual(self.pages(['Nope']), [])
+
+    def test_counts(self):
+        counts = self.index.counts()
+        self.assertEqual(counts, {name: len(self.expected([name])) for name in TAG_NAMES})
+
+    def test_incremental_updates(self):
+        self.pages()
+        newest = self.add_post(self.start + timedelta(days=100), ['Zen'])
+        db.session.commit()
+        self.index.sync_post(newest)
+
+        # An old draft published, retagged
+        draft = Post.query.filter_by(status='draft').first()
+        db.session.query(PostTag).filter_by(post_id=draft.id).delete()
+        db.session.add(PostTag(post_id=draft.id, tag_id=self.tags['Sleep'].id))
+        draft.status = 'published'
+        db.session.commit()
+        db.session.expire(draft)
+        self.index.sync_post(draft)
+
+        # A post unpublished, another removed
+        published = Post.query.filter_by(status='published').order_by(Post.id).all()
+        published[0].status = 'draft'
+        db.session.commit()
+        self.index.sync_post(published[0])
+        removed_id = published[1].id
+        db.session.query(PostTag).filter_by(post_id=removed_id).delete()
+        db.session.delete(published[1])
+        db.session.commit()
+        self.index.remove_posts([removed_id])
+
+        self.assertEqual(self.pages(['Zen'])[0], newest.id)
+        self.assertMatchesDatabase()
+
+    def test_reload_after_timeout(self):
+        self.app.config['TAG_INDEX_TIMEOUT'] = 0
+        self.pages()
+        # Added by another worker, without sync_post
+        post = self.add_post(self.start + timedelta(days=100), ['Focus'])
+        db.session.commit()
+        self.assertEqual(self.pages(['Focus'])[0], post.id)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from flask import Flask
+from dbase import db
+from models import Tag
+from querycount import count_queries
+from tags import resolve_tags, tag_cache
+
+class TestTags(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        tag_cache.clear()
+        db.session.add_all([Tag(name='Burnout'), Tag(name='Mental Health')])
+        db.session.commit()
+
+    def tearDown(self):
+        tag_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_resolves_existing_and_creates_missing(self):
+        with count_queries() as counter:
+            ids = resolve_tags(['Burnout', 'Focus', 'Sleep', 'Burnout', ' '])
+        # One IN query, one INSERT for both new tags, one read back
+        self.assertEqual(counter.count, 3)
+        self.assertEqual(list(ids), ['Burnout', 'Focus', 'Sleep'])
+        db.session.commit()
+        self.assertEqual(Tag.query.count(), 4)
+        self.assertEqual(ids['Focus'], Tag.query.filter_by(name='Focus').one().id)
+
+    def test_insert_is_idempotent(self):
+        first = resolve_tags(['Focus'])
+        tag_cache.clear()
+        second = resolve_tags(['Focus'])
+        self.assertEqual(first, second)
+        self.assertEqual(Tag.query.filter_by(name='Focus').count(), 1)
+
+    def test_cache_serves_known_tags(self):
+        self.assertEqual(tag_cache.names(), ['Burnout', 'Mental Health'])
+        with count_queries() as counter:
+            ids = resolve_tags(['Mental Health'])
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(ids, {'Mental Health': Tag.query.filter_by(name='Mental Health').one().id})
+
+if __name__ == '__main__':
+    unittest.main()
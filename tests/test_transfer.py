@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+from datetime import date, datetime
+from unittest import mock
+from flask import Flask
+import transfer
+from dbase import db
+from models import Comment, Post, PostTag, Tag, User
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.export_dir = os.path.join(self.tmp.name, 'export')
+        self.source = self.make_app('source.db')
+        self.target = self.make_app('target.db')
+
+        with self.source.app_context():
+            users = [
+                User(username='alice', email='alice@example.com', password='x', date_of_birth=date(1990, 5, 1)),
+                User(username='bob', email='bob@example.com', password='y', bio='Line\nbreak, "quoted"'),
+            ]
+            tags = [Tag(name='Burnout'), Tag(name='Zen')]
+            db.session.add_all(users + tags)
+            db.session.flush()
+            for n in range(5):
+                post = Post(title=f'Post {n}', body='Body', author_id=users[n % 2].id, status='published',
+                            created=datetime(2024, 1, 1, 12, 0, n, 500))
+                db.session.add(post)
+                db.session.flush()
+                db.session.add_all([
+                    PostTag(post_id=post.id, tag_id=tags[n % 2].id),
+                    Comment(post_id=post.id, author_id=users[(n + 1) % 2].id, body=f'Comment {n}',
+                            created=datetime(2024, 1, 2)),
+                ])
+            db.session.commit()
+
+        # The target already has rows, one of them the same user and tag
+        with self.target.app_context():
+            existing = User(username='bob', email='bob@example.com', password='z')
+            other = User(username='carol', email='carol@example.com', password='z')
+            db.session.add_all([other, existing, Tag(name='Zen')])
+            db.session.flush()
+            db.session.add(Post(title='Existing', body='Body', author_id=other.id, status='published'))
+            db.session.commit()
+
+    def tearDown(self):
+        for app in (self.source, self.target):
+            with app.app_context():
+                db.session.remove()
+                db.engine.dispose()
+        self.tmp.cleanup()
+
+    def make_app(self, name):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.tmp.name, name)
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+        return app
+
+    def snapshot(self):
+        """Returns the content of a database in terms of natural keys"""
+        posts = {
+            post.title: (post.author.email, post.created, sorted(tag.name for tag in post.tags),
+                         sorted((comment.author.email, comment.body) for comment in post.comments))
+            for post in Post.query.filter(Post.title != 'Existing')
+        }
+        users = {user.email: (user.username, user.date_of_birth, user.bio) for user in User.query}
+        return posts, users
+
+    def assertTransferred(self):
+        with self.source.app_context():
+            expected_posts, expected_users = self.snapshot()
+        with self.target.app_context():
+            posts, users = self.snapshot()
+            self.assertEqual(posts, expected_posts)
+            self.assertEqual(users['alice@example.com'], expected_users['alice@example.com'])
+            # Existing rows are kept and merged into, not duplicated
+            self.assertEqual(users['bob@example.com'][0], 'bob')
+            self.assertEqual(User.query.count(), 3)
+            self.assertEqual(Tag.query.count(), 2)
+            self.assertEqual(Post.query.count(), 6)
+
+    def transfer(self, fmt, chunk_size=2):
+        with self.source.app_context():
+            counts = transfer.export_data(self.export_dir, fmt, chunk_size)
+        self.assertEqual(counts, {'users': 2, 'tags': 2, 'posts': 5, 'post_tags': 5, 'comments': 5})
+        with self.target.app_context():
+            return transfer.import_data(self.export_dir, fmt, chunk_size)
+
+    def test_ndjson(self):
+        counts = self.transfer('ndjson')
+        self.assertEqual(counts, {'users': 1, 'tags': 1, 'posts': 5, 'post_tags': 5, 'comments': 5})
+        self.assertTransferred()
+
+    def test_csv(self):
+        self.transfer('csv')
+        self.assertTransferred()
+
+    def test_taken_username_is_renamed(self):
+        with self.target.app_context():
+            db.session.add(User(username='alice', email='alice@elsewhere.example', password='z'))
+            db.session.commit()
+        self.transfer('ndjson')
+        with self.source.app_context():
+            expected_posts, _ = self.snapshot()
+        with self.target.app_context():
+            posts, users = self.snapshot()
+            self.assertEqual(posts, expected_posts)
+            self.assertEqual(users['alice@example.com'][0], 'alice-2')
+            self.assertEqual(users['alice@elsewhere.example'][0], 'alice')
+            self.assertEqual(User.query.count(), 4)
+
+    def test_import_is_resumable(self):
+        write_checkpoint = transfer.write_checkpoint
+        calls = []
+
+        def crash(path, checkpoint):
+            # Fails after a chunk of posts is committed but before it is recorded
+            calls.append(checkpoint.get('posts', {}).get('done'))
+            if calls.count(2) == 1 and checkpoint['posts']['done'] == 2:
+                raise OSError('disk full')
+            write_checkpoint(path, checkpoint)
+
+        with mock.patch.object(transfer, 'write_checkpoint', crash):
+            with self.assertRaises(OSError):
+                self.transfer('ndjson')
+        with self.target.app_context():
+            self.assertEqual(Post.query.count(), 3)
+            transfer.import_data(self.export_dir, 'ndjson', 2)
+            # Running it again once complete imports nothing
+            self.assertEqual(set(transfer.import_data(self.export_dir, 'ndjson', 2).values()), {0})
+        self.assertTransferred()
+
+if __name__ == '__main__':
+    unittest.main()
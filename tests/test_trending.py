@@ -0,0 +1,99 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+import feed
+import trending
+from dbase import db
+from likes import LikeBuffer
+from models import Comment, Post, PostScore, User
+
+HOUR = timedelta(hours=1)
+
+class TestTrending(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        trending.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.user = User(username='testuser', email='test@example.com', password='x')
+        db.session.add(self.user)
+        db.session.flush()
+        self.now = datetime(2024, 6, 1, 12)
+        self.posts = [self.add_post(f'Post {n}') for n in range(8)]
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_post(self, title, status='published'):
+        post = Post(title=title, body='Body', author_id=self.user.id, status=status, created=self.now - 48 * HOUR)
+        db.session.add(post)
+        db.session.flush()
+        feed.sync_post(post)
+        return post
+
+    def top_ids(self, **kwargs):
+        return [entry.id for entry in trending.top(now=self.now, **kwargs)]
+
+    def test_recent_engagement_ranks_higher(self):
+        first, second, third = self.posts[:3]
+        # 4 likes a day ago weigh as much as 1 like now with a 12 hour half life
+        trending.record_likes({first.id: 4}, now=self.now - 24 * HOUR)
+        trending.record_likes({second.id: 2}, now=self.now)
+        trending.record_comment(third.id, now=self.now - HOUR)
+        db.session.commit()
+        self.assertEqual(self.top_ids(), [third.id, second.id, first.id])
+
+        trending.record_likes({first.id: 8}, now=self.now)
+        db.session.commit()
+        self.assertEqual(self.top_ids(size=1), [first.id])
+
+    def test_incremental_scores_match_direct_sum(self):
+        post = self.posts[0]
+        events = [(1, self.now - 30 * HOUR), (3, self.now - 5 * HOUR), (2, self.now)]
+        for weight, when in events:
+            trending.record({post.id: weight}, now=when)
+        db.session.commit()
+        expected = sum(weight * 2 ** ((when - self.now).total_seconds() / (12 * 3600)) for weight, when in events)
+        score = db.session.get(PostScore, post.id).score
+        self.assertAlmostEqual(2 ** (score - trending.log2_weight(1, self.now)), expected)
+
+    def test_top_skips_unpublished_and_decayed_posts(self):
+        draft = self.add_post('Draft', status='draft')
+        old, recent = self.posts[:2]
+        trending.record_likes({draft.id: 50, recent.id: 1}, now=self.now)
+        trending.record_likes({old.id: 50}, now=self.now - 30 * 24 * HOUR)
+        db.session.commit()
+        self.assertEqual(self.top_ids(), [recent.id])
+
+        self.assertEqual(trending.prune(now=self.now), 1)
+        self.assertIsNone(db.session.get(PostScore, old.id))
+
+    def test_like_flush_updates_scores(self):
+        likes = LikeBuffer(self.app)
+        likes._flusher = object()
+        for post in self.posts[2:5]:
+            for _ in range(post.id):
+                likes.like(post.id)
+        self.assertEqual(likes.flush(), 3)
+        self.assertEqual(self.top_ids(), [post.id for post in reversed(self.posts[2:5])])
+
+    def test_rebuild(self):
+        liked, commented = self.posts[:2]
+        liked.like_count = 4
+        db.session.add_all([Comment(post_id=commented.id, author_id=self.user.id, body='Hi', created=self.now - HOUR)
+                            for _ in range(2)])
+        db.session.commit()
+        self.assertEqual(trending.rebuild(now=self.now), 2)
+        self.assertEqual(self.top_ids(), [commented.id, liked.id])
+        expected = trending.log2_weight(6, self.now - HOUR)
+        self.assertAlmostEqual(db.session.get(PostScore, commented.id).score, expected)
+
+if __name__ == '__main__':
+    unittest.main()
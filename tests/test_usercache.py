@@ -0,0 +1,55 @@
+import unittest
+from flask import Flask
+from dbase import db
+from models import User
+from querycount import count_queries
+from usercache import CachedUser, UserCache
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.users = UserCache(self.app)
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+        db.create_all()
+        user = User(username='testuser', email='test@example.com', password='x', bio='A long bio')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_second_load_skips_the_database(self):
+        with count_queries() as counter:
+            first = self.users.get(self.user_id)
+            second = self.users.get(self.user_id)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second.username, 'testuser')
+        self.assertEqual(second.get_id(), str(self.user_id))
+        self.assertTrue(second.is_authenticated)
+
+    def test_cached_user_is_slim(self):
+        user = self.users.get(self.user_id)
+        self.assertIsInstance(user, CachedUser)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertFalse(hasattr(user, 'bio'))
+
+    def test_invalidate_reloads_changed_user(self):
+        self.users.get(self.user_id)
+        db.session.get(User, self.user_id).username = 'renamed'
+        db.session.commit()
+        self.assertEqual(self.users.get(self.user_id).username, 'testuser')
+        self.users.invalidate(self.user_id)
+        self.assertEqual(self.users.get(self.user_id).username, 'renamed')
+
+    def test_missing_user(self):
+        self.assertIsNone(self.users.get(self.user_id + 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,327 @@
+"""This module exports and imports users, tags, posts and comments in bulk.
+
+'flask export DIRECTORY' streams every table to one newline-delimited
+JSON (or CSV) file per table through a server-side cursor. 'flask import
+DIRECTORY' loads such files into another database in chunks of
+executemany inserts, so memory stays constant whatever the row count.
+
+Imported rows get new ids: the id of each row is shifted past the largest
+id of its table in the target database, and users and tags that already
+exist there (same email, same tag name) are merged into the existing row.
+An imported user whose username is taken by another user of the target
+database is renamed, e.g. 'bob' to 'bob-2', and the rename is reported.
+Foreign keys are rewritten with the same mapping. Progress is saved to a
+checkpoint file after every chunk, and running the same import again
+resumes after the last committed chunk.
+
+Uploaded images are not part of the export, their storage names are kept
+as they are.
+"""
+import csv
+import itertools
+import json
+import os
+from datetime import date, datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Date, DateTime, Integer, func, insert, select, tuple_
+from cache import page_cache
+from dbase import db
+from fulltext import search_index
+from models import Comment, Post, PostTag, Tag, User
+
+CSV_NULL = '\\N'
+CHECKPOINT_NAME = 'import-checkpoint.json'
+
+
+class TableSpec:
+    """How one table is exported and remapped on import"""
+
+    def __init__(self, name, model, natural_key=None, renamed=(), references=None):
+        self.name = name
+        self.model = model
+        self.table = model.__table__
+        # Unique column merging imported rows into existing ones
+        self.natural_key = natural_key
+        # Other unique string columns, suffixed when the value is taken
+        self.renamed = renamed
+        # {column: referenced table name}
+        self.references = references or {}
+
+    @property
+    def has_id(self):
+        return 'id' in self.table.c
+
+
+# In dependency order, referenced tables first
+TABLES = (
+    TableSpec('users', User, natural_key='email', renamed=('username',)),
+    TableSpec('tags', Tag, natural_key='name'),
+    TableSpec('posts', Post, references={'author_id': 'users'}),
+    TableSpec('post_tags', PostTag, references={'post_id': 'posts', 'tag_id': 'tags'}),
+    TableSpec('comments', Comment, references={'post_id': 'posts', 'author_id': 'users'}),
+)
+
+EXTENSIONS = {'ndjson': '.ndjson', 'csv': '.csv'}
+
+
+def table_path(directory, spec, fmt):
+    return os.path.join(directory, spec.name + EXTENSIONS[fmt])
+
+
+def dump_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def column_loader(column):
+    """Returns the function turning an exported value back into a column value"""
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, Date):
+        return date.fromisoformat
+    if isinstance(column.type, Integer):
+        return int
+    return str
+
+
+def write_rows(f, fmt, columns, rows):
+    """Writes row mappings to a file, returns the number of rows"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([CSV_NULL if row[c] is None else dump_value(row[c]) for c in columns])
+            count += 1
+    else:
+        for row in rows:
+            f.write(json.dumps({c: dump_value(row[c]) for c in columns}, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def read_rows(f, fmt):
+    """Yields the rows of an exported file as {column: raw value} dicts"""
+    if fmt == 'csv':
+        reader = csv.reader(f)
+        columns = next(reader, None)
+        for values in reader:
+            yield {c: None if v == CSV_NULL else v for c, v in zip(columns, values)}
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_data(directory, fmt='ndjson', chunk_size=1000):
+    """Writes every table to directory, returns {table name: row count}"""
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    with db.engine.connect() as connection:
+        for spec in TABLES:
+            columns = [column.name for column in spec.table.columns]
+            query = select(spec.table).order_by(*spec.table.primary_key.columns)
+            # yield_per streams the result, with a server-side cursor on MySQL
+            result = connection.execution_options(yield_per=chunk_size).execute(query).mappings()
+            with open(table_path(directory, spec, fmt), 'w', encoding='utf-8', newline='') as f:
+                counts[spec.name] = write_rows(f, fmt, columns, result)
+            result.close()
+    return counts
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    for state in checkpoint.values():
+        state['merged'] = {int(old): new for old, new in state['merged'].items()}
+    return checkpoint
+
+
+def write_checkpoint(path, checkpoint):
+    """Replaces the checkpoint file, so a crash never leaves it half written"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+class Remapper:
+    """Maps the ids of the exported database to ids of the target one"""
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+
+    def __call__(self, table_name, old_id):
+        if old_id is None:
+            return None
+        state = self.checkpoint[table_name]
+        return state['merged'].get(old_id, old_id + state['offset'])
+
+
+def import_table(spec, path, fmt, chunk_size, checkpoint, checkpoint_path):
+    """Imports one exported table, resuming after the rows the checkpoint records as done"""
+    table = spec.table
+    state = checkpoint.get(spec.name)
+    # A table already started may have a committed chunk the checkpoint does not record
+    resuming = state is not None
+    if state is None:
+        offset = db.session.scalar(select(func.max(table.c.id))) if spec.has_id else 0
+        state = checkpoint[spec.name] = {'offset': offset or 0, 'done': 0, 'complete': False, 'merged': {}}
+        write_checkpoint(checkpoint_path, checkpoint)
+    if state['complete']:
+        return 0
+    remap = Remapper(checkpoint)
+    loaders = {column.name: column_loader(column) for column in table.columns}
+    imported = 0
+
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = itertools.islice(read_rows(f, fmt), state['done'], None)
+        for chunk in chunked(rows, chunk_size):
+            values = []
+            for raw in chunk:
+                row = {c: None if v is None else loaders[c](v) for c, v in raw.items() if c in loaders}
+                for column, referenced in spec.references.items():
+                    row[column] = remap(referenced, row[column])
+                values.append(row)
+            if spec.natural_key:
+                values = merge_existing(spec, values, state)
+            if resuming:
+                values = skip_existing(spec, values, remap)
+                resuming = False
+            if spec.renamed:
+                rename_conflicts(spec, values)
+            if spec.has_id:
+                for row in values:
+                    row['id'] = remap(spec.name, row['id'])
+            if values:
+                db.session.execute(insert(table), values)
+            db.session.commit()
+            imported += len(values)
+            state['done'] += len(chunk)
+            write_checkpoint(checkpoint_path, checkpoint)
+
+    state['complete'] = True
+    write_checkpoint(checkpoint_path, checkpoint)
+    return imported
+
+
+def merge_existing(spec, values, state):
+    """Drops the rows whose natural key already exists, mapping their ids to the existing rows"""
+    key = spec.table.c[spec.natural_key]
+    existing = dict(db.session.execute(
+        select(key, spec.table.c.id).where(key.in_([row[spec.natural_key] for row in values]))
+    ).all())
+    kept = []
+    for row in values:
+        existing_id = existing.get(row[spec.natural_key])
+        if existing_id is None:
+            kept.append(row)
+        else:
+            state['merged'][row['id']] = existing_id
+    return kept
+
+
+def rename_conflicts(spec, values):
+    """Suffixes the renamed columns of the rows whose value another row of the target database has"""
+    for name in spec.renamed:
+        column = spec.table.c[name]
+        taken = set(db.session.scalars(select(column).where(column.in_([row[name] for row in values]))))
+        if not taken:
+            continue
+        # Renamed values must not collide with the rest of the chunk either
+        chunk = {row[name] for row in values}
+        for row in values:
+            if row[name] not in taken:
+                continue
+            for n in itertools.count(2):
+                suffix = f'-{n}'
+                candidate = row[name][:column.type.length - len(suffix)] + suffix
+                if candidate not in chunk and db.session.scalar(
+                        select(func.count()).where(column == candidate)) == 0:
+                    break
+            click.echo(f'Renamed {spec.name} {row["id"]} {name} {row[name]!r} to {candidate!r}, '
+                       'it is taken in the target database.', err=True)
+            chunk.add(candidate)
+            row[name] = candidate
+
+
+def skip_existing(spec, values, remap):
+    """Drops the rows already present in the target database"""
+    if not values:
+        return values
+    if spec.has_id:
+        ids = {row['id']: remap(spec.name, row['id']) for row in values}
+        present = set(db.session.scalars(select(spec.table.c.id).where(spec.table.c.id.in_(ids.values()))))
+        return [row for row in values if ids[row['id']] not in present]
+    columns = list(spec.table.primary_key.columns)
+    keys = [tuple(row[c.name] for c in columns) for row in values]
+    present = set(map(tuple, db.session.execute(select(*columns).where(tuple_(*columns).in_(keys))).all()))
+    return [row for row, row_key in zip(values, keys) if row_key not in present]
+
+
+def import_data(directory, fmt='ndjson', chunk_size=1000, checkpoint_path=None):
+    """Imports every exported table in directory, returns {table name: imported rows}"""
+    checkpoint_path = checkpoint_path or os.path.join(directory, CHECKPOINT_NAME)
+    checkpoint = load_checkpoint(checkpoint_path)
+    counts = {}
+    for spec in TABLES:
+        path = table_path(directory, spec, fmt)
+        if not os.path.exists(path):
+            raise click.ClickException(f'{path} is missing.')
+        counts[spec.name] = import_table(spec, path, fmt, chunk_size, checkpoint, checkpoint_path)
+    return counts
+
+
+def init_app(app):
+    """Registers the export and import commands"""
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_command)
+
+
+@click.command('export')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXTENSIONS)), default='ndjson', help='File format.')
+@click.option('--chunk-size', default=1000, help='Rows fetched per round trip.')
+@with_appcontext
+def export_command(directory, fmt, chunk_size):
+    """Export users, tags, posts and comments to DIRECTORY."""
+    counts = export_data(directory, fmt, chunk_size)
+    click.echo(', '.join(f'{count} {table}' for table, count in counts.items()))
+
+
+@click.command('import')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXTENSIONS)), default='ndjson', help='File format.')
+@click.option('--chunk-size', default=1000, help='Rows inserted per transaction.')
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False),
+              help=f'Checkpoint file, {CHECKPOINT_NAME} in DIRECTORY by default.')
+@with_appcontext
+def import_command(directory, fmt, chunk_size, checkpoint_path):
+    """Import an export from DIRECTORY, resuming an interrupted import."""
+    import authorstats
+    import feed
+    import rendering
+    import trending
+    counts = import_data(directory, fmt, chunk_size, checkpoint_path)
+    click.echo(', '.join(f'{count} {table}' for table, count in counts.items()))
+    # Derived data of the imported posts
+    rendering.rerender()
+    click.echo(f'Built {feed.rebuild()} feed entries.')
+    search_index.rebuild()
+    authorstats.rebuild()
+    click.echo(f'Scored {trending.rebuild()} posts.')
+    page_cache.invalidate('feed')
@@ -0,0 +1,157 @@
+"""This module ranks posts by likes and comments decayed over time.
+
+Every like or comment adds its weight to the score of its post, and the
+score halves every TRENDING_HALF_LIFE seconds. Rather than decaying every
+row as time passes, post_scores stores log2 of the score scaled to a fixed
+origin: an event of weight w at time t adds w * 2 ** ((t - ORIGIN) / half
+life), which grows with t instead of shrinking with age. All scores decay
+by the same factor, so their order never changes and only events touch
+rows, each update combining the stored logarithm with the new one.
+Logarithms grow by 730 a year with the default half life, well within
+the precision of a double, so the stored values never need re-normalizing.
+
+The trending list is the first TRENDING_SIZE rows of the score index,
+joined to the feed. The likes flush and the comment view add their
+weights inside their own transactions. 'flask trending-prune', meant to
+run periodically, deletes the rows of posts whose score has decayed below
+a hundredth of a like, and 'flask trending-rebuild' recomputes every
+score from the comments and like counts.
+"""
+import math
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, delete, func, insert, select
+from dbase import db, insert_ignore
+from models import Comment, FeedEntry, Post, PostScore
+
+ORIGIN = datetime(2024, 1, 1)
+# Scores below this many halvings of a single like are dropped
+HORIZON = math.log2(100)
+
+DEFAULTS = {
+    'TRENDING_HALF_LIFE': 12 * 3600,
+    'TRENDING_SIZE': 5,
+    'TRENDING_LIKE_WEIGHT': 1,
+    'TRENDING_COMMENT_WEIGHT': 3,
+}
+
+
+def _setting(name):
+    return current_app.config.get(name, DEFAULTS[name])
+
+
+def log2_weight(weight, when):
+    """Returns the stored form of an event of the given weight at the given time"""
+    return math.log2(weight) + (when - ORIGIN).total_seconds() / _setting('TRENDING_HALF_LIFE')
+
+
+def log2_add(a, b):
+    """Returns log2(2 ** a + 2 ** b) without overflowing"""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def floor(now=None):
+    """Returns the stored score below which a post no longer counts as trending"""
+    return log2_weight(_setting('TRENDING_LIKE_WEIGHT'), now or datetime.now()) - HORIZON
+
+
+def record(weights, now=None):
+    """Adds {post id: weight} to the scores inside the caller's transaction"""
+    weights = {post_id: weight for post_id, weight in weights.items() if weight > 0}
+    if not weights:
+        return
+    now = now or datetime.now()
+    post_ids = sorted(weights)
+    db.session.execute(insert_ignore(PostScore, [{'post_id': post_id} for post_id in post_ids], 'post_id'))
+    # Locked so concurrent flushes and comments combine instead of overwriting each other
+    stored = dict(db.session.execute(
+        select(PostScore.post_id, PostScore.score).where(PostScore.post_id.in_(post_ids)).with_for_update()
+    ).all())
+    scores = PostScore.__table__
+    db.session.execute(
+        scores.update().where(scores.c.post_id == bindparam('b_post_id')).values(score=bindparam('b_score')),
+        [{'b_post_id': post_id, 'b_score': log2_add(stored[post_id], log2_weight(weights[post_id], now))}
+         for post_id in post_ids if post_id in stored]
+    )
+
+
+def record_likes(deltas, now=None):
+    """Adds {post id: number of likes} to the scores inside the caller's transaction"""
+    weight = _setting('TRENDING_LIKE_WEIGHT')
+    record({post_id: delta * weight for post_id, delta in deltas.items()}, now)
+
+
+def record_comment(post_id, now=None):
+    """Adds a comment to the score of a post inside the caller's transaction"""
+    record({post_id: _setting('TRENDING_COMMENT_WEIGHT')}, now)
+
+
+def top(size=None, now=None):
+    """Returns the feed rows of the highest scoring published posts"""
+    return (
+        FeedEntry.query
+        .join(PostScore, PostScore.post_id == FeedEntry.id)
+        .filter(PostScore.score >= floor(now))
+        .order_by(PostScore.score.desc())
+        .limit(size or _setting('TRENDING_SIZE'))
+        .all()
+    )
+
+
+def prune(now=None):
+    """Deletes the scores that have decayed below the trending floor, returns their number"""
+    deleted = db.session.execute(delete(PostScore).where(PostScore.score < floor(now))).rowcount
+    db.session.commit()
+    return deleted
+
+
+def rebuild(now=None, batch_size=500):
+    """Recomputes every score, returns the number of posts scored.
+
+    Comments count at their creation time. Likes have no timestamp, so
+    they count at the creation time of their post.
+    """
+    like_weight = _setting('TRENDING_LIKE_WEIGHT')
+    comment_weight = _setting('TRENDING_COMMENT_WEIGHT')
+    scores = {}
+    rows = db.session.execute(select(Post.id, Post.created, Post.like_count).where(Post.like_count > 0))
+    for post_id, created, like_count in rows:
+        scores[post_id] = log2_weight(like_count * like_weight, created)
+    rows = db.session.execute(select(Comment.post_id, Comment.created).execution_options(yield_per=batch_size))
+    for post_id, created in rows:
+        scores[post_id] = log2_add(scores.get(post_id), log2_weight(comment_weight, created))
+
+    cutoff = floor(now)
+    values = [{'post_id': post_id, 'score': score} for post_id, score in scores.items() if score >= cutoff]
+    db.session.execute(delete(PostScore))
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(PostScore), values[start:start + batch_size])
+    db.session.commit()
+    return len(values)
+
+
+def init_app(app):
+    """Sets the default settings and registers the maintenance commands"""
+    for name, value in DEFAULTS.items():
+        app.config.setdefault(name, value)
+    app.cli.add_command(trending_prune_command)
+    app.cli.add_command(trending_rebuild_command)
+
+
+@click.command('trending-prune')
+@with_appcontext
+def trending_prune_command():
+    """Delete the scores of posts that stopped trending."""
+    click.echo(f'Pruned {prune()} post scores, {db.session.scalar(select(func.count()).select_from(PostScore))} left.')
+
+
+@click.command('trending-rebuild')
+@with_appcontext
+def trending_rebuild_command():
+    """Recompute every post score from the comments and like counts."""
+    click.echo(f'Scored {rebuild()} posts.')
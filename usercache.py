@@ -0,0 +1,105 @@
+"""This module caches the identity of logged in users.
+
+Flask-Login calls the user loader on every authenticated request. Instead
+of loading the full users row each time, the loader returns a slim
+CachedUser holding only the id and username, kept in a per-worker LRU
+with a time to live, or in Redis when USER_CACHE_URL is set so every
+worker shares it. Views that need the rest of the profile load the User
+row themselves, and profile or password changes invalidate the entry.
+"""
+import json
+from sqlalchemy import select
+from cache import MemoryCache
+from dbase import db
+from models import User
+
+
+class CachedUser:
+    """Lightweight stand-in for User exposing what Flask-Login and templates need"""
+    __slots__ = ('id', 'username')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, CachedUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'{self.username}'
+
+
+class RedisUserStore:
+    """User cache entries kept in Redis and shared by every worker"""
+
+    def __init__(self, url, prefix='byteserenity:user:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('USER_CACHE_URL is set but the redis package is not installed')
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        value = self._redis.get(f'{self._prefix}{key}')
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        self._redis.set(f'{self._prefix}{key}', json.dumps(value), ex=timeout or None)
+
+    def delete(self, key):
+        self._redis.delete(f'{self._prefix}{key}')
+
+    def clear(self):
+        for key in self._redis.scan_iter(f'{self._prefix}*'):
+            self._redis.delete(key)
+
+
+class UserCache:
+    """Flask extension mapping user ids to CachedUser objects"""
+
+    def __init__(self, app=None):
+        self._store = MemoryCache()
+        self._timeout = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_URL', None)
+        app.config.setdefault('USER_CACHE_TIMEOUT', 60)
+        app.config.setdefault('USER_CACHE_MAX_ENTRIES', 10000)
+        url = app.config['USER_CACHE_URL']
+        if url:
+            self._store = RedisUserStore(url)
+        else:
+            self._store = MemoryCache(app.config['USER_CACHE_MAX_ENTRIES'])
+        self._timeout = app.config['USER_CACHE_TIMEOUT']
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id):
+        """Returns the CachedUser for an id, or None if the user does not exist"""
+        fields = self._store.get(user_id)
+        if fields is None:
+            row = db.session.execute(select(User.id, User.username).where(User.id == user_id)).first()
+            if row is None:
+                return None
+            fields = [row.id, row.username]
+            self._store.set(user_id, fields, self._timeout)
+        return CachedUser(*fields)
+
+    def invalidate(self, user_id):
+        """Drops a user from the cache after their row changed"""
+        self._store.delete(user_id)
+
+
+user_cache = UserCache()